@@ -17,42 +17,530 @@ def generate_report(portfolio):
     }
     return report
 
+import multiprocessing
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import numpy as np
 import pandas as pd
+from scipy.stats import norm, qmc
+
+try:
+    from .fixed_income import BondBook, curve_points, interpolation_weights, price_bonds
+except ImportError:  # imported as a top-level module (e.g. by streamlit_app)
+    from fixed_income import BondBook, curve_points, interpolation_weights, price_bonds
 
-def simulate_portfolio_paths(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float) -> np.ndarray:
+def _portfolio_values(book, quantities, maturities, curves, budget: int = 4_000_000) -> np.ndarray:
+    # Value the book under each row of curves (n_scenarios, n_tenors of spot rates): every bond's yield is
+    # its curve rate interpolated at maturity, priced in closed form; callables take the worse of maturity and call.
+    # Rows are processed in blocks of about budget prices so memory does not grow with the book size.
+    weights = interpolation_weights(maturities, book.maturity).T
+    callable = np.flatnonzero(book.callable)
+    values = np.empty(len(curves))
+    step = max(1, budget // max(len(book), 1))
+    for start in range(0, len(curves), step):
+        yields = curves[start:start + step] @ weights
+        prices = price_bonds(book.face_value, book.coupon_rate, book.maturity, yields, book.frequency)
+        if len(callable):
+            to_call = price_bonds(book.face_value[callable], book.coupon_rate[callable], book.call_date[callable],
+                                  yields[:, callable], book.frequency[callable])
+            prices[:, callable] = np.minimum(prices[:, callable], to_call)
+        values[start:start + step] = prices @ quantities
+    return values
+
+def iter_portfolio_paths(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float,
+                         chunk_size: int = 100_000):
+    """
+    Generator form of simulate_portfolio_paths: yields the simulated portfolio values block by block
+    (at most chunk_size each), so memory is bounded by the chunk size rather than n_scenarios.
+    Concatenating the blocks gives exactly simulate_portfolio_paths(...) for the same RNG state and chunk_size.
+    The normal draws do not depend on chunk_size; the values do only at the level of float rounding, since
+    the matrix products are blocked differently.
+    """
+    maturities, spot_rates = curve_points(zero_curve_df)
+    book, quantities = portfolio.bond_positions()
+    for start in range(0, n_scenarios, chunk_size):
+        size = min(chunk_size, n_scenarios - start)
+        # Drawn row by row from the global stream, exactly as one normal draw per scenario would be
+        shocks = np.random.normal(loc=0, scale=vol * np.sqrt(dt), size=(size, len(spot_rates)))
+        yield _portfolio_values(book, quantities, maturities, spot_rates * np.exp(shocks))
+
+def simulate_portfolio_paths(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float,
+                             chunk_size: int = 100_000) -> np.ndarray:
     """
     Simulate portfolio values under yield curve scenarios (GBM for each spot rate).
     Args:
         portfolio: Portfolio object with .assets (dict of asset_name: {quantity, ...})
-        zero_curve_df: DataFrame with ['maturity', 'spot_rate']
+        zero_curve_df: DataFrame with ['maturity', 'spot_rate'], or a ZeroCurve
         n_scenarios: number of Monte Carlo scenarios
         vol: annualized volatility (applied to each spot rate, decimal)
         dt: time step (years)
+        chunk_size: scenarios simulated per block (bounds memory; same draws for any value, results equal up to float rounding)
     Returns:
         np.ndarray of simulated portfolio values (shape: [n_scenarios])
     """
-    maturities = zero_curve_df['maturity'].values
-    spot_rates = zero_curve_df['spot_rate'].values
-    n_bonds = len(portfolio.assets)
     portfolio_values = np.zeros(n_scenarios)
-    for i in range(n_scenarios):
-        # Simulate shocked spot rates for each maturity
-        shocks = np.random.normal(loc=0, scale=vol * np.sqrt(dt), size=len(spot_rates))
-        shocked_spots = spot_rates * np.exp(shocks)
-        shocked_curve = pd.DataFrame({'maturity': maturities, 'spot_rate': shocked_spots})
-        # For each bond, reprice using shocked curve (assume asset_name is Bond object)
-        total_value = 0.0
-        for asset_name, asset_info in portfolio.assets.items():
-            bond = asset_name if hasattr(asset_name, 'price') else None
-            if bond is not None:
-                # Interpolate yield for bond maturity
-                y = np.interp(bond.maturity, shocked_curve['maturity'], shocked_curve['spot_rate'])
-                price = bond.price(y)
-                total_value += asset_info['quantity'] * price
-        portfolio_values[i] = total_value
+    start = 0
+    for block in iter_portfolio_paths(portfolio, zero_curve_df, n_scenarios, vol, dt, chunk_size):
+        portfolio_values[start:start + len(block)] = block
+        start += len(block)
     return portfolio_values
 
+def _pool_context():
+    # Forking a multi-threaded caller can deadlock the child; the fork server is single-threaded and reused across runs
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    # Import this module (NumPy, SciPy) once in the server rather than in every worker
+    context.set_forkserver_preload([__name__])
+    return context
+
+# Book, quantities, curve and output buffer of the current parallel run, as seen by a worker process
+_shared_run = None
+
+def _attach_shared_run(name: str, n_bonds: int, n_tenors: int, n_scenarios: int):
+    # Pool initializer: map the shared block once per worker instead of pickling the book with every task
+    global _shared_run
+    block = shared_memory.SharedMemory(name=name)
+    data = np.ndarray(6 * n_bonds + 2 * n_tenors + n_scenarios, dtype=np.float64, buffer=block.buf)
+    terms = data[:6 * n_bonds].reshape(6, n_bonds)
+    book = BondBook(terms[0], terms[1], terms[2], terms[3], call_date=terms[4])
+    curve = data[6 * n_bonds:6 * n_bonds + 2 * n_tenors].reshape(2, n_tenors)
+    _shared_run = (block, book, terms[5], curve[0], curve[1], data[6 * n_bonds + 2 * n_tenors:])
+
+def _simulate_shared_block(start: int, stop: int, seed, vol: float, dt: float, chunk_size: int):
+    # One worker's share of scenarios: its own generator, written straight into the shared output
+    _, book, quantities, maturities, spot_rates, output = _shared_run
+    rng = np.random.default_rng(seed)
+    for begin in range(start, stop, chunk_size):
+        end = min(begin + chunk_size, stop)
+        shocks = rng.normal(loc=0, scale=vol * np.sqrt(dt), size=(end - begin, len(spot_rates)))
+        output[begin:end] = _portfolio_values(book, quantities, maturities, spot_rates * np.exp(shocks))
+
+def simulate_portfolio_paths_parallel(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float,
+                                      seed=None, n_workers: int = None, chunk_size: int = 100_000) -> np.ndarray:
+    """
+    Process-pool version of simulate_portfolio_paths with reproducible random streams.
+    Scenarios are split into n_workers contiguous blocks; block i is drawn from a Generator seeded with the
+    i-th child of SeedSequence(seed), so the same seed and n_workers give the same paths (bit-identical for the
+    same chunk_size too) and the global np.random state is neither read nor advanced. Bond terms, quantities,
+    the curve and the output live in one shared-memory block that each worker maps once when it starts.
+    Workers are started by a fork server (or spawned where there is none), never forked from the caller,
+    so calling this from a multi-threaded process (e.g. a Streamlit server) is safe.
+    Args:
+        seed: int / SeedSequence entropy (None draws fresh entropy)
+        n_workers: number of processes (default: os.cpu_count()); 1 runs in-process
+        chunk_size: scenarios per block within a worker (bounds memory; same draws for any value, results equal up to float rounding)
+    Returns:
+        np.ndarray of simulated portfolio values (shape: [n_scenarios])
+    """
+    global _shared_run
+    n_workers = n_workers or os.cpu_count() or 1
+    maturities, spot_rates = curve_points(zero_curve_df)
+    book, quantities = portfolio.bond_positions()
+    n_bonds, n_tenors = len(book), len(maturities)
+    seeds = np.random.SeedSequence(seed).spawn(n_workers)
+    bounds = np.linspace(0, n_scenarios, n_workers + 1).astype(np.int64)
+    tasks = [(int(bounds[i]), int(bounds[i + 1]), seeds[i], vol, dt, chunk_size) for i in range(n_workers)]
+    block = shared_memory.SharedMemory(create=True, size=max(8, 8 * (6 * n_bonds + 2 * n_tenors + n_scenarios)))
+    try:
+        data = np.ndarray(6 * n_bonds + 2 * n_tenors + n_scenarios, dtype=np.float64, buffer=block.buf)
+        data[:6 * n_bonds] = np.concatenate([book.face_value, book.coupon_rate, book.maturity, book.frequency,
+                                             book.call_date, quantities])
+        data[6 * n_bonds:6 * n_bonds + 2 * n_tenors] = np.concatenate([maturities, spot_rates])
+        initargs = (block.name, n_bonds, n_tenors, n_scenarios)
+        if n_workers == 1:
+            _attach_shared_run(*initargs)
+            try:
+                _simulate_shared_block(*tasks[0])
+            finally:
+                _shared_run[0].close()
+                _shared_run = None
+        else:
+            with ProcessPoolExecutor(n_workers, mp_context=_pool_context(),
+                                     initializer=_attach_shared_run, initargs=initargs) as pool:
+                for done in [pool.submit(_simulate_shared_block, *task) for task in tasks]:
+                    done.result()
+        values = data[6 * n_bonds + 2 * n_tenors:].copy()
+        del data
+    finally:
+        block.close()
+        block.unlink()
+    return values
+
+def key_rate_sensitivities(portfolio, zero_curve_df) -> dict:
+    """
+    Key-rate deltas and gammas of the portfolio's bonds with respect to the curve's knot rates, in the
+    valuation used by simulate_portfolio_paths (each bond priced at its curve rate interpolated at maturity;
+    callables on the worse of maturity and call at the base curve). Computed once, in closed form:
+        'value': portfolio value on the base curve
+        'bond_delta': (n_bonds, n_tenors) per-unit price change per unit move of each knot rate
+        'delta': (n_tenors,) portfolio delta, 'gamma': (n_tenors, n_tenors) portfolio gamma
+        'tenors', 'spot_rates': the curve knots the sensitivities refer to
+    """
+    maturities, spot_rates = curve_points(zero_curve_df)
+    book, quantities = portfolio.bond_positions()
+    weights = interpolation_weights(maturities, book.maturity)
+    yields = weights @ spot_rates
+    measures = book.schedule.measures(yields)
+    callable = np.flatnonzero(book.callable)
+    if len(callable):
+        to_call = book.call_schedule.take(callable).measures(yields[callable])
+        worse = to_call['price'] < measures['price'][callable]
+        for name in measures:
+            measures[name][callable[worse]] = to_call[name][worse]
+    # dP/dy = -modified duration * P and d2P/dy2 = convexity * P, mapped onto the knots through the weights
+    slope = -measures['modified_duration'] * measures['price']
+    curvature = measures['convexity'] * measures['price']
+    return {
+        'value': measures['price'] @ quantities,
+        'bond_delta': slope[:, None] * weights,
+        'delta': weights.T @ (quantities * slope),
+        'gamma': (weights.T * quantities * curvature) @ weights,
+        'tenors': maturities,
+        'spot_rates': spot_rates,
+    }
+
+def delta_gamma_pnl(sensitivities: dict, rate_changes: np.ndarray) -> np.ndarray:
+    """
+    Second-order P&L approximation for a (n_scenarios, n_tenors) matrix of knot rate changes:
+    rate_changes @ delta + 0.5 * diag(rate_changes @ gamma @ rate_changes.T).
+    """
+    rate_changes = np.atleast_2d(rate_changes)
+    return rate_changes @ sensitivities['delta'] + 0.5 * np.einsum('ij,ij->i', rate_changes @ sensitivities['gamma'], rate_changes)
+
+def simulate_portfolio_paths_delta_gamma(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float,
+                                         sensitivities: dict = None, n_check: int = 1000, alpha: float = 0.95,
+                                         chunk_size: int = 100_000):
+    """
+    Fast approximate version of simulate_portfolio_paths: same scenarios (same RNG stream), but each
+    scenario's value is the base value plus the delta-gamma P&L instead of a full repricing.
+    Args:
+        sensitivities: precomputed key_rate_sensitivities(...) (e.g. reused across slider updates)
+        n_check: scenarios, evenly spaced through the run, that are also fully revalued
+        alpha: confidence level for the VaR comparison in the error report
+    Returns:
+        (values, report): np.ndarray of approximate portfolio values (shape: [n_scenarios]) and a dict with
+        the checked scenario count, RMSE and max absolute P&L error, the P&L standard deviation, and the
+        VaR of the checked subset under full and approximate revaluation.
+    """
+    if sensitivities is None:
+        sensitivities = key_rate_sensitivities(portfolio, zero_curve_df)
+    maturities, spot_rates = sensitivities['tenors'], sensitivities['spot_rates']
+    check = np.unique(np.linspace(0, n_scenarios - 1, min(n_check, n_scenarios)).astype(np.int64))
+    values = np.empty(n_scenarios)
+    checked = np.empty((len(check), len(spot_rates)))
+    for start in range(0, n_scenarios, chunk_size):
+        stop = min(start + chunk_size, n_scenarios)
+        # Drawn row by row from the global stream, exactly as simulate_portfolio_paths does
+        shocks = np.random.normal(loc=0, scale=vol * np.sqrt(dt), size=(stop - start, len(spot_rates)))
+        curves = spot_rates * np.exp(shocks)
+        values[start:stop] = sensitivities['value'] + delta_gamma_pnl(sensitivities, curves - spot_rates)
+        inside = (check >= start) & (check < stop)
+        checked[inside] = curves[check[inside] - start]
+    report = {'n_checked': len(check)}
+    if len(check):
+        book, quantities = portfolio.bond_positions()
+        full = _portfolio_values(book, quantities, maturities, checked)
+        error = values[check] - full
+        report.update({
+            'rmse': float(np.sqrt(np.mean(error ** 2))),
+            'max_abs_error': float(np.abs(error).max()),
+            'pnl_std': float(full.std()),
+            'var_full': float(calculate_var(full, alpha)),
+            'var_approx': float(calculate_var(values[check], alpha)),
+        })
+    return values, report
+
+def draw_normals(n: int, dimension: int, sampling: str = 'pseudo', rng=None) -> np.ndarray:
+    """
+    (n, dimension) standard normal draws for Monte Carlo.
+    sampling: 'pseudo' (plain draws), 'antithetic' (second half mirrors the first), or 'sobol' / 'halton'
+        (scrambled quasi-random points mapped through the normal inverse CDF; n a power of two suits Sobol best)
+    rng: numpy Generator / seed for the draws and the scrambling
+    """
+    rng = np.random.default_rng(rng)
+    if sampling == 'pseudo':
+        return rng.standard_normal((n, dimension))
+    if sampling == 'antithetic':
+        half = rng.standard_normal(((n + 1) // 2, dimension))
+        return np.concatenate([half, -half])[:n]
+    if sampling in ('sobol', 'halton'):
+        engine = qmc.Sobol(dimension, scramble=True, seed=rng) if sampling == 'sobol' else qmc.Halton(dimension, scramble=True, seed=rng)
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message='The balance properties of Sobol')
+            points = engine.random(n)
+        return norm.ppf(np.clip(points, 1e-12, 1 - 1e-12))
+    raise ValueError(f"Unknown sampling: {sampling}")
+
+def _control_weights(controls: np.ndarray, means: np.ndarray) -> np.ndarray:
+    # Hesterberg-Nelson control-variate weights: sum to one and reproduce the controls' known means exactly,
+    # w_i = 1/n + (mu - c_bar)' S^-1 (c_i - c_bar) with S the centered cross-product matrix of the controls
+    centered = controls - controls.mean(axis=0)
+    coefficients = np.linalg.lstsq(centered.T @ centered, means - controls.mean(axis=0), rcond=None)[0]
+    return 1 / len(controls) + centered @ coefficients
+
+def weighted_var(portfolio_values: np.ndarray, alpha: float, weights: np.ndarray = None) -> float:
+    """
+    calculate_var for weighted scenarios (e.g. control-variate weights): the weighted mean minus the
+    smallest value whose cumulative weight reaches 1 - alpha. Equal weights give the empirical quantile.
+    Negative weights (control-variate weights can have some) are clipped to zero and the rest renormalized,
+    so the cumulative weight is monotone.
+    """
+    values = np.asarray(portfolio_values, dtype=float)
+    weights = np.full(len(values), 1 / len(values)) if weights is None else np.asarray(weights, dtype=float)
+    if (weights < 0).any():
+        weights = np.clip(weights, 0, None)
+        weights = weights / weights.sum()
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order])
+    cutoff = values[order][min(np.searchsorted(cumulative, 1 - alpha), len(values) - 1)]
+    return float(weights @ values - cutoff)
+
+def simulate_portfolio_paths_vr(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float,
+                                sampling: str = 'sobol', control_variate: str = None, alpha: float = 0.95,
+                                seed=None, sensitivities: dict = None, surrogate_factor: int = 100):
+    """
+    simulate_portfolio_paths with variance reduction: the same model (independent lognormal shocks to each
+    spot rate, full revaluation), with draws from draw_normals(sampling) and an optional control variate
+    whose mean and probability of falling below its own (1 - alpha) quantile are matched with
+    control-variate weights, sharpening both the mean and the tail quantile used by weighted_var.
+    control_variate:
+        'duration': key-rate delta P&L linear in the normal draws, exactly normal with known moments
+        'delta_gamma': delta-gamma P&L of the actual rate changes (closer to the full revaluation); its
+            mean and quantile come from surrogate_factor * n_scenarios cheap delta-gamma-only scenarios
+    Returns:
+        (values, weights): simulated portfolio values (shape: [n_scenarios]) and scenario weights
+        (equal without a control variate), to be used with weighted_var(values, alpha, weights)
+    """
+    rng = np.random.default_rng(seed)
+    maturities, spot_rates = curve_points(zero_curve_df)
+    book, quantities = portfolio.bond_positions()
+    scale = vol * np.sqrt(dt)
+    normals = draw_normals(n_scenarios, len(spot_rates), sampling, rng)
+    values = _portfolio_values(book, quantities, maturities, spot_rates * np.exp(scale * normals))
+    if control_variate is None:
+        return values, np.full(n_scenarios, 1 / n_scenarios)
+    if sensitivities is None:
+        sensitivities = key_rate_sensitivities(portfolio, zero_curve_df)
+    if control_variate == 'duration':
+        loadings = sensitivities['delta'] * spot_rates * scale
+        control = normals @ loadings
+        mean, threshold = 0.0, np.sqrt(loadings @ loadings) * norm.ppf(1 - alpha)
+        tail_probability = 1 - alpha
+    elif control_variate == 'delta_gamma':
+        control = delta_gamma_pnl(sensitivities, spot_rates * np.expm1(scale * normals))
+        surrogate = delta_gamma_pnl(sensitivities, spot_rates * np.expm1(scale * rng.standard_normal((surrogate_factor * n_scenarios, len(spot_rates)))))
+        mean, threshold = surrogate.mean(), np.quantile(surrogate, 1 - alpha)
+        tail_probability = np.mean(surrogate <= threshold)
+    else:
+        raise ValueError(f"Unknown control variate: {control_variate}")
+    controls = np.column_stack([control, control <= threshold])
+    return values, _control_weights(controls, np.array([mean, tail_probability]))
+
+def var_convergence(portfolio, zero_curve_df, vol: float, dt: float, alpha: float = 0.95,
+                    sizes=(256, 512, 1024, 2048, 4096), replicates: int = 16, sampling: str = 'sobol',
+                    control_variate: str = None, seed=None) -> pd.DataFrame:
+    """
+    Convergence report: VaR estimated from independent replicates (fresh pseudo-random streams or
+    re-scrambled quasi-random sequences) at each scenario count.
+    Returns:
+        DataFrame with columns ['n_scenarios', 'var', 'std_error']: the replicate mean and the standard
+        error of a single run of that size (standard deviation across replicates)
+    """
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes) * replicates)
+    sensitivities = key_rate_sensitivities(portfolio, zero_curve_df) if control_variate is not None else None
+    rows = []
+    for k, n in enumerate(sizes):
+        estimates = []
+        for r in range(replicates):
+            values, weights = simulate_portfolio_paths_vr(portfolio, zero_curve_df, n, vol, dt, sampling, control_variate,
+                                                          alpha, seeds[k * replicates + r], sensitivities)
+            estimates.append(weighted_var(values, alpha, weights))
+        rows.append({'n_scenarios': n, 'var': np.mean(estimates), 'std_error': np.std(estimates, ddof=1)})
+    return pd.DataFrame(rows)
+
+def parametric_var(portfolio, zero_curve_df, vol: float, dt: float, alpha: float = 0.95,
+                   covariance: np.ndarray = None, sensitivities: dict = None) -> float:
+    """
+    Variance-covariance (delta-normal) VaR: z_alpha * sqrt(delta' Sigma delta), as a positive loss.
+    Sigma defaults to the knot rate-change covariance of simulate_portfolio_paths to first order,
+    diag((spot_rate * vol * sqrt(dt)) ** 2); pass covariance for correlated tenors.
+    """
+    if sensitivities is None:
+        sensitivities = key_rate_sensitivities(portfolio, zero_curve_df)
+    delta = sensitivities['delta']
+    if covariance is None:
+        covariance = np.diag((sensitivities['spot_rates'] * vol * np.sqrt(dt)) ** 2)
+    return float(norm.ppf(alpha) * np.sqrt(delta @ covariance @ delta))
+
+class StreamingVaR:
+    """
+    Online VaR / Expected Shortfall over portfolio values that arrive in blocks.
+    Keeps a running mean and the exact lowest values seen so far (merged per block with np.partition),
+    sized for n_scenarios: enough for the quantile at the smallest confidence level plus a margin for
+    its confidence interval. Memory is that tail plus one block; once all n_scenarios values are in,
+    var matches calculate_var on the full array.
+    """
+
+    def __init__(self, n_scenarios: int, alphas=(0.95, 0.99)):
+        self.n_scenarios = int(n_scenarios)
+        self.alphas = np.sort(np.atleast_1d(np.asarray(alphas, dtype=float)))
+        q = 1 - self.alphas[0]
+        # np.percentile needs ranks floor(q*(n-1)) and the one above; the margin covers a 4-sigma CI rank
+        self.tail_size = min(self.n_scenarios, int(np.ceil(q * self.n_scenarios + 4 * np.sqrt(self.n_scenarios * q * (1 - q)))) + 2)
+        self.tail = np.empty(0)
+        self.count = 0
+        self.total = 0.0
+
+    def update(self, values) -> 'StreamingVaR':
+        values = np.asarray(values, dtype=float).ravel()
+        if self.count + len(values) > self.n_scenarios:
+            raise ValueError(f"More than n_scenarios={self.n_scenarios} values supplied")
+        self.count += len(values)
+        self.total += values.sum()
+        merged = np.concatenate([self.tail, values])
+        if len(merged) > self.tail_size:
+            merged = np.partition(merged, self.tail_size - 1)[:self.tail_size]
+        self.tail = merged
+        return self
+
+    def estimates(self, confidence: float = 0.95) -> pd.DataFrame:
+        """
+        Current VaR and ES (positive losses against the running mean, as in calculate_var) for every alpha,
+        with distribution-free order-statistic bounds for VaR and asymptotic normal bounds for ES.
+        """
+        n = self.count
+        if n == 0:
+            raise ValueError("No values supplied yet")
+        mean = self.total / n
+        tail = np.sort(self.tail)
+        z = norm.ppf(0.5 + confidence / 2)
+        rows = []
+        for alpha in self.alphas:
+            q = 1 - alpha
+            # Linear interpolation between order statistics, as np.percentile does
+            h = q * (n - 1)
+            lo = int(np.floor(h))
+            hi = min(lo + 1, len(tail) - 1)
+            quantile = tail[lo] + (h - lo) * (tail[hi] - tail[lo])
+            spread = z * np.sqrt(n * q * (1 - q))
+            lower_rank = int(np.clip(np.floor(n * q - spread), 0, len(tail) - 1))
+            upper_rank = int(np.clip(np.ceil(n * q + spread), 0, len(tail) - 1))
+            losses = mean - tail[:max(1, int(np.ceil(n * q)))]
+            var = mean - quantile
+            es = losses.mean()
+            # Asymptotic ES standard error: sqrt((Var(L | L >= VaR) + alpha * (ES - VaR)^2) / (n * q))
+            es_error = np.sqrt((losses.var() + alpha * (es - var) ** 2) / (n * q))
+            rows.append({'alpha': alpha, 'n_scenarios': n, 'var': var,
+                         'var_lower': mean - tail[upper_rank], 'var_upper': mean - tail[lower_rank],
+                         'es': es, 'es_lower': es - z * es_error, 'es_upper': es + z * es_error})
+        return pd.DataFrame(rows).set_index('alpha')
+
+def stream_var(portfolio, zero_curve_df, n_scenarios: int, vol: float, dt: float, alphas=(0.95, 0.99),
+               chunk_size: int = 100_000, confidence: float = 0.95):
+    """
+    Bounded-memory Monte Carlo VaR/ES: simulates blocks with iter_portfolio_paths and yields the running
+    StreamingVaR.estimates(confidence) after every block; the last frame covers all n_scenarios.
+    """
+    estimator = StreamingVaR(n_scenarios, alphas)
+    for block in iter_portfolio_paths(portfolio, zero_curve_df, n_scenarios, vol, dt, chunk_size):
+        yield estimator.update(block).estimates(confidence)
+
+def _remaining_value(model, horizon, rates, times, cash, budget: int = 4_000_000) -> np.ndarray:
+    # Value at the horizon of the payments still ahead (times > horizon) for each short rate, path chunk by chunk
+    alive = times > horizon
+    tau, cash = times[alive] - horizon, cash[alive]
+    values = np.zeros((len(rates),) + cash.shape[1:])
+    chunk = max(1, budget // max(len(tau), 1))
+    for start in range(0, len(rates), chunk):
+        values[start:start + chunk] = model.discount(horizon, tau, rates[start:start + chunk]) @ cash
+    return values
+
+def simulate_term_structure_paths(portfolio, model, horizons, n_paths: int, seed=None,
+                                  include_paid: bool = False) -> np.ndarray:
+    """
+    Evolve the curve along short-rate paths and revalue the portfolio's bonds at every horizon.
+    Args:
+        portfolio: Portfolio object (bonds are taken from portfolio.bond_positions())
+        model: VasicekModel / CIRModel / HullWhiteModel (anything with short_rate, step and discount)
+        horizons: increasing horizon times in years, e.g. [10 / 252, 0.25, 1.0]
+        n_paths: number of simulated paths
+        seed: seed for numpy.random.default_rng (reproducible paths)
+        include_paid: add coupons and redemptions paid up to each horizon (uninvested) to the value
+    Returns:
+        np.ndarray of portfolio values (shape: [n_horizons, n_paths]). At each horizon the bonds roll down:
+        payments already made drop out, and the rest are discounted with the model's curve in each path's state.
+        Paths move between horizons with the models' exact transitions, all paths at once.
+    """
+    horizons = np.asarray(horizons, dtype=float)
+    book, quantities = portfolio.bond_positions()
+    rng = np.random.default_rng(seed)
+    straight = ~book.callable
+    times, cash = book.schedule.take(straight).cash_flow_matrix()
+    book_cash = cash @ quantities[straight]
+    callable = np.flatnonzero(book.callable)
+    if len(callable):
+        call_times, call_cash = book.call_schedule.take(callable).cash_flow_matrix()
+        maturity_times, maturity_cash = book.schedule.take(callable).cash_flow_matrix()
+        call_cash, maturity_cash = call_cash.toarray(), maturity_cash.toarray()
+    values = np.empty((len(horizons), n_paths))
+    rates = np.full(n_paths, float(model.short_rate))
+    now = 0.0
+    for k, horizon in enumerate(horizons):
+        if horizon > now:
+            rates = model.step(now, horizon - now, rates, rng)
+            now = horizon
+        values[k] = _remaining_value(model, horizon, rates, times, book_cash)
+        if include_paid:
+            values[k] += book_cash[times <= horizon].sum()
+        if len(callable):
+            # Worst of maturity and call for bonds whose call date is still ahead
+            prices = _remaining_value(model, horizon, rates, maturity_times, maturity_cash)
+            to_call = _remaining_value(model, horizon, rates, call_times, call_cash)
+            open_call = book.call_date[callable] > horizon
+            prices[:, open_call] = np.minimum(prices[:, open_call], to_call[:, open_call])
+            values[k] += prices @ quantities[callable]
+            if include_paid:
+                values[k] += maturity_cash[maturity_times <= horizon].sum(axis=0) @ quantities[callable]
+    return values
+
+def var_term_structure(values: np.ndarray, horizons, alphas=(0.95, 0.99)) -> pd.DataFrame:
+    """
+    VaR and Expected Shortfall per horizon from a (n_horizons, n_paths) value matrix, as risk_measures
+    computes them (losses measured from each horizon's mean value, as in calculate_var). Returns a DataFrame
+    indexed by horizon with columns var_<alpha> and es_<alpha> (alpha in percent).
+    """
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    pnl = values - values.mean(axis=1, keepdims=True)
+    measures = np.stack([risk_measures(row, alphas).to_numpy() for row in pnl])
+    result = pd.DataFrame(index=pd.Index(np.asarray(horizons, dtype=float), name='horizon'))
+    for k, alpha in enumerate(alphas):
+        result[f'var_{alpha * 100:g}'] = measures[:, k, 0]
+        result[f'es_{alpha * 100:g}'] = measures[:, k, 1]
+    return result
+
+def scenario_pnl(portfolio, zero_curve_df, shocks, by_position: bool = False) -> np.ndarray:
+    """
+    Revalue the portfolio's bonds under a whole library of curve scenarios in one vectorized pass.
+    Args:
+        portfolio: Portfolio object (bonds are taken from portfolio.bond_positions())
+        zero_curve_df: DataFrame with ['maturity', 'spot_rate'], or a ZeroCurve
+        shocks: (n_scenarios, n_knots) zero-rate moves (decimal) at the curve's knots, e.g. built with
+            parallel_shocks / steepener_shocks / twist_shocks / butterfly_shocks / key_rate_shocks
+        by_position: return the (n_scenarios, n_positions) P&L matrix instead of the portfolio total
+    Returns:
+        np.ndarray of P&L against the unshocked curve (shape: [n_scenarios] or [n_scenarios, n_positions])
+    """
+    book, quantities = portfolio.bond_positions()
+    shocks = np.atleast_2d(np.asarray(shocks, dtype=float))
+    base = np.zeros((1, shocks.shape[1]))
+    if by_position:
+        return (book.scenario_prices(zero_curve_df, shocks) - book.scenario_prices(zero_curve_df, base)) * quantities
+    return book.scenario_values(zero_curve_df, shocks, quantities) - book.scenario_values(zero_curve_df, base, quantities)
+
 def calculate_var(portfolio_values: np.ndarray, alpha: float) -> float:
     """
     Calculate Value-at-Risk (VaR) at confidence level alpha (e.g. 0.95 or 0.99).
@@ -60,4 +548,199 @@ def calculate_var(portfolio_values: np.ndarray, alpha: float) -> float:
     """
     pnl = portfolio_values - np.mean(portfolio_values)
     var = -np.percentile(pnl, 100 * (1 - alpha))
-    return var
\ No newline at end of file
+    return var
+
+
+def _tail_ranks(n: int, alphas: np.ndarray):
+    # Order statistics behind VaR (np.percentile's linear interpolation between ranks lo and hi) and
+    # ES (the count of worst outcomes) for each alpha, plus the sorted set of ranks to select
+    h = (1 - alphas) * (n - 1)
+    lo = np.floor(h).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    counts = np.maximum(1, np.ceil(n * (1 - alphas))).astype(np.int64)
+    return lo, hi, h - lo, counts, np.unique(np.concatenate([lo, hi, counts - 1]))
+
+def _tail_sums(values: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    # Sums of the first counts[k] rows of values (the partitioned tail), accumulated segment by segment
+    order = np.argsort(counts)
+    sums = np.empty((len(counts),) + values.shape[1:])
+    running, done = np.zeros(values.shape[1:]), 0
+    for k in order:
+        running = running + values[done:counts[k]].sum(axis=0)
+        done = counts[k]
+        sums[k] = running
+    return sums
+
+def risk_measures(pnl, alphas=(0.95, 0.99)) -> pd.DataFrame:
+    """
+    VaR and Expected Shortfall (positive losses) at several confidence levels from one partial selection.
+    Args:
+        pnl: P&L vector, or a (n_scenarios, n_positions) P&L matrix (its row sums are used)
+        alphas: confidence levels, e.g. (0.95, 0.975, 0.99)
+    Returns:
+        DataFrame indexed by alpha with columns ['var', 'es']; var matches -np.percentile(pnl, 100 * (1 - alpha))
+        and es is minus the mean of the ceil(n * (1 - alpha)) worst outcomes.
+    """
+    pnl = np.asarray(pnl, dtype=float)
+    if pnl.ndim == 2:
+        pnl = pnl.sum(axis=1)
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    lo, hi, weight, counts, ranks = _tail_ranks(len(pnl), alphas)
+    selected = np.partition(pnl, ranks)
+    var = -(selected[lo] * (1 - weight) + selected[hi] * weight)
+    es = -_tail_sums(selected, counts) / counts
+    return pd.DataFrame({'var': var, 'es': es}, index=pd.Index(alphas, name='alpha'))
+
+def _attribution(total: np.ndarray, tail_pnl, alphas, exposures=None, groups=None) -> dict:
+    # Euler (scenario-based) risk attribution: one argpartition of the total P&L, then the position P&L of
+    # only the selected tail scenarios, fetched with tail_pnl(rows) -> (len(rows), n_positions)
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    lo, hi, weight, counts, ranks = _tail_ranks(len(total), alphas)
+    order = np.argpartition(total, ranks)
+    rows = order[:counts.max()]
+    tail = tail_pnl(np.concatenate([rows, order[lo], order[hi]]))
+    at_lo, at_hi = tail[len(rows):len(rows) + len(alphas)], tail[len(rows) + len(alphas):]
+    columns = pd.Index(alphas, name='alpha')
+    result = {
+        'summary': risk_measures(total, alphas),
+        # Contributions at the VaR quantile scenario(s) and averaged over the ES tail; both sum to the totals
+        'component_var': pd.DataFrame(-(at_lo * (1 - weight[:, None]) + at_hi * weight[:, None]).T, columns=columns),
+        'component_es': pd.DataFrame((-_tail_sums(tail[:len(rows)], counts) / counts[:, None]).T, columns=columns),
+    }
+    if exposures is not None:
+        exposures = np.asarray(exposures, dtype=float)
+        for name in ('var', 'es'):
+            result[f'marginal_{name}'] = result[f'component_{name}'].div(exposures, axis=0)
+    if groups is not None:
+        codes, labels = pd.factorize(np.asarray(groups))
+        for name in ('var', 'es'):
+            component = result[f'component_{name}'].to_numpy()
+            by_group = np.column_stack([np.bincount(codes, weights=component[:, k], minlength=len(labels)) for k in range(len(alphas))])
+            result[f'group_component_{name}'] = pd.DataFrame(by_group, index=pd.Index(labels, name='group'), columns=columns)
+            if exposures is not None:
+                group_exposure = np.bincount(codes, weights=exposures, minlength=len(labels))
+                result[f'group_marginal_{name}'] = result[f'group_component_{name}'].div(group_exposure, axis=0)
+    return result
+
+def risk_attribution(pnl: np.ndarray, alphas=(0.95, 0.99), exposures=None, groups=None) -> dict:
+    """
+    VaR/ES at several alphas plus component and marginal VaR/ES per position and per group (e.g. sector)
+    from a (n_scenarios, n_positions) P&L matrix and a single selection on its row sums.
+    Args:
+        exposures: position market values; marginal measures are component / exposure (risk per unit of value)
+        groups: label per position (e.g. sector); components are summed per label
+    Returns:
+        dict of DataFrames: 'summary' (risk_measures of the total), 'component_var' and 'component_es'
+        (positions x alphas, summing to the totals), and when requested 'marginal_var', 'marginal_es',
+        'group_component_var', 'group_component_es', 'group_marginal_var', 'group_marginal_es'.
+    """
+    pnl = np.asarray(pnl, dtype=float)
+    return _attribution(pnl.sum(axis=1), lambda rows: pnl[rows], alphas, exposures, groups)
+
+def scenario_risk(portfolio, zero_curve_df, shocks, alphas=(0.95, 0.99), groups=None) -> dict:
+    """
+    risk_attribution for a scenario library (see scenario_pnl) without building the full position matrix:
+    the portfolio P&L comes from the aggregated pass, and positions are repriced only in the tail scenarios.
+    Exposures are the positions' market values on the unshocked curve.
+    """
+    book, quantities = portfolio.bond_positions()
+    shocks = np.atleast_2d(np.asarray(shocks, dtype=float))
+    base = book.scenario_prices(zero_curve_df, np.zeros((1, shocks.shape[1])))[0]
+    total = book.scenario_values(zero_curve_df, shocks, quantities) - base @ quantities
+    tail_pnl = lambda rows: (book.scenario_prices(zero_curve_df, shocks[rows]) - base) * quantities
+    return _attribution(total, tail_pnl, alphas, base * quantities, groups)
+
+class HistoricalVaR:
+    """
+    Historical-simulation VaR: every observed daily change of a stored curve history, applied to today's
+    curve and book, is one scenario. The history is held as a dense dates x tenors array; the window's
+    scenarios are repriced in one batch (BondBook.scenario_values), and append() rolls the window forward
+    by repricing only the new day into the slot of the oldest one (a ring buffer).
+    Args:
+        portfolio: Portfolio object (bonds are taken from portfolio.bond_positions())
+        zero_curve_df: today's curve (DataFrame with ['maturity', 'spot_rate'], or a ZeroCurve)
+        history: DataFrame indexed by date with one column per tenor in years (zero rates, decimal), or a
+            (n_dates, n_tenors) array together with tenors (and optionally dates)
+        window: number of daily changes in the rolling window, at least 1 (default: the whole history)
+    """
+
+    def __init__(self, portfolio, zero_curve_df, history, tenors=None, dates=None, window: int = None):
+        if isinstance(history, pd.DataFrame):
+            history = history.sort_index().ffill().dropna()
+            tenors = history.columns.astype(float).to_numpy() if tenors is None else tenors
+            dates = history.index.to_numpy() if dates is None else dates
+            history = history.to_numpy(dtype=float)
+        history = np.asarray(history, dtype=float)
+        if np.isnan(history).any():
+            raise ValueError("Curve history contains missing values.")
+        if len(history) < 2:
+            raise ValueError("Curve history needs at least two dates.")
+        self.tenors = np.asarray(tenors, dtype=float)
+        changes = np.diff(history, axis=0)
+        dates = np.arange(len(history)) if dates is None else np.asarray(dates)
+        self.window = len(changes) if window is None else int(window)
+        if self.window < 1:
+            raise ValueError("window must be at least 1.")
+        changes, dates = changes[-self.window:], dates[1:][-self.window:]
+        self.count = len(changes)
+        self.changes = np.zeros((self.window, len(self.tenors)))
+        self.changes[:self.count] = changes
+        self.dates = np.empty(self.window, dtype=dates.dtype)
+        self.dates[:self.count] = dates
+        # Slot the next appended day goes to: the oldest one once the window is full
+        self.next = self.count % self.window
+        self.last_curve = history[-1]
+        self.rebase(portfolio, zero_curve_df)
+
+    def _pnl(self, changes) -> np.ndarray:
+        # Knot shocks of today's curve: each day's tenor changes interpolated onto the curve's maturities
+        return self.book.scenario_values(self.zero_curve, changes @ self.mapping, self.quantities) - self.value
+
+    def rebase(self, portfolio=None, zero_curve_df=None) -> 'HistoricalVaR':
+        """
+        Revalue the whole window against a new book and/or curve (one batch over all stored days).
+        """
+        if portfolio is not None:
+            self.book, self.quantities = portfolio.bond_positions()
+        if zero_curve_df is not None:
+            self.zero_curve = zero_curve_df
+            maturities, _ = curve_points(zero_curve_df)
+            self.mapping = interpolation_weights(self.tenors, maturities).T
+        self.value = self.book.scenario_values(self.zero_curve, np.zeros((1, self.mapping.shape[1])), self.quantities)[0]
+        self.pnl = np.zeros(self.window)
+        self.pnl[:self.count] = self._pnl(self.changes[:self.count])
+        return self
+
+    def append(self, curve, date=None) -> 'HistoricalVaR':
+        """
+        Add a new day's curve (zero rates at self.tenors): its change from the previous day becomes the newest
+        scenario, replacing the oldest one when the window is full. Only that one scenario is repriced.
+        date defaults to the next day number for an undated history and is required otherwise.
+        """
+        curve = np.asarray(curve, dtype=float)
+        slot = self.next
+        if date is None:
+            if self.dates.dtype.kind not in 'iu':
+                raise ValueError("append() needs the new curve's date for a dated history.")
+            date = self.dates[slot - 1] + 1
+        change = curve - self.last_curve
+        self.changes[slot] = change
+        self.dates[slot] = date
+        self.pnl[slot] = self._pnl(change[None, :])[0]
+        self.next = (slot + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.last_curve = curve
+        return self
+
+    def scenario_pnl(self) -> pd.Series:
+        """
+        Window P&L per historical day, oldest first.
+        """
+        order = (np.arange(self.count) + (self.next if self.count == self.window else 0)) % self.window
+        return pd.Series(self.pnl[order], index=pd.Index(self.dates[order], name='date'), name='pnl')
+
+    def risk(self, alphas=(0.95, 0.99)) -> pd.DataFrame:
+        """
+        VaR and ES over the current window (see risk_measures).
+        """
+        return risk_measures(self.pnl[:self.count], alphas)
@@ -0,0 +1,175 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from .fixed_income import BondBook, BondView
+except ImportError:  # imported as a top-level module (e.g. by streamlit_app)
+    from fixed_income import BondBook, BondView
+
+
+class ComplianceEngine:
+    '''
+    Diversification limits over a BondBook: no position above position_limit and no sector above sector_limit
+    of the book's market value (quantity * price), except for exempt sectors. Exposures are kept per book row
+    and per sector and updated in O(1) per trade (apply, or subscribe it to a TradeLedger), so pre-trade checks
+    are O(1) and a full scan is a few vectorized passes. Bonds without a sector label are only subject to the
+    position limit.
+    '''
+
+    def __init__(self, book: BondBook, quantities, prices=None, position_limit: float = 0.05, sector_limit: float = 0.20,
+                 exempt_sectors=('real estate',)):
+        self.book = book
+        self.quantity = np.array(quantities, dtype=float)
+        self.price = np.array(book.price if prices is None else prices, dtype=float)
+        self.position_limit = position_limit
+        self.sector_limit = sector_limit
+        # Sectors are matched case-insensitively
+        codes, labels = pd.factorize(pd.Series(book.sector).str.strip().str.lower())
+        self.sector_code = codes.astype(np.int64)
+        self.sectors = np.asarray(labels, dtype=str)
+        self.set_exempt(exempt_sectors)
+        self.reprice(self.price)
+
+    @classmethod
+    def from_portfolio(cls, portfolio, book: BondBook, **limits) -> 'ComplianceEngine':
+        '''
+        Engine for the portfolio's holdings of book (BondView keys from that book).
+        '''
+        if not all(isinstance(asset, BondView) and asset.book is book for asset in portfolio.keys):
+            raise ValueError("Portfolio holds instruments that are not in the book.")
+        quantities = np.zeros(len(book))
+        rows = np.fromiter((asset.row for asset in portfolio.keys), dtype=np.int64, count=len(portfolio))
+        quantities[rows] = portfolio.quantity
+        return cls(book, quantities, **limits)
+
+    def set_exempt(self, exempt_sectors):
+        exempt = {sector.strip().lower() for sector in exempt_sectors}
+        self.exempt_sectors = tuple(sorted(exempt))
+        self.sector_exempt = np.isin(self.sectors, list(exempt))
+        self.position_exempt = self.sector_exempt[self.sector_code]
+        # Unlabeled bonds are not a sector of their own
+        self.sector_exempt |= self.sectors == ''
+
+    def reprice(self, prices):
+        '''
+        Revalue every exposure at new prices (one bincount). Raises ValueError unless every price is positive
+        and finite, since weights and cure quantities are undefined otherwise.
+        '''
+        prices = np.asarray(prices, dtype=float)
+        if prices.shape != self.quantity.shape:
+            raise ValueError("Need one price per bond in the book.")
+        if not (np.isfinite(prices) & (prices > 0)).all():
+            raise ValueError("Prices must be positive and finite.")
+        self.price = prices
+        self.exposure = self.quantity * self.price
+        self.sector_exposure = np.bincount(self.sector_code, weights=self.exposure, minlength=len(self.sectors))
+        self.total = float(self.exposure.sum())
+
+    def _row(self, asset) -> int:
+        if isinstance(asset, BondView):
+            if asset.book is not self.book:
+                raise ValueError("Bond is not in this book.")
+            return asset.row
+        return int(asset)
+
+    def apply(self, asset, quantity_change: float):
+        '''
+        Update exposures for a trade of quantity_change units of a bond (BondView or book row). O(1).
+        '''
+        row = self._row(asset)
+        notional = quantity_change * self.price[row]
+        self.quantity[row] += quantity_change
+        self.exposure[row] += notional
+        self.sector_exposure[self.sector_code[row]] += notional
+        self.total += notional
+
+    def check(self, asset, quantity_change: float) -> list:
+        '''
+        Breaches a trade would cause in its own position and sector, as dicts of level, key, weight and limit
+        (empty if the trade is compliant). O(1). A sale also raises every other weight slightly; scan()
+        covers those knock-on effects.
+        '''
+        row = self._row(asset)
+        notional = quantity_change * self.price[row]
+        total = self.total + notional
+        if total <= 0:
+            return []
+        breaches = []
+        code = self.sector_code[row]
+        weight = (self.exposure[row] + notional) / total
+        if not self.position_exempt[row] and weight > self.position_limit:
+            breaches.append({'level': 'position', 'key': int(self.book.id[row]), 'weight': weight, 'limit': self.position_limit})
+        weight = (self.sector_exposure[code] + notional) / total
+        if not self.sector_exempt[code] and weight > self.sector_limit:
+            breaches.append({'level': 'sector', 'key': self.sectors[code], 'weight': weight, 'limit': self.sector_limit})
+        return breaches
+
+    def max_quantity(self, asset) -> float:
+        '''
+        Most units of a bond that can be bought without breaching its position or sector limit
+        (buying x of notional keeps E + x <= L * (T + x), i.e. x <= (L*T - E) / (1 - L)). O(1).
+        '''
+        row = self._row(asset)
+        room = np.inf
+        if not self.position_exempt[row]:
+            room = min(room, (self.position_limit * self.total - self.exposure[row]) / (1 - self.position_limit))
+        code = self.sector_code[row]
+        if not self.sector_exempt[code]:
+            room = min(room, (self.sector_limit * self.total - self.sector_exposure[code]) / (1 - self.sector_limit))
+        return max(np.floor(room / self.price[row]), 0.0) if np.isfinite(room) else np.inf
+
+    def weights(self) -> np.ndarray:
+        return self.exposure / self.total if self.total else np.zeros_like(self.exposure)
+
+    def sector_weights(self) -> pd.Series:
+        weights = self.sector_exposure / self.total if self.total else np.zeros_like(self.sector_exposure)
+        return pd.Series(weights, index=pd.Index(self.sectors, name='sector'), name='weight')
+
+    def scan(self) -> pd.DataFrame:
+        '''
+        Every current violation with the sale that cures it on its own: selling x of notional from an exposure E
+        (proceeds leave the book) cures it once (E - x) / (T - x) <= L, i.e. x >= (E - L*T) / (1 - L).
+        Positions also get the whole number of units to sell; sector cures are notional (see cure_orders).
+        '''
+        position_excess = (self.exposure - self.position_limit * self.total) / (1 - self.position_limit)
+        rows = np.flatnonzero((position_excess > 1e-9 * max(self.total, 1.0)) & ~self.position_exempt)
+        sector_excess = (self.sector_exposure - self.sector_limit * self.total) / (1 - self.sector_limit)
+        codes = np.flatnonzero((sector_excess > 1e-9 * max(self.total, 1.0)) & ~self.sector_exempt)
+        total = self.total if self.total else np.nan
+        positions = pd.DataFrame({
+            'level': 'position', 'key': self.book.id[rows].astype(object), 'sector': self.sectors[self.sector_code[rows]],
+            'weight': self.exposure[rows] / total, 'limit': self.position_limit, 'exposure': self.exposure[rows],
+            'cure_notional': position_excess[rows],
+            'cure_quantity': np.minimum(np.ceil(position_excess[rows] / self.price[rows]), self.quantity[rows]),
+        })
+        sectors = pd.DataFrame({
+            'level': 'sector', 'key': self.sectors[codes].astype(object), 'sector': self.sectors[codes],
+            'weight': self.sector_exposure[codes] / total, 'limit': self.sector_limit, 'exposure': self.sector_exposure[codes],
+            'cure_notional': sector_excess[codes], 'cure_quantity': np.nan,
+        })
+        return pd.concat([frame for frame in (positions, sectors) if len(frame)] or [positions], ignore_index=True)
+
+    def cure_orders(self) -> pd.DataFrame:
+        '''
+        Sales (book row, bond id, units) that cure every violation: first each position is cut to its limit,
+        then each still-breaching sector sells its cure notional pro rata to the remaining holdings, rounded up.
+        Each cure is sized against the book as it stands, so when many names are cut at once the smaller book
+        can leave residual breaches; apply the orders and scan() again.
+        '''
+        position_excess = np.where(self.position_exempt, 0.0,
+                                   (self.exposure - self.position_limit * self.total) / (1 - self.position_limit))
+        sell = np.minimum(np.ceil(np.maximum(position_excess, 0.0) / self.price), self.quantity)
+        sell[~np.isfinite(sell)] = 0.0
+        exposure = self.exposure - sell * self.price
+        total = exposure.sum()
+        sector_exposure = np.bincount(self.sector_code, weights=exposure, minlength=len(self.sectors))
+        sector_excess = np.where(self.sector_exempt, 0.0, (sector_exposure - self.sector_limit * total) / (1 - self.sector_limit))
+        sector_excess = np.maximum(sector_excess, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(sector_exposure[self.sector_code] > 0, exposure / sector_exposure[self.sector_code], 0.0)
+            extra = np.ceil(sector_excess[self.sector_code] * share / self.price)
+        extra[~np.isfinite(extra)] = 0.0
+        sell = np.minimum(sell + extra, self.quantity)
+        rows = np.flatnonzero(sell > 0)
+        return pd.DataFrame({'row': rows, 'id': self.book.id[rows], 'sector': self.sectors[self.sector_code[rows]],
+                             'quantity': sell[rows], 'notional': sell[rows] * self.price[rows]})
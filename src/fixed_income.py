@@ -1,11 +1,32 @@
 import math
-from typing import List
+from functools import cached_property
 
 import pandas as pd
 import numpy as np
 import pandas as pd
-from scipy.interpolate import CubicSpline
-import matplotlib.pyplot as plt
+from scipy import sparse
+from scipy.interpolate import CubicSpline, PPoly
+
+
+def price_bonds(face_value, coupon_rate, maturity, yield_rate, frequency=1) -> np.ndarray:
+    '''
+    Vectorized version of price_bond: prices many bonds and/or many yields in one call.
+    All arguments are NumPy-broadcast against each other, so bond terms of shape (n_bonds, 1)
+    and yields of shape (n_scenarios,) give an (n_bonds, n_scenarios) price matrix.
+    Uses the closed-form annuity formula instead of discounting each coupon separately.
+    '''
+    face_value = np.asarray(face_value, dtype=float)
+    coupon_rate = np.asarray(coupon_rate, dtype=float)
+    yield_rate = np.asarray(yield_rate, dtype=float)
+    frequency = np.asarray(frequency, dtype=float)
+    # Same truncation as int(maturity * frequency) in the scalar version
+    n_periods = np.trunc(np.asarray(maturity, dtype=float) * frequency)
+    r = yield_rate / frequency
+    discount = (1 + r) ** -n_periods
+    # PV of 1 per period for n_periods; the limit at r == 0 is simply n_periods
+    with np.errstate(divide='ignore', invalid='ignore'):
+        annuity = np.where(r == 0, n_periods, (1 - discount) / r)
+    return face_value * (coupon_rate / frequency * annuity + discount)
 
 
 def price_bond(face_value: float, coupon_rate: float, maturity: float, yield_rate: float, frequency: int = 1) -> float:
@@ -17,16 +38,420 @@ def price_bond(face_value: float, coupon_rate: float, maturity: float, yield_rat
     yield_rate: annual yield to maturity (as decimal)
     frequency: number of coupon payments per year (1=annual, 2=semi-annual)
     '''
-    # Calculate the coupon payment per period
+    return float(price_bonds(face_value, coupon_rate, maturity, yield_rate, frequency))
+
+
+def _price_and_slope(coupon, redemption, n_periods, frequency, yield_rate):
+    # Closed-form price and dP/dy of n_periods coupons plus a redemption amount at the last period
+    r = yield_rate / frequency
+    discount = (1 + r) ** -n_periods
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        annuity = np.where(r == 0, n_periods, (1 - discount) / r)
+        annuity_slope = np.where(r == 0, -n_periods * (n_periods + 1) / 2,
+                                 (n_periods * discount / (1 + r) - annuity) / r)
+    price = coupon * annuity + redemption * discount
+    slope = (coupon * annuity_slope - redemption * n_periods * discount / (1 + r)) / frequency
+    return price, slope
+
+
+def yield_to_maturity(price, face_value, coupon_rate, maturity, frequency=1, redemption=None,
+                      tol: float = 1e-10, max_iter: int = 50, bracket=(-0.5, 1.0)) -> pd.DataFrame:
+    '''
+    Solve price -> yield for many bonds at once (same conventions as price_bonds).
+    Runs max_iter vectorized Newton steps on all bonds together, then a fixed number of bisection
+    steps inside bracket for any bond Newton did not converge on.
+    redemption: amount repaid at the last period (defaults to face_value; use the call price for yield-to-call)
+    Returns a DataFrame with one row per bond: 'yield', 'converged', 'iterations' (Newton steps used,
+    or max_iter plus bisection steps), 'bisection' (True if the fallback was needed) and 'error'
+    (absolute price error at the returned yield).
+    '''
+    price, face_value, coupon_rate, maturity, frequency = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (price, face_value, coupon_rate, maturity, frequency)))
+    redemption = face_value if redemption is None else np.broadcast_to(np.asarray(redemption, dtype=float), price.shape)
     coupon = face_value * coupon_rate / frequency
-    n_periods = int(maturity * frequency)
-    pv = 0.0
-    for t in range(1, n_periods + 1):
-        # Discount each coupon payment to present value
-        pv += coupon / (1 + yield_rate / frequency) ** t
-    # Discount the face value to present value
-    pv += face_value / (1 + yield_rate / frequency) ** n_periods
-    return pv
+    n_periods = np.trunc(maturity * frequency)
+    lower, upper = bracket
+
+    # Start from the usual approximate yield: (annual coupon + pull to redemption) / average price
+    years = np.maximum(n_periods / frequency, 1 / frequency)
+    y = np.clip((coupon * frequency + (redemption - price) / years) / ((redemption + price) / 2), lower, upper)
+    iterations = np.zeros(price.shape, dtype=np.int64)
+    active = np.ones(price.shape, dtype=bool)
+    for _ in range(max_iter):
+        model, slope = _price_and_slope(coupon[active], redemption[active], n_periods[active], frequency[active], y[active])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = (model - price[active]) / slope
+        y[active] = np.clip(y[active] - np.nan_to_num(step), lower, upper)
+        iterations[active] += 1
+        done = np.abs(step) <= tol
+        active[np.flatnonzero(active)[done]] = False
+        if not active.any():
+            break
+
+    # Bracketed bisection fallback for whatever Newton left unconverged; price falls as the yield rises
+    failed = active
+    converged = ~failed
+    if failed.any():
+        args = (coupon[failed], redemption[failed], n_periods[failed], frequency[failed])
+        lo = np.full(failed.sum(), float(lower))
+        hi = np.full(failed.sum(), float(upper))
+        target = price[failed]
+        bracketed = (_price_and_slope(*args, lo)[0] >= target) & (_price_and_slope(*args, hi)[0] <= target)
+        bisection_steps = int(np.ceil(np.log2((upper - lower) / tol)))
+        for _ in range(bisection_steps):
+            mid = (lo + hi) / 2
+            too_cheap = _price_and_slope(*args, mid)[0] > target
+            lo = np.where(too_cheap, mid, lo)
+            hi = np.where(too_cheap, hi, mid)
+        y[failed] = (lo + hi) / 2
+        iterations[failed] = max_iter + bisection_steps
+        converged[failed] = bracketed
+
+    error = np.abs(_price_and_slope(coupon, redemption, n_periods, frequency, y)[0] - price)
+    return pd.DataFrame({
+        'yield': np.where(converged, y, np.nan),
+        'converged': converged,
+        'iterations': iterations,
+        'bisection': failed,
+        'error': error,
+    })
+
+
+def yield_to_worst(price, face_value, coupon_rate, maturity, frequency=1, call_dates=None, call_prices=None,
+                   **solver_options) -> pd.DataFrame:
+    '''
+    Yield-to-worst for many bonds at once: the lowest of the yield to maturity and the yields to
+    every call date. All candidates are solved in a single yield_to_maturity call.
+    call_dates: (n_bonds, n_calls) array of call dates in years, NaN-padded (NaN row = not callable)
+    call_prices: call prices of the same shape (defaults to face value)
+    Returns a DataFrame with 'yield_to_maturity', 'yield_to_worst', 'worst_date' (maturity if no call
+    is worse) and 'converged' (all candidates converged). A bond with any unconverged candidate gets
+    NaN yield_to_worst and worst_date, since the minimum over the others could overstate its yield.
+    '''
+    price, face_value, coupon_rate, maturity, frequency = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (price, face_value, coupon_rate, maturity, frequency)))
+    n_bonds = len(price)
+    call_dates = np.empty((n_bonds, 0)) if call_dates is None else np.asarray(call_dates, dtype=float).reshape(n_bonds, -1)
+    call_prices = face_value[:, None] if call_prices is None else np.asarray(call_prices, dtype=float).reshape(n_bonds, -1)
+    # Column 0 is the maturity, the rest the call dates
+    dates = np.column_stack([maturity, call_dates])
+    redemption = np.column_stack([face_value, np.broadcast_to(call_prices, call_dates.shape)])
+    valid = ~np.isnan(dates)
+    rows = np.nonzero(valid)[0]
+    solved = yield_to_maturity(price[rows], face_value[rows], coupon_rate[rows], dates[valid], frequency[rows],
+                               redemption=redemption[valid], **solver_options)
+    yields = np.full(dates.shape, np.inf)
+    yields[valid] = solved['yield'].to_numpy()
+    converged = np.ones(dates.shape, dtype=bool)
+    converged[valid] = solved['converged'].to_numpy()
+    yields = np.where(np.isnan(yields), np.inf, yields)
+    worst = np.argmin(yields, axis=1)
+    ytw = yields[np.arange(n_bonds), worst]
+    all_converged = converged.all(axis=1)
+    return pd.DataFrame({
+        'yield_to_maturity': np.where(converged[:, 0], yields[:, 0], np.nan),
+        'yield_to_worst': np.where(all_converged & np.isfinite(ytw), ytw, np.nan),
+        'worst_date': np.where(all_converged, dates[np.arange(n_bonds), worst], np.nan),
+        'converged': all_converged,
+    })
+
+
+class ZeroCurve:
+    '''
+    Immutable zero curve: a cubic spline through annually compounded zero rates at the knot maturities.
+    The fitted spline is kept, so discount(), zero() and forward() are vectorized lookups; rates are held
+    flat beyond the first and last knots. Curves compare and hash by content (knots and spline coefficients),
+    so results computed from a curve can be memoized on it.
+    '''
+    __slots__ = ('maturity', 'spot_rate', 'coefficients', '_spline', '_hash')
+
+    def __init__(self, maturity, spot_rate):
+        maturity = np.array(maturity, dtype=np.float64).reshape(-1)
+        spot_rate = np.array(spot_rate, dtype=np.float64).reshape(-1)
+        order = np.argsort(maturity, kind='stable')
+        maturity, spot_rate = maturity[order], spot_rate[order]
+        # A single knot is a flat curve
+        spline = CubicSpline(maturity, spot_rate) if len(maturity) > 1 else None
+        coefficients = spline.c.copy() if spline is not None else spot_rate.reshape(1, 1).copy()
+        for name, value in (('maturity', maturity), ('spot_rate', spot_rate), ('coefficients', coefficients)):
+            value.flags.writeable = False
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_spline', spline)
+        object.__setattr__(self, '_hash', hash((maturity.tobytes(), coefficients.tobytes())))
+
+    @classmethod
+    def from_frame(cls, zero_curve_df: pd.DataFrame) -> 'ZeroCurve':
+        '''
+        Build a curve from a DataFrame with ['maturity', 'spot_rate'] (rows without a spot rate are skipped).
+        '''
+        curve = zero_curve_df.dropna(subset=['spot_rate'])
+        return cls(curve['maturity'].to_numpy(dtype=float), curve['spot_rate'].to_numpy(dtype=float))
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({'maturity': self.maturity, 'spot_rate': self.spot_rate})
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ZeroCurve is immutable")
+
+    def __getstate__(self):
+        # Knots, rates and coefficients (not the constructor arguments), so patched() curves round-trip exactly
+        return self.maturity, self.spot_rate, self.coefficients
+
+    def __setstate__(self, state):
+        maturity, spot_rate, coefficients = (np.array(value, dtype=np.float64) for value in state)
+        for name, value in (('maturity', maturity), ('spot_rate', spot_rate), ('coefficients', coefficients)):
+            value.flags.writeable = False
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, '_spline', PPoly(coefficients, maturity) if len(maturity) > 1 else None)
+        object.__setattr__(self, '_hash', hash((maturity.tobytes(), coefficients.tobytes())))
+
+    def __eq__(self, other):
+        return (isinstance(other, ZeroCurve) and np.array_equal(self.maturity, other.maturity)
+                and np.array_equal(self.coefficients, other.coefficients))
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return f"ZeroCurve({len(self.maturity)} knots, {self.maturity[0]:g}y-{self.maturity[-1]:g}y)"
+
+    def zero(self, t) -> np.ndarray:
+        '''
+        Annually compounded zero rate(s) at time(s) t.
+        '''
+        t = np.clip(np.asarray(t, dtype=float), self.maturity[0], self.maturity[-1])
+        if self._spline is None:
+            return np.full(t.shape, self.spot_rate[0])
+        return self._spline(t)
+
+    def discount(self, t) -> np.ndarray:
+        '''
+        Discount factor(s) (1 + z(t))^-t at time(s) t.
+        '''
+        t = np.asarray(t, dtype=float)
+        return (1 + self.zero(t)) ** -t
+
+    def forward(self, t1, t2) -> np.ndarray:
+        '''
+        Annually compounded forward rate(s) between t1 and t2 (broadcast against each other).
+        '''
+        t1, t2 = np.asarray(t1, dtype=float), np.asarray(t2, dtype=float)
+        return (self.discount(t1) / self.discount(t2)) ** (1 / (t2 - t1)) - 1
+
+    def patched(self, spot_rate, start: int) -> 'ZeroCurve':
+        '''
+        Curve with the same knots and new rates from knot `start` on, without a full refit:
+        spline pieces left of knot start - 1 are kept and the rest is refitted with its slope at that
+        knot clamped to the current spline's, so the curve stays smooth (C1) across the join.
+        '''
+        spot_rate = np.asarray(spot_rate, dtype=np.float64)
+        join = start - 1
+        if self._spline is None or join < 0:
+            return ZeroCurve(self.maturity, spot_rate)
+        tail = CubicSpline(self.maturity[join:], spot_rate[join:],
+                           bc_type=((1, float(self._spline(self.maturity[join], 1))), 'not-a-knot'))
+        curve = object.__new__(ZeroCurve)
+        spline = PPoly(np.hstack([self._spline.c[:, :join], tail.c]), self.maturity)
+        coefficients = spline.c.copy()
+        for name, value in (('maturity', self.maturity), ('spot_rate', spot_rate.copy()), ('coefficients', coefficients)):
+            value.flags.writeable = False
+            object.__setattr__(curve, name, value)
+        object.__setattr__(curve, '_spline', spline)
+        object.__setattr__(curve, '_hash', hash((self.maturity.tobytes(), coefficients.tobytes())))
+        return curve
+
+    def shifted(self, shift) -> 'ZeroCurve':
+        '''
+        Curve with every knot rate moved by shift (decimal; scalar or one per knot).
+        '''
+        return ZeroCurve(self.maturity, self.spot_rate + shift)
+
+
+def curve_points(zero_curve):
+    '''
+    Return (maturities, spot_rates) knot arrays of a ZeroCurve or a zero curve DataFrame
+    (['maturity', 'spot_rate'], rows without a spot rate skipped).
+    '''
+    if isinstance(zero_curve, ZeroCurve):
+        return zero_curve.maturity, zero_curve.spot_rate
+    curve = zero_curve.dropna(subset=['spot_rate'])
+    return curve['maturity'].to_numpy(dtype=float), curve['spot_rate'].to_numpy(dtype=float)
+
+
+def _zero_rates(zero_curve, times) -> np.ndarray:
+    # Annually compounded zero rates at the given times: the spline for a ZeroCurve,
+    # linear interpolation (flat beyond the ends) for a DataFrame
+    if isinstance(zero_curve, ZeroCurve):
+        return zero_curve.zero(times)
+    maturities, spot_rates = curve_points(zero_curve)
+    return np.interp(times, maturities, spot_rates)
+
+
+def _shift_curve(zero_curve, shift):
+    # Parallel shift of a ZeroCurve or zero curve DataFrame, keeping its type
+    if isinstance(zero_curve, ZeroCurve):
+        return zero_curve.shifted(shift)
+    return zero_curve.assign(spot_rate=zero_curve['spot_rate'] + shift)
+
+
+def interpolation_weights(tenors, times) -> np.ndarray:
+    '''
+    (n_times, n_tenors) weights W with W @ y == np.interp(times, tenors, y) for any knot values y,
+    so many curves on the same knots interpolate to fixed dates in one matrix product.
+    '''
+    return np.column_stack([np.interp(times, tenors, unit) for unit in np.eye(len(tenors))])
+
+
+def _scenario_discount(zero_curve, shocks, times, budget: int = 4_000_000):
+    # Yield (scenario slice, discount factors at times) chunk by chunk: base zero rates plus each
+    # scenario's knot shocks interpolated linearly onto the times; chunks hold ~budget floats
+    tenors, _ = curve_points(zero_curve)
+    base = _zero_rates(zero_curve, times)
+    weights = interpolation_weights(tenors, times).T
+    chunk = max(1, budget // max(len(times), 1))
+    for start in range(0, len(shocks), chunk):
+        rows = slice(start, min(start + chunk, len(shocks)))
+        yield rows, (1 + base + shocks[rows] @ weights) ** -times
+
+
+class CashFlowSchedule:
+    '''
+    Immutable coupon schedule for one bond or a whole book.
+    Rows are bonds and columns are payment periods, padded with zero amounts so the book fits in one
+    rectangular array: periods holds the period number k used as discount exponent, times the payment
+    time in years (k / frequency) and amounts the cash paid (coupon, plus face value in the last period).
+    Follows price_bond's convention of int(maturity * frequency) whole periods.
+    Built once and reused for every reprice, since only the discount rates change between calls.
+    '''
+    __slots__ = ('frequency', 'n_periods', 'periods', 'times', 'amounts')
+
+    def __init__(self, face_value, coupon_rate, maturity, frequency=1):
+        face_value, coupon_rate, maturity, frequency = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in (face_value, coupon_rate, maturity, frequency)))
+        n_periods = np.trunc(maturity * frequency).astype(np.int64)
+        width = max(int(n_periods.max(initial=0)), 1)
+        periods = np.broadcast_to(np.arange(1, width + 1, dtype=np.int64), (len(n_periods), width)).copy()
+        amounts = np.where(periods <= n_periods[:, None], (face_value * coupon_rate / frequency)[:, None], 0.0)
+        rows = np.arange(len(n_periods))
+        # Face value is repaid with the last coupon; a bond with no whole period left repays it at period 0
+        periods[n_periods == 0, 0] = 0
+        amounts[rows, np.maximum(n_periods - 1, 0)] += face_value
+        times = periods / frequency[:, None]
+        for name, value in (('frequency', frequency.copy()), ('n_periods', n_periods), ('periods', periods),
+                            ('times', times), ('amounts', amounts)):
+            value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CashFlowSchedule is immutable")
+
+    def __getstate__(self):
+        # The arrays themselves, so take() subsets round-trip too
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            value = np.array(value)
+            value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    def __len__(self):
+        return len(self.n_periods)
+
+    def _discount(self, yield_rate) -> np.ndarray:
+        # (1 + y/f)^-k for every payment, for a scalar yield or one yield per bond
+        base = 1 + np.asarray(yield_rate, dtype=float) / self.frequency
+        return base.reshape(-1, 1) ** -self.periods
+
+    def index_ratios(self, cpi) -> np.ndarray:
+        '''
+        CPI index ratios cpi[k] / cpi[0] aligned with periods, for inflation-linked (TIPS) pricing.
+        cpi: CPI path indexed by payment period, either shared by all bonds (1-D) or one row per bond;
+        the last value is carried forward past the end of the path.
+        Compute this once per CPI path and pass it to price() for every real-yield scenario.
+        '''
+        cpi = np.asarray(cpi, dtype=float)
+        if cpi.ndim == 1:
+            return cpi[np.minimum(self.periods, len(cpi) - 1)] / cpi[0]
+        cpi = np.broadcast_to(cpi, (len(self), cpi.shape[1]))
+        return np.take_along_axis(cpi, np.minimum(self.periods, cpi.shape[1] - 1), axis=1) / cpi[:, :1]
+
+    def price(self, yield_rate, index_ratios=None) -> np.ndarray:
+        '''
+        Present value of every bond at the given yield(s): scalar, (n_bonds,) or (n_bonds, n_scenarios).
+        With index_ratios (see index_ratios()) every payment is inflation-adjusted and yield_rate is the real yield.
+        '''
+        amounts = self.amounts if index_ratios is None else self.amounts * index_ratios
+        if np.ndim(yield_rate) <= 1:
+            return np.einsum('nw,nw->n', amounts, self._discount(yield_rate))
+        # Scenario yields: accumulate one payment column at a time to keep memory at n_bonds x n_scenarios
+        base = 1 + np.asarray(yield_rate, dtype=float) / self.frequency[:, None]
+        pv = np.zeros(base.shape)
+        for j in range(self.periods.shape[1]):
+            pv += amounts[:, j, None] * base ** -self.periods[:, j, None]
+        return pv
+
+    def measures(self, yield_rate) -> dict:
+        '''
+        Price, Macaulay duration, modified duration, convexity and DV01 of every bond at the given yield(s)
+        (scalar or one per bond), all from a single pass over the schedule.
+        '''
+        pv = self.amounts * self._discount(yield_rate)
+        price = pv.sum(axis=1)
+        growth = 1 + np.asarray(yield_rate, dtype=float) / self.frequency
+        with np.errstate(divide='ignore', invalid='ignore'):
+            macaulay = (self.times * pv).sum(axis=1) / price
+            convexity = (self.times * (self.times + 1 / self.frequency[:, None]) * pv).sum(axis=1) / (price * growth ** 2)
+        modified = macaulay / growth
+        return {
+            'price': price,
+            'macaulay_duration': macaulay,
+            'modified_duration': modified,
+            'convexity': convexity,
+            'dv01': modified * price * 1e-4,
+        }
+
+    def curve_measures(self, zero_curve_df) -> dict:
+        '''
+        Same measures as measures(), but discounting each payment on the zero curve
+        (a ZeroCurve, or a DataFrame with ['maturity', 'spot_rate'] interpolated linearly; annual compounding). Durations and convexity are with respect to a
+        parallel shift of the zero rates and come from closed-form derivatives, not bump-and-reprice.
+        '''
+        z = _zero_rates(zero_curve_df, self.times)
+        pv = self.amounts * (1 + z) ** -self.times
+        price = pv.sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            macaulay = (self.times * pv).sum(axis=1) / price
+            modified = (self.times * pv / (1 + z)).sum(axis=1) / price
+            convexity = (self.times * (self.times + 1) * pv / (1 + z) ** 2).sum(axis=1) / price
+        return {
+            'price': price,
+            'macaulay_duration': macaulay,
+            'modified_duration': modified,
+            'convexity': convexity,
+            'dv01': modified * price * 1e-4,
+        }
+
+    def cash_flow_matrix(self):
+        '''
+        Payments aggregated by distinct payment time: returns (times, amounts) where amounts is a
+        sparse (n_times, n_bonds) matrix, so discount factors at those times price the book in one product.
+        '''
+        paid = self.amounts != 0
+        bonds = np.broadcast_to(np.arange(len(self))[:, None], self.amounts.shape)[paid]
+        times, index = np.unique(self.times[paid], return_inverse=True)
+        return times, sparse.csr_matrix((self.amounts[paid], (index, bonds)), shape=(len(times), len(self)))
+
+    def take(self, rows) -> 'CashFlowSchedule':
+        '''
+        Return the schedule of a subset of bonds without rebuilding it.
+        '''
+        subset = object.__new__(CashFlowSchedule)
+        for name in self.__slots__:
+            value = getattr(self, name)[rows]
+            value.flags.writeable = False
+            object.__setattr__(subset, name, value)
+        return subset
 
 
 class Bond:
@@ -49,88 +474,701 @@ class Bond:
         self.call_date = call_date
         self.cpi_series = cpi_series
 
+    @cached_property
+    def schedule(self) -> CashFlowSchedule:
+        '''
+        Cash-flow schedule to maturity, built on first use and reused afterwards
+        (the bond's terms are treated as fixed from then on).
+        '''
+        return CashFlowSchedule(self.face_value, self.coupon_rate, self.maturity, self.frequency)
+
+    @cached_property
+    def call_schedule(self) -> CashFlowSchedule:
+        '''
+        Cash-flow schedule to the call date (callable bonds only), cached like schedule.
+        '''
+        return CashFlowSchedule(self.face_value, self.coupon_rate, self.call_date, self.frequency)
+
+    @cached_property
+    def index_ratios(self) -> np.ndarray:
+        '''
+        CPI index ratios aligned with the schedule (TIPS only), converted from cpi_series once.
+        cpi_series is read by position: element k is the CPI at payment period k.
+        '''
+        return self.schedule.index_ratios(np.asarray(self.cpi_series, dtype=float))
+
+    def _worst_schedule(self, yield_rate: float) -> CashFlowSchedule:
+        # Schedule giving the lowest price at this yield: maturity, or the call date for callables
+        if self.callable and self.call_date is not None and self.call_schedule.price(yield_rate)[0] < self.schedule.price(yield_rate)[0]:
+            return self.call_schedule
+        return self.schedule
+
+    def duration(self, yield_rate: float) -> float:
+        '''
+        Modified duration at the given yield (to the worst of maturity and call date for callables).
+        '''
+        return float(self._worst_schedule(yield_rate).measures(yield_rate)['modified_duration'][0])
+
+    def convexity(self, yield_rate: float) -> float:
+        '''
+        Convexity at the given yield (to the worst of maturity and call date for callables).
+        '''
+        return float(self._worst_schedule(yield_rate).measures(yield_rate)['convexity'][0])
+
+    def dv01(self, yield_rate: float) -> float:
+        '''
+        Price change for a 1bp fall in yield (to the worst of maturity and call date for callables).
+        '''
+        return float(self._worst_schedule(yield_rate).measures(yield_rate)['dv01'][0])
+
     def price(self, yield_rate: float, real_yield: float = None) -> float:
         '''
         Return the present value of the bond for a given yield.
         For callable: price at worst yield (maturity or call date).
         For TIPS: use real_yield and inflation-adjusted principal/coupons.
         '''
-        # TIPS logic
+        # TIPS logic: inflation-adjusted payments discounted at the real yield
         if self.cpi_series is not None and real_yield is not None:
-            # Assume cpi_series index is payment period (int), value is CPI
-            n_periods = int(self.maturity * self.frequency)
-            base_cpi = self.cpi_series.iloc[0]
-            pv = 0.0
-            for t in range(1, n_periods + 1):
-                # Adjust principal for inflation
-                cpi_t = self.cpi_series.iloc[min(t, len(self.cpi_series)-1)]
-                inflated_principal = self.face_value * (cpi_t / base_cpi)
-                coupon = inflated_principal * self.coupon_rate / self.frequency
-                pv += coupon / (1 + real_yield / self.frequency) ** t
-            # Final principal payment
-            cpi_T = self.cpi_series.iloc[min(n_periods, len(self.cpi_series)-1)]
-            inflated_principal = self.face_value * (cpi_T / base_cpi)
-            pv += inflated_principal / (1 + real_yield / self.frequency) ** n_periods
-            return pv
+            return float(self.schedule.price(real_yield, self.index_ratios)[0])
         # Callable logic
         if self.callable and self.call_date is not None:
             # Price to maturity and to call date, return worst (lowest) price
-            price_maturity = price_bond(self.face_value, self.coupon_rate, self.maturity, yield_rate, self.frequency)
-            price_call = price_bond(self.face_value, self.coupon_rate, self.call_date, yield_rate, self.frequency)
-            return min(price_maturity, price_call)
+            price_maturity = self.schedule.price(yield_rate)[0]
+            price_call = self.call_schedule.price(yield_rate)[0]
+            return float(min(price_maturity, price_call))
         # Vanilla bond
-        return price_bond(self.face_value, self.coupon_rate, self.maturity, yield_rate, self.frequency)
-
-
-def bootstrap_yield_curve(bond_list: List[Bond]) -> pd.DataFrame:
-    '''
-    Given a list of Bond objects with known market prices, returns a DataFrame with columns ['maturity', 'spot_rate', 'interpolated_spot_rate'].
-    Assumes annual coupon bonds and that bond.face_value, bond.coupon_rate, bond.maturity, and bond.price(yield) are available.
-    '''
-    # Sort bonds by maturity
-    bond_list = sorted(bond_list, key=lambda b: b.maturity)
-    maturities = []
-    spot_rates = []
-    prices = []
-    for bond in bond_list:
-        maturities.append(bond.maturity)
-        prices.append(bond.price)
-
-    # Bootstrapping: solve for spot rates iteratively
-    for i, bond in enumerate(bond_list):
-        C = bond.face_value * bond.coupon_rate  # annual coupon
-        F = bond.face_value
-        P = bond.price
-        n = int(bond.maturity)
-        if n == 1:
-            # Zero-coupon: P = F/(1+z1)^1 => z1 = F/P - 1
-            z = (F / P) - 1
-            spot_rates.append(z)
+        return float(self.schedule.price(yield_rate)[0])
+
+
+def _column_property(name: str, dtype=float):
+    # Read one row of a BondBook column as a Python scalar
+    return property(lambda self: dtype(getattr(self.book, name)[self.row]))
+
+
+class BondView:
+    '''
+    Lightweight view of one row of a BondBook.
+    Exposes the same attributes and price() method as Bond without copying the row out of the book.
+    The market price lives in market_price, so price() stays the pricing method.
+    '''
+    __slots__ = ('book', 'row', '_hash')
+
+    face_value = _column_property('face_value')
+    coupon_rate = _column_property('coupon_rate')
+    maturity = _column_property('maturity')
+    frequency = _column_property('frequency', int)
+    call_date = _column_property('call_date')
+    market_price = _column_property('price')
+    id = _column_property('id', int)
+    sector = _column_property('sector', str)
+    cpi_series = None
+
+    def __init__(self, book: 'BondBook', row: int):
+        self.book = book
+        self.row = row
+        # Views are dict keys in portfolios and ledgers, so hash once
+        self._hash = hash((id(book), row))
+
+    @property
+    def callable(self) -> bool:
+        return not np.isnan(self.book.call_date[self.row])
+
+    def price(self, yield_rate: float, real_yield: float = None) -> float:
+        '''
+        Return the present value of the bond for a given yield (worst of maturity and call date for callables).
+        '''
+        pv = price_bond(self.face_value, self.coupon_rate, self.maturity, yield_rate, self.frequency)
+        if self.callable:
+            pv = min(pv, price_bond(self.face_value, self.coupon_rate, self.call_date, yield_rate, self.frequency))
+        return pv
+
+    def to_bond(self) -> Bond:
+        '''
+        Return a standalone Bond with the same terms.
+        '''
+        return Bond(self.face_value, self.coupon_rate, self.maturity, self.frequency,
+                    callable=self.callable, call_date=self.call_date if self.callable else None)
+
+    def __eq__(self, other):
+        return isinstance(other, BondView) and other.book is self.book and other.row == self.row
+
+    def __hash__(self):
+        return self._hash
+
+    def __repr__(self):
+        return (f"BondView(id={self.id}, face_value={self.face_value}, coupon_rate={self.coupon_rate}, "
+                f"maturity={self.maturity}, frequency={self.frequency})")
+
+
+class BondBook:
+    '''
+    Columnar (struct-of-arrays) container for a book of bonds.
+    Every column is a contiguous NumPy array with one entry per bond, so bulk analytics work on whole
+    columns instead of lists of Bond objects. call_date is NaN for non-callable bonds, price holds
+    the market price (NaN if unknown) and sector a label ('' if unknown). Indexing returns a BondView for the row.
+    Cash-flow schedules are cached on first use, so treat the term columns as fixed afterwards.
+    '''
+    columns = ('face_value', 'coupon_rate', 'maturity', 'frequency', 'call_date', 'price')
+
+    def __init__(self, face_value, coupon_rate, maturity, frequency=1, call_date=np.nan, price=np.nan, ids=None, sector=''):
+        n = np.size(maturity)
+        self.maturity = np.ascontiguousarray(maturity, dtype=np.float64).reshape(n)
+        self.face_value = np.array(np.broadcast_to(np.asarray(face_value, dtype=np.float64), n))
+        self.coupon_rate = np.array(np.broadcast_to(np.asarray(coupon_rate, dtype=np.float64), n))
+        self.frequency = np.array(np.broadcast_to(np.asarray(frequency, dtype=np.float64), n))
+        self.call_date = np.array(np.broadcast_to(np.asarray(call_date, dtype=np.float64), n))
+        self.price = np.array(np.broadcast_to(np.asarray(price, dtype=np.float64), n))
+        self.id = np.arange(n, dtype=np.int64) if ids is None else np.ascontiguousarray(ids, dtype=np.int64).reshape(n)
+        self.sector = np.array(np.broadcast_to(np.asarray(sector, dtype=str), n))
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, face_value: float = 100.0, frequency: int = 1) -> 'BondBook':
+        '''
+        Build a book straight from DataFrame columns (no row iteration).
+        Requires 'maturity' and 'coupon_rate'; 'face_value', 'frequency', 'call_date', 'price', 'id' and 'sector'
+        are used when present, otherwise face_value/frequency default to the arguments and ids to 0..n-1.
+        '''
+        def column(name, default):
+            return df[name].to_numpy(dtype=np.float64, na_value=np.nan) if name in df.columns else default
+        return cls(
+            face_value=column('face_value', face_value),
+            coupon_rate=df['coupon_rate'].to_numpy(dtype=np.float64),
+            maturity=df['maturity'].to_numpy(dtype=np.float64),
+            frequency=column('frequency', frequency),
+            call_date=column('call_date', np.nan),
+            price=column('price', np.nan),
+            ids=df['id'].to_numpy() if 'id' in df.columns else None,
+            sector=df['sector'].fillna('').to_numpy(dtype=str) if 'sector' in df.columns else '',
+        )
+
+    @cached_property
+    def schedule(self) -> CashFlowSchedule:
+        '''
+        Cash-flow schedule to maturity for every bond, built on first use.
+        '''
+        return CashFlowSchedule(self.face_value, self.coupon_rate, self.maturity, self.frequency)
+
+    @cached_property
+    def call_schedule(self) -> CashFlowSchedule:
+        '''
+        Cash-flow schedule to the call date for every bond (to maturity for non-callable bonds).
+        '''
+        return CashFlowSchedule(self.face_value, self.coupon_rate, np.where(self.callable, self.call_date, self.maturity), self.frequency)
+
+    def curve_measures(self, zero_curve_df) -> dict:
+        '''
+        Per-bond price, durations, convexity and DV01 (per unit) against a zero curve.
+        Callable bonds use whichever of the maturity and call schedules gives the lower price.
+        '''
+        measures = self.schedule.curve_measures(zero_curve_df)
+        if self.callable.any():
+            to_call = self.call_schedule.curve_measures(zero_curve_df)
+            worst = self.callable & (to_call['price'] < measures['price'])
+            measures = {name: np.where(worst, to_call[name], value) for name, value in measures.items()}
+        return measures
+
+    def scenario_prices(self, zero_curve, shocks) -> np.ndarray:
+        '''
+        Price every bond under every curve scenario: shocks is an (n_scenarios, n_knots) matrix of zero-rate
+        moves (decimal) at the curve's knots (see apply_shocks), interpolated linearly onto payment dates.
+        Returns an (n_scenarios, n_bonds) price matrix; callables take the worse of maturity and call.
+        '''
+        shocks = np.atleast_2d(np.asarray(shocks, dtype=float))
+        prices = np.empty((len(shocks), len(self)))
+        times, cash = self.schedule.cash_flow_matrix()
+        for rows, discount in _scenario_discount(zero_curve, shocks, times):
+            prices[rows] = (cash.T @ discount.T).T
+        callable = np.flatnonzero(self.callable)
+        if len(callable):
+            times, cash = self.call_schedule.take(callable).cash_flow_matrix()
+            for rows, discount in _scenario_discount(zero_curve, shocks, times):
+                prices[rows, callable] = np.minimum(prices[rows, callable], (cash.T @ discount.T).T)
+        return prices
+
+    def scenario_values(self, zero_curve, shocks, quantities) -> np.ndarray:
+        '''
+        Value of the book (quantities per bond) under every scenario, as scenario_prices(...) @ quantities
+        but without materializing per-bond prices for non-callable bonds: their cash flows are first
+        aggregated by payment date, so each scenario costs one product over the distinct dates.
+        '''
+        shocks = np.atleast_2d(np.asarray(shocks, dtype=float))
+        quantities = np.asarray(quantities, dtype=float)
+        straight = ~self.callable
+        times, cash = self.schedule.take(straight).cash_flow_matrix()
+        book_cash = cash @ quantities[straight]
+        values = np.empty(len(shocks))
+        for rows, discount in _scenario_discount(zero_curve, shocks, times):
+            values[rows] = discount @ book_cash
+        if not straight.all():
+            values += self.take(~straight).scenario_prices(zero_curve, shocks) @ quantities[~straight]
+        return values
+
+    @classmethod
+    def from_bonds(cls, bonds) -> 'BondBook':
+        '''
+        Build a book from Bond-like objects. Views that all come from the same book are gathered
+        from it by row instead of reading their attributes one by one.
+        '''
+        bonds = list(bonds)
+        if bonds and all(isinstance(b, BondView) for b in bonds):
+            book = bonds[0].book
+            if all(b.book is book for b in bonds):
+                return book.take(np.fromiter((b.row for b in bonds), dtype=np.int64, count=len(bonds)))
+        return cls(
+            face_value=[b.face_value for b in bonds],
+            coupon_rate=[b.coupon_rate for b in bonds],
+            maturity=[b.maturity for b in bonds],
+            frequency=[b.frequency for b in bonds],
+            call_date=[b.call_date if b.callable and b.call_date is not None else np.nan for b in bonds],
+            price=[getattr(b, 'market_price', np.nan) for b in bonds],
+            sector=[getattr(b, 'sector', '') or '' for b in bonds],
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({name: getattr(self, name) for name in ('id',) + self.columns + ('sector',)})
+
+    @property
+    def callable(self) -> np.ndarray:
+        return ~np.isnan(self.call_date)
+
+    def take(self, rows) -> 'BondBook':
+        '''
+        Return a new book holding the given rows (integer indices or boolean mask).
+        '''
+        return BondBook(self.face_value[rows], self.coupon_rate[rows], self.maturity[rows], self.frequency[rows],
+                        self.call_date[rows], self.price[rows], self.id[rows], self.sector[rows])
+
+    def __len__(self):
+        return len(self.maturity)
+
+    def __getitem__(self, row: int) -> BondView:
+        n = len(self)
+        if not -n <= row < n:
+            raise IndexError("BondBook index out of range")
+        return BondView(self, row % n)
+
+    def __iter__(self):
+        return (BondView(self, row) for row in range(len(self)))
+
+    def __repr__(self):
+        return f"BondBook({len(self)} bonds)"
+
+
+class ShortRateLattice:
+    '''
+    Black-Derman-Toy binomial short-rate tree calibrated to a zero curve, for pricing callable bonds.
+    The rate over step i in the state with j up-moves is level[i] * exp(2 * volatility * sqrt(dt) * j),
+    simply compounded over the step, with up/down probability 1/2; each level[i] is solved so the tree
+    reprices the curve's discount factor to the end of the step exactly.
+    Calibrate once for the longest maturity and reuse for every bond in a book: backward induction runs
+    over all bonds together, one tree level at a time.
+    zero_curve_df: ZeroCurve or DataFrame with ['maturity', 'spot_rate'] (annual compounding)
+    horizon: years the tree must cover (at least the longest maturity to be priced)
+    steps_per_year: tree steps per year; coupon dates are rounded to the nearest step
+    volatility: annual log-volatility of the short rate
+    '''
+    def __init__(self, zero_curve_df, horizon: float, steps_per_year: int = 2, volatility: float = 0.15):
+        self.zero_curve_df = zero_curve_df
+        self.horizon = horizon
+        self.steps_per_year = steps_per_year
+        self.volatility = volatility
+        self.dt = 1.0 / steps_per_year
+        self.n_steps = int(np.ceil(horizon * steps_per_year - 1e-9))
+        self._shifted = {}
+        times = self.dt * np.arange(1, self.n_steps + 1)
+        discount = (1 + _zero_rates(zero_curve_df, times)) ** -times
+        spread = np.exp(2 * volatility * np.sqrt(self.dt) * np.arange(self.n_steps))
+        # rates[i, :i+1] are the short rates at level i; the upper triangle is unused
+        self.rates = np.full((self.n_steps, self.n_steps), np.nan)
+        # Arrow-Debreu prices of the nodes at the current level, propagated forward level by level
+        state_prices = np.array([1.0])
+        level = (1 / discount[0] - 1) / self.dt if self.n_steps else 0.0
+        for i in range(self.n_steps):
+            e = spread[:i + 1]
+            for _ in range(50):
+                growth = 1 + level * e * self.dt
+                error = (state_prices / growth).sum() - discount[i]
+                step = error / -(state_prices * e * self.dt / growth ** 2).sum()
+                level -= step
+                if abs(step) < 1e-15:
+                    break
+            self.rates[i, :i + 1] = level * e
+            half = 0.5 * state_prices / (1 + self.rates[i, :i + 1] * self.dt)
+            state_prices = np.zeros(i + 2)
+            state_prices[:-1] += half
+            state_prices[1:] += half
+
+    def shifted(self, shift: float) -> 'ShortRateLattice':
+        '''
+        Lattice recalibrated to the zero curve shifted in parallel by shift (decimal); cached per shift.
+        '''
+        if shift not in self._shifted:
+            curve = _shift_curve(self.zero_curve_df, shift)
+            self._shifted[shift] = ShortRateLattice(curve, self.horizon, self.steps_per_year, self.volatility)
+        return self._shifted[shift]
+
+    def cash_flows(self, book: BondBook, call_dates=None, call_prices=None):
+        '''
+        Map a book onto the tree: returns (cash, strike), both (n_bonds, n_steps + 1).
+        cash holds the payments at each step, strike the call price where the issuer may call (inf elsewhere).
+        Without call_dates, callable bonds are Bermudan: callable at par on every coupon date from
+        book.call_date up to maturity. Otherwise call_dates/call_prices are (n_bonds, n_calls) arrays,
+        NaN-padded, with call prices defaulting to face value.
+        '''
+        schedule = book.schedule
+        n_bonds = len(book)
+        steps = np.rint(schedule.times * self.steps_per_year).astype(np.int64)
+        live = schedule.periods <= np.maximum(schedule.n_periods, 1)[:, None]
+        if (steps[live] > self.n_steps).any():
+            raise ValueError("Bond maturity is beyond the lattice horizon.")
+        steps = np.where(live, steps, 0)
+        rows = np.broadcast_to(np.arange(n_bonds)[:, None], steps.shape)
+        cash = np.zeros((n_bonds, self.n_steps + 1))
+        np.add.at(cash, (rows, steps), np.where(live, schedule.amounts, 0.0))
+        strike = np.full(cash.shape, np.inf)
+        if call_dates is None:
+            maturity_step = steps[np.arange(n_bonds), np.maximum(schedule.n_periods - 1, 0)]
+            exercisable = live & (schedule.times >= book.call_date[:, None]) & (steps < maturity_step[:, None])
+            strike[rows[exercisable], steps[exercisable]] = np.broadcast_to(book.face_value[:, None], steps.shape)[exercisable]
         else:
-            # Coupon bond: P = sum_{t=1}^{n-1} C/(1+z_t)^t + (C+F)/(1+z_n)^n
-            # All z_t for t < n are already solved
-            pv_coupons = 0.0
-            for t in range(1, n):
-                pv_coupons += C / (1 + spot_rates[t-1]) ** t
-            # Solve for z_n:
-            # P - pv_coupons = (C+F)/(1+z_n)^n
-            # (1+z_n)^n = (C+F)/(P - pv_coupons)
-            # z_n = ((C+F)/(P - pv_coupons))**(1/n) - 1
-            z = ((C + F) / (P - pv_coupons)) ** (1 / n) - 1
-            spot_rates.append(z)
+            call_dates = np.asarray(call_dates, dtype=float).reshape(n_bonds, -1)
+            call_prices = np.broadcast_to(book.face_value[:, None] if call_prices is None
+                                          else np.asarray(call_prices, dtype=float).reshape(n_bonds, -1), call_dates.shape)
+            valid = ~np.isnan(call_dates)
+            call_rows = np.broadcast_to(np.arange(n_bonds)[:, None], call_dates.shape)
+            strike[call_rows[valid], np.rint(call_dates[valid] * self.steps_per_year).astype(np.int64)] = call_prices[valid]
+        return cash, strike
+
+    def induct(self, cash: np.ndarray, strike: np.ndarray, oas=0.0) -> np.ndarray:
+        '''
+        Backward induction for every bond at once; returns the price of each bond at the root.
+        oas: spread added to every short rate (scalar or one per bond)
+        '''
+        oas = np.broadcast_to(np.asarray(oas, dtype=float), (len(cash),))[:, None]
+        value = np.repeat(cash[:, -1:], self.n_steps + 1, axis=1)
+        for i in range(self.n_steps - 1, -1, -1):
+            value = 0.5 * (value[:, :-1] + value[:, 1:]) / (1 + (self.rates[i, :i + 1] + oas) * self.dt)
+            # Issuer calls when continuation is worth more than the strike; the coupon is paid either way
+            value = np.minimum(value, strike[:, i:i + 1]) + cash[:, i:i + 1]
+        return value[:, 0]
+
+    def price(self, book: BondBook, call_dates=None, call_prices=None, oas=0.0) -> np.ndarray:
+        '''
+        Option-adjusted price of every bond in the book (see cash_flows for the call schedule).
+        '''
+        return self.induct(*self.cash_flows(book, call_dates, call_prices), oas)
+
+    def _solve_oas(self, cash, strike, prices, bounds=(-0.05, 0.5), iterations=40) -> np.ndarray:
+        # Bisection on the spread for all bonds at once; price falls as the spread rises
+        lo = np.full(len(prices), bounds[0])
+        hi = np.full(len(prices), bounds[1])
+        bracketed = (self.induct(cash, strike, lo) >= prices) & (self.induct(cash, strike, hi) <= prices)
+        for _ in range(iterations):
+            mid = (lo + hi) / 2
+            rich = self.induct(cash, strike, mid) > prices
+            lo = np.where(rich, mid, lo)
+            hi = np.where(rich, hi, mid)
+        return np.where(bracketed, (lo + hi) / 2, np.nan)
+
+    def oas(self, book: BondBook, prices=None, call_dates=None, call_prices=None) -> np.ndarray:
+        '''
+        Option-adjusted spread that reprices each bond to its market price (book.price unless prices
+        is given); NaN where no spread in [-5%, 50%] matches.
+        '''
+        prices = book.price if prices is None else np.asarray(prices, dtype=float)
+        return self._solve_oas(*self.cash_flows(book, call_dates, call_prices), prices)
+
+    def analyze(self, book: BondBook, prices=None, call_dates=None, call_prices=None, bump: float = 0.001) -> pd.DataFrame:
+        '''
+        Model price, straight (non-callable) price, option value, OAS and effective duration/convexity
+        for every bond in the book, indexed by bond id. Effective measures reprice on trees recalibrated
+        to the curve shifted by +/- bump, holding each bond's OAS fixed (0 where there is no market price).
+        '''
+        cash, strike = self.cash_flows(book, call_dates, call_prices)
+        prices = book.price if prices is None else np.asarray(prices, dtype=float)
+        oas = self._solve_oas(cash, strike, prices)
+        spread = np.nan_to_num(oas)
+        base = self.induct(cash, strike, spread)
+        up = self.shifted(bump).induct(cash, strike, spread)
+        down = self.shifted(-bump).induct(cash, strike, spread)
+        model = self.induct(cash, strike)
+        straight = self.induct(cash, np.full(strike.shape, np.inf))
+        return pd.DataFrame({
+            'model_price': model,
+            'straight_price': straight,
+            'option_value': straight - model,
+            'oas': oas,
+            'effective_duration': (down - up) / (2 * base * bump),
+            'effective_convexity': (up + down - 2 * base) / (base * bump ** 2),
+        }, index=pd.Index(book.id, name='id'))
+
+
+class VasicekModel:
+    '''
+    Vasicek short rate dr = mean_reversion * (long_rate - r) dt + volatility dW, with closed-form
+    zero-coupon prices P(t, t + tau) = exp(ln A(tau) - B(tau) r) and exact Gaussian transitions.
+    Rates are continuously compounded; calibrate() fits long_rate and the initial short_rate to a curve.
+    '''
+    def __init__(self, mean_reversion: float = 0.1, volatility: float = 0.01, long_rate: float = 0.04, short_rate: float = 0.03):
+        self.mean_reversion = mean_reversion
+        self.volatility = volatility
+        self.long_rate = long_rate
+        self.short_rate = short_rate
+
+    def _loadings(self, tau):
+        # (known, slope, B) with ln P(t, t + tau) = known + long_rate * slope - B * r
+        a, sigma = self.mean_reversion, self.volatility
+        b = (1 - np.exp(-a * tau)) / a
+        return -(b - tau) * sigma ** 2 / (2 * a ** 2) - sigma ** 2 * b ** 2 / (4 * a), b - tau, b
+
+    @classmethod
+    def calibrate(cls, zero_curve, mean_reversion: float = 0.1, volatility: float = 0.01):
+        '''
+        Fit long_rate and short_rate to the curve's knots by least squares on log discount factors
+        (both enter ln P linearly), for the given mean reversion and volatility.
+        '''
+        model = cls(mean_reversion, volatility)
+        tau, spot_rates = curve_points(zero_curve)
+        keep = tau > 0
+        tau, spot_rates = tau[keep], spot_rates[keep]
+        known, slope, b = model._loadings(tau)
+        (model.long_rate, model.short_rate), *_ = np.linalg.lstsq(np.column_stack([slope, -b]),
+                                                                 -tau * np.log1p(spot_rates) - known, rcond=None)
+        return model
+
+    def discount(self, t: float, tau, r) -> np.ndarray:
+        '''
+        Zero-coupon prices P(t, t + tau) for short rates r at time t: shape (len(r), len(tau)).
+        '''
+        known, slope, b = self._loadings(np.asarray(tau, dtype=float))
+        return np.exp(known + self.long_rate * slope - np.multiply.outer(np.asarray(r, dtype=float), b))
+
+    def step(self, t: float, dt: float, r, rng) -> np.ndarray:
+        '''
+        Sample the short rates dt years after t given rates r (exact transition).
+        '''
+        decay = np.exp(-self.mean_reversion * dt)
+        sd = self.volatility * np.sqrt((1 - decay ** 2) / (2 * self.mean_reversion))
+        return r * decay + self.long_rate * (1 - decay) + sd * rng.standard_normal(np.shape(r))
+
+
+class CIRModel(VasicekModel):
+    '''
+    Cox-Ingersoll-Ross short rate dr = mean_reversion * (long_rate - r) dt + volatility sqrt(r) dW,
+    with closed-form zero-coupon prices and exact noncentral chi-square transitions (rates stay >= 0).
+    '''
+    def _loadings(self, tau):
+        a, sigma = self.mean_reversion, self.volatility
+        h = np.sqrt(a ** 2 + 2 * sigma ** 2)
+        growth = np.expm1(h * tau)
+        denominator = (h + a) * growth + 2 * h
+        slope = 2 * a / sigma ** 2 * (np.log(2 * h / denominator) + (a + h) * tau / 2)
+        return np.zeros_like(tau), slope, 2 * growth / denominator
+
+    def step(self, t: float, dt: float, r, rng) -> np.ndarray:
+        if self.long_rate <= 0:
+            raise ValueError("CIR long_rate must be positive.")
+        decay = np.exp(-self.mean_reversion * dt)
+        scale = self.volatility ** 2 * (1 - decay) / (4 * self.mean_reversion)
+        dof = 4 * self.mean_reversion * self.long_rate / self.volatility ** 2
+        return scale * rng.noncentral_chisquare(dof, np.maximum(r, 0) * decay / scale)
+
+
+class HullWhiteModel:
+    '''
+    Hull-White (extended Vasicek) short rate dr = (theta(t) - mean_reversion * r) dt + volatility dW,
+    with theta(t) fitted to the zero curve so that the model reprices it exactly at time 0.
+    zero_curve: ZeroCurve or DataFrame with ['maturity', 'spot_rate'] (annual compounding)
+    '''
+    def __init__(self, zero_curve, mean_reversion: float = 0.1, volatility: float = 0.01):
+        self.zero_curve = zero_curve
+        self.mean_reversion = mean_reversion
+        self.volatility = volatility
+        self.short_rate = float(self._alpha(0.0))
+
+    def _log_discount(self, t):
+        # ln P(0, t) on the initial curve
+        t = np.asarray(t, dtype=float)
+        return -t * np.log1p(_zero_rates(self.zero_curve, t))
+
+    def _forward(self, t, h: float = 1e-4):
+        # Instantaneous forward f(0, t) = -d ln P(0, t) / dt by central differences (one-sided at 0)
+        t = np.asarray(t, dtype=float)
+        lower = np.maximum(t - h, 0.0)
+        return -(self._log_discount(t + h) - self._log_discount(lower)) / (t + h - lower)
+
+    def _alpha(self, t):
+        # Mean of r(t): r(t) = alpha(t) + x(t), where x is a zero-mean Ornstein-Uhlenbeck process
+        a, sigma = self.mean_reversion, self.volatility
+        return self._forward(t) + sigma ** 2 / (2 * a ** 2) * (1 - np.exp(-a * t)) ** 2
+
+    def discount(self, t: float, tau, r) -> np.ndarray:
+        '''
+        Zero-coupon prices P(t, t + tau) for short rates r at time t: shape (len(r), len(tau)).
+        '''
+        a, sigma = self.mean_reversion, self.volatility
+        tau = np.asarray(tau, dtype=float)
+        b = (1 - np.exp(-a * tau)) / a
+        forward = self._forward(t)
+        log_a = (self._log_discount(t + tau) - self._log_discount(t) + b * forward
+                 - sigma ** 2 / (4 * a) * (1 - np.exp(-2 * a * t)) * b ** 2)
+        return np.exp(log_a - np.multiply.outer(np.asarray(r, dtype=float), b))
+
+    def step(self, t: float, dt: float, r, rng) -> np.ndarray:
+        '''
+        Sample the short rates dt years after t given rates r (exact transition).
+        '''
+        a = self.mean_reversion
+        decay = np.exp(-a * dt)
+        sd = self.volatility * np.sqrt((1 - decay ** 2) / (2 * a))
+        return (r - self._alpha(t)) * decay + self._alpha(t + dt) + sd * rng.standard_normal(np.shape(r))
+
+
+class CurveBootstrapper:
+    '''
+    Bootstraps discount factors from coupon bond prices and keeps the state, so that when one quote
+    moves only that instrument and the longer maturities are re-solved (see update()).
+    Coupons fall every 1/frequency years counting back from maturity (so fractional maturities get a
+    short first period), and maturities are rounded to a grid of steps_per_year points per year, which
+    every coupon frequency must divide. Discount factors between two solved maturities are log-linearly
+    interpolated. Running sums of discount factors along each coupon stride are kept, so the coupons
+    that fall on already-solved dates are priced in constant time and each instrument only does work
+    for the dates since the previous maturity; the whole curve is linear in the grid size.
+    '''
+    def __init__(self, maturity, coupon_rate, price, face_value=100.0, frequency=1, steps_per_year: int = 12):
+        maturity, coupon_rate, price, face_value, frequency = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(x, dtype=float)) for x in (maturity, coupon_rate, price, face_value, frequency)))
+        order = np.argsort(maturity, kind='stable')
+        self.steps_per_year = steps_per_year
+        self.end = np.rint(maturity[order] * steps_per_year).astype(np.int64)
+        self.stride = np.rint(steps_per_year / frequency[order]).astype(np.int64)
+        if (self.end <= 0).any() or (np.diff(self.end) == 0).any():
+            raise ValueError("Maturities must be positive and distinct on the bootstrap grid.")
+        if (self.stride * frequency[order] != steps_per_year).any():
+            raise ValueError("Every coupon frequency must divide steps_per_year.")
+        self.coupon = face_value[order] * coupon_rate[order] / frequency[order]
+        self.redemption = face_value[order].copy()
+        self.price = price[order].copy()
+        self.grid_discount = np.ones(self.end[-1] + 1)
+        # running[s][j] = grid_discount[j] + grid_discount[j - s] + ... over grid points > 0
+        self.running = {s: np.zeros(self.end[-1] + 1) for s in np.unique(self.stride)}
+        self._curve = None
+        self._solve_from(0)
+
+    @property
+    def maturities(self) -> np.ndarray:
+        return self.end / self.steps_per_year
+
+    @property
+    def discount_factors(self) -> np.ndarray:
+        return self.grid_discount[self.end]
+
+    @property
+    def spot_rates(self) -> np.ndarray:
+        return self.discount_factors ** (-1 / self.maturities) - 1
+
+    @property
+    def curve(self) -> 'ZeroCurve':
+        '''
+        ZeroCurve through the bootstrapped spot rates (patched in place of a refit after update()).
+        '''
+        if self._curve is None:
+            self._curve = ZeroCurve(self.maturities, self.spot_rates)
+        return self._curve
+
+    def _solve_from(self, first: int):
+        # Solve instruments first..n-1; everything up to the maturity before `first` is kept as is
+        discount = self.grid_discount
+        last = self.end[first - 1] if first > 0 else 0
+        for i in range(first, len(self.end)):
+            T, s, C, R = self.end[i], self.stride[i], self.coupon[i], self.redemption[i]
+            # Coupon dates T - k*s: the earliest k0 - 1 of them fall after the last solved maturity
+            k0 = -(-(T - last) // s)
+            known = self.running[s][T - k0 * s] if T - k0 * s > 0 else 0.0
+            weights = (T - np.arange(1, k0) * s - last) / (T - last)
+            target = self.price[i] - C * known
+            x = target / (C * len(weights) + C + R)
+            # Newton on the maturity discount factor x; interpolated coupon dates depend on it as x**w
+            for _ in range(50 if len(weights) else 0):
+                interpolated = discount[last] ** (1 - weights) * x ** weights
+                error = C * interpolated.sum() + (C + R) * x - target
+                step = error / (C * (weights * interpolated).sum() / x + C + R)
+                x -= step
+                if abs(step) < 1e-15:
+                    break
+            grid = np.arange(last + 1, T + 1)
+            discount[grid] = discount[last] ** ((T - grid) / (T - last)) * x ** ((grid - last) / (T - last))
+            for j in grid:
+                for width, sums in self.running.items():
+                    sums[j] = discount[j] + (sums[j - width] if j > width else 0.0)
+            last = T
+
+    def update(self, maturity: float, price: float) -> np.ndarray:
+        '''
+        Set a new market price for the instrument maturing at `maturity` and re-solve only it and the
+        longer maturities. The curve's spline is patched rather than refitted: pieces before the previous
+        knot are kept and the rest is refitted with its slope clamped to the old spline there.
+        Returns the maturities whose discount factor changed, for selective revaluation downstream.
+        '''
+        index = int(np.searchsorted(self.end, round(maturity * self.steps_per_year)))
+        if index == len(self.end) or self.end[index] != round(maturity * self.steps_per_year):
+            raise KeyError(f"No instrument maturing at {maturity}")
+        before = self.discount_factors
+        self.price[index] = price
+        self._solve_from(index)
+        changed = np.flatnonzero(self.discount_factors != before)
+        if self._curve is not None and len(changed):
+            self._curve = self._curve.patched(self.spot_rates, changed[0])
+        return self.maturities[changed]
+
+
+def bootstrap_discount_factors(maturity, coupon_rate, price, face_value=100.0, frequency=1, steps_per_year: int = 12):
+    '''
+    Bootstrap discount factors from coupon bond prices in a single pass over the instruments
+    (conventions as in CurveBootstrapper). Returns (maturities, discount_factors) sorted by maturity.
+    '''
+    bootstrapper = CurveBootstrapper(maturity, coupon_rate, price, face_value, frequency, steps_per_year)
+    return bootstrapper.maturities, bootstrapper.discount_factors
+
+
+def bootstrap_zero_curve(bond_list, prices=None, steps_per_year: int = 12) -> ZeroCurve:
+    '''
+    Bootstrap a ZeroCurve from a BondBook (market prices in its price column), a DataFrame of bond terms,
+    or a list of Bond objects with known market prices.
+    prices: optional array of market prices overriding the ones carried by bond_list.
+    Coupon frequencies and fractional maturities are handled by bootstrap_discount_factors;
+    spot rates are annually compounded.
+    '''
+    if isinstance(bond_list, pd.DataFrame):
+        book = BondBook.from_frame(bond_list)
+    elif isinstance(bond_list, BondBook):
+        book = bond_list
+    else:
+        bonds = list(bond_list)
+        book = BondBook.from_bonds(bonds)
+        if prices is None and np.isnan(book.price).any():
+            # Plain Bond objects with the market price assigned to bond.price
+            prices = [getattr(b, 'market_price', b.price) for b in bonds]
+    prices = book.price if prices is None else prices
+    maturities, discount = bootstrap_discount_factors(book.maturity, book.coupon_rate, prices, book.face_value,
+                                                      book.frequency, steps_per_year)
+    return ZeroCurve(maturities, discount ** (-1 / maturities) - 1)
+
+
+def bootstrap_yield_curve(bond_list, prices=None, steps_per_year: int = 12) -> pd.DataFrame:
+    '''
+    Same inputs as bootstrap_zero_curve, but returns a DataFrame with columns
+    ['maturity', 'spot_rate', 'interpolated_spot_rate'], the latter on a 0.5-year grid from the curve's spline.
+    '''
+    curve = bootstrap_zero_curve(bond_list, prices, steps_per_year)
+    maturities_arr = curve.maturity
 
     # Interpolate spot rates at 0.5-year intervals using cubic spline
-    maturities_arr = np.array(maturities)
-    spot_arr = np.array(spot_rates)
-    spline = CubicSpline(maturities_arr, spot_arr)
     interp_maturities = np.arange(maturities_arr[0], maturities_arr[-1] + 0.5, 0.5)
-    interp_spots = spline(interp_maturities)
+    interp_spots = curve.zero(interp_maturities)
 
     # Build DataFrame
-    df = pd.DataFrame({
-        'maturity': maturities_arr,
-        'spot_rate': spot_arr
-    })
+    df = curve.to_frame()
     interp_df = pd.DataFrame({
         'maturity': interp_maturities,
         'interpolated_spot_rate': interp_spots
@@ -139,39 +1177,96 @@ def bootstrap_yield_curve(bond_list: List[Bond]) -> pd.DataFrame:
     out = pd.merge(df, interp_df, on='maturity', how='outer').sort_values('maturity').reset_index(drop=True)
     return out
 
+def parallel_shocks(tenors, shifts_bp) -> np.ndarray:
+    '''
+    One scenario per shift in shifts_bp: every tenor moves by the same amount.
+    Like all shock builders, returns an (n_scenarios, n_tenors) matrix in decimal.
+    '''
+    shifts = np.atleast_1d(np.asarray(shifts_bp, dtype=float)) / 10000
+    return np.repeat(shifts[:, None], len(tenors), axis=1)
+
+
+def steepener_shocks(tenors, shifts_bp, pivot: float = 2.0) -> np.ndarray:
+    '''
+    Tenors up to pivot move down by half the shift and longer ones up by half (negative shifts flatten).
+    '''
+    shifts = np.atleast_1d(np.asarray(shifts_bp, dtype=float)) / 10000
+    return shifts[:, None] * np.where(np.asarray(tenors, dtype=float) <= pivot, -0.5, 0.5)
+
+
+def twist_shocks(tenors, shifts_bp, pivot: float = None) -> np.ndarray:
+    '''
+    Linear rotation around pivot (default: middle of the tenor range); the ends of the curve move
+    apart by the full shift.
+    '''
+    tenors = np.asarray(tenors, dtype=float)
+    pivot = (tenors.min() + tenors.max()) / 2 if pivot is None else pivot
+    shifts = np.atleast_1d(np.asarray(shifts_bp, dtype=float)) / 10000
+    return shifts[:, None] * (tenors - pivot) / (tenors.max() - tenors.min())
+
+
+def butterfly_shocks(tenors, shifts_bp, belly: float = None) -> np.ndarray:
+    '''
+    Wings up and belly down by the shift (negative shifts invert it), linear in between;
+    belly defaults to the middle of the tenor range.
+    '''
+    tenors = np.asarray(tenors, dtype=float)
+    belly = (tenors.min() + tenors.max()) / 2 if belly is None else belly
+    shape = np.interp(tenors, [tenors.min(), belly, tenors.max()], [1.0, -1.0, 1.0])
+    shifts = np.atleast_1d(np.asarray(shifts_bp, dtype=float)) / 10000
+    return shifts[:, None] * shape
+
+
+def key_rate_shocks(tenors, key_tenors, shift_bp: float = 1.0) -> np.ndarray:
+    '''
+    One scenario per key tenor: a triangular bump of shift_bp peaking at the key tenor and falling to zero
+    at the neighbouring keys (flat beyond the first and last key), so the bumps add up to a parallel shift.
+    '''
+    key_tenors = np.asarray(key_tenors, dtype=float)
+    return np.vstack([np.interp(tenors, key_tenors, unit) for unit in np.eye(len(key_tenors))]) * shift_bp / 10000
+
+
+def apply_shocks(zero_curve, shocks) -> np.ndarray:
+    '''
+    Shocked knot rates for a whole scenario library in one broadcast: returns (n_scenarios, n_knots).
+    shocks: (n_scenarios, n_knots) matrix built on the curve's knot maturities (curve_points) with the
+    builders above, stacked with np.vstack to mix scenario types.
+    '''
+    _, spot_rates = curve_points(zero_curve)
+    return spot_rates + np.atleast_2d(np.asarray(shocks, dtype=float))
+
+
 def simulate_yield_shift(zero_curve_df: pd.DataFrame, scenario: str, shift_bp: float) -> pd.DataFrame:
     """
     Apply a yield curve shock scenario to the zero curve DataFrame.
     Args:
-        zero_curve_df: DataFrame with at least columns ['maturity', 'spot_rate']
+        zero_curve_df: DataFrame with at least columns ['maturity', 'spot_rate'], or a ZeroCurve
         scenario: 'parallel' or 'steepening'
         shift_bp: shift in basis points (float)
     Returns:
-        DataFrame with shocked spot rates (same structure as input)
+        DataFrame with shocked spot rates (same structure as input), or a ZeroCurve for a ZeroCurve input
     """
+    if isinstance(zero_curve_df, ZeroCurve):
+        shocked = simulate_yield_shift(zero_curve_df.to_frame(), scenario, shift_bp)
+        return ZeroCurve(shocked['maturity'], shocked['spot_rate'])
     shocked = zero_curve_df.copy()
-    shift = shift_bp / 10000  # convert bp to decimal
+    maturities = shocked["maturity"].to_numpy(dtype=float)
     if scenario == "parallel":
-        shocked["spot_rate"] = shocked["spot_rate"] + shift
-        if "interpolated_spot_rate" in shocked.columns:
-            shocked["interpolated_spot_rate"] = shocked["interpolated_spot_rate"] + shift
+        shift = parallel_shocks(maturities, shift_bp)[0]
     elif scenario == "steepening":
         # For maturities <= 2y: subtract half shift; >2y: add half shift
-        shocked["spot_rate"] = shocked.apply(
-            lambda row: row["spot_rate"] - 0.5 * shift if row["maturity"] <= 2 else row["spot_rate"] + 0.5 * shift,
-            axis=1
-        )
-        if "interpolated_spot_rate" in shocked.columns:
-            shocked["interpolated_spot_rate"] = shocked.apply(
-                lambda row: row["interpolated_spot_rate"] - 0.5 * shift if row["maturity"] <= 2 else row["interpolated_spot_rate"] + 0.5 * shift,
-                axis=1
-            )
+        shift = steepener_shocks(maturities, shift_bp, pivot=2.0)[0]
     else:
         raise ValueError(f"Unknown scenario: {scenario}")
+    shocked["spot_rate"] = shocked["spot_rate"] + shift
+    if "interpolated_spot_rate" in shocked.columns:
+        shocked["interpolated_spot_rate"] = shocked["interpolated_spot_rate"] + shift
     return shocked
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
     # Unit tests for price_bond and Bond class
     # Example 1: 5-year, 5% annual coupon, face 100, yield 5%, annual
     bond1 = Bond(100, 0.05, 5, 1)
@@ -0,0 +1,293 @@
+import json
+import os
+import struct
+import threading
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .fixed_income import BondBook, BondView
+    from .portfolio import Portfolio, TradeLedger
+except ImportError:  # imported as a top-level module (e.g. by streamlit_app)
+    from fixed_income import BondBook, BondView
+    from portfolio import Portfolio, TradeLedger
+
+STATE_SCHEMA_VERSION = 1
+
+
+def _default(value):
+    # Tag the types plain JSON would drop, so decode() can rebuild them
+    if isinstance(value, pd.Timestamp):
+        return {'$timestamp': value.isoformat()}
+    if isinstance(value, np.datetime64):
+        return {'$timestamp': pd.Timestamp(value).isoformat()}
+    if isinstance(value, np.ndarray):
+        return {'$array': value.tolist(), 'dtype': value.dtype.str}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot journal a value of type {type(value).__name__}.")
+
+
+def _object_hook(obj):
+    if '$timestamp' in obj:
+        return pd.Timestamp(obj['$timestamp'])
+    if '$array' in obj:
+        return np.array(obj['$array'], dtype=obj['dtype'])
+    return obj
+
+
+def encode(value) -> str:
+    '''
+    Compact JSON for a journal record or snapshot. Timestamps, NumPy scalars and arrays keep their types.
+    '''
+    return json.dumps(value, default=_default, separators=(',', ':'))
+
+
+def decode(text: str):
+    return json.loads(text, object_hook=_object_hook)
+
+
+def _write_atomic(path: str, text: str):
+    # Write a temporary file, fsync it and rename it over the target: readers see the old or the new file, never half of one
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    try:
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:  # directories cannot be opened on every platform (e.g. Windows)
+        return
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class SessionJournal:
+    '''
+    Journaled session persistence: each state change is appended to <path>.journal.jsonl as one compact,
+    sequence-numbered line (flushed at once, fsynced every sync_every records), and the full state is
+    periodically compacted into <path>.snapshot.json. Restoring reads the snapshot plus the journal records
+    after it, so the cost of saving one change does not grow with the length of the session.
+    '''
+
+    def __init__(self, path: str = 'autosave_session', sync_every: int = 32, compact_every: int = 1000):
+        self.snapshot_path = path + '.snapshot.json'
+        self.journal_path = path + '.journal.jsonl'
+        self.sync_every = max(int(sync_every), 1)
+        self.compact_every = max(int(compact_every), 1)
+        self._lock = threading.Lock()
+        self._compactor = None
+        snapshot_seq, _ = self._read_snapshot()
+        offsets = []
+        tail = self._read_journal(snapshot_seq, offsets)
+        # Continue the sequence after whatever is already on disk
+        self.seq = tail[-1][0] if tail else snapshot_seq
+        self._since_snapshot = len(tail)
+        self._unsynced = 0
+        # Cut off a torn last line so new records do not get appended onto it
+        if os.path.exists(self.journal_path) and os.path.getsize(self.journal_path) > offsets[0]:
+            os.truncate(self.journal_path, offsets[0])
+        self._file = open(self.journal_path, 'a', encoding='utf-8')
+
+    def _read_snapshot(self):
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = decode(f.read())
+        except FileNotFoundError:
+            return 0, None
+        return snapshot['seq'], snapshot['state']
+
+    def _read_journal(self, after: int, offsets: list = None) -> list:
+        # (seq, record) pairs after a sequence number; a torn last line from a crash mid-write ends the journal.
+        # offsets, if given, receives the byte offset just past the last complete record.
+        records = []
+        end = 0
+        try:
+            with open(self.journal_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        seq, record = decode(line.decode('utf-8'))
+                    except ValueError:
+                        break
+                    end += len(line)
+                    if seq > after:
+                        records.append((seq, record))
+        except FileNotFoundError:
+            pass
+        if offsets is not None:
+            offsets.append(end)
+        return records
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def append(self, record: dict) -> int:
+        '''
+        Append one state-change record and return its sequence number.
+        '''
+        with self._lock:
+            self.seq += 1
+            self._file.write(encode([self.seq, record]) + '\n')
+            self._file.flush()
+            self._unsynced += 1
+            self._since_snapshot += 1
+            if self._unsynced >= self.sync_every:
+                self._sync()
+            return self.seq
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self._since_snapshot >= self.compact_every
+
+    def compact(self, state: dict, background: bool = True):
+        '''
+        Write state (the full session as of the latest record) as the new snapshot and drop the journal
+        records it covers. state must not be modified afterwards; in the background it is serialized on a
+        worker thread while appends continue.
+        '''
+        self.wait()
+        with self._lock:
+            seq = self.seq
+            self._since_snapshot = 0
+        if background:
+            self._compactor = threading.Thread(target=self._compact, args=(state, seq), daemon=True)
+            self._compactor.start()
+        else:
+            self._compact(state, seq)
+
+    def _compact(self, state: dict, seq: int):
+        _write_atomic(self.snapshot_path, encode({'seq': seq, 'state': state}))
+        # A crash before the journal is trimmed is harmless: restore skips records the snapshot covers
+        with self._lock:
+            self._sync()
+            tail = self._read_journal(seq)
+            self._file.close()
+            _write_atomic(self.journal_path, ''.join(encode([s, record]) + '\n' for s, record in tail))
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+
+    def wait(self):
+        # Block until a background compaction has finished
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+
+    def load(self):
+        '''
+        Return (snapshot state or None, journal records written after it, in order).
+        '''
+        self.wait()
+        with self._lock:
+            self._file.flush()
+            snapshot_seq, state = self._read_snapshot()
+            return state, [record for _, record in self._read_journal(snapshot_seq)]
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+
+def save_state(file, book: BondBook, portfolio: Portfolio, ledger: TradeLedger = None, reinvestable_money: float = 0.0,
+               activity_feed=(), compress: bool = False):
+    '''
+    Write the portfolio state as an .npz of typed columns: the bond terms (book/*, including call dates and
+    sector codes with their labels), positions keyed by book id (positions/*), the ledger's events (ledger/*,
+    with instruments numbered by book row), the reinvestable cash and the activity feed, tagged with
+    STATE_SCHEMA_VERSION. file is a path or a binary file object. Uncompressed files can be memory-mapped
+    by load_state; compress trades that for size (e.g. for downloads).
+    '''
+    positions = portfolio.to_frame()
+    if not np.isin(positions['instrument_id'].to_numpy(), book.id).all():
+        raise ValueError("Portfolio holds instruments that are not in the book.")
+    columns = {'schema_version': np.int64(STATE_SCHEMA_VERSION), 'reinvestable_money': np.float64(reinvestable_money),
+               'activity_feed': np.array(list(activity_feed), dtype=str)}
+    columns.update({f'book/{name}': getattr(book, name) for name in ('id',) + BondBook.columns})
+    codes, labels = pd.factorize(book.sector)
+    columns.update({'book/sector': codes.astype(np.int32), 'book/sector_labels': np.asarray(labels, dtype=str)})
+    columns.update({f'positions/{name}': values.to_numpy() for name, values in positions.items()})
+    if ledger is not None:
+        assets = ledger.assets
+        if not all(isinstance(asset, BondView) and asset.book is book for asset in assets):
+            raise ValueError("Ledger holds instruments that are not in the book.")
+        events = ledger.to_frame()
+        events['instrument'] = np.fromiter((asset.row for asset in assets), dtype=np.int64, count=len(assets))[events['instrument'].to_numpy()]
+        events['kind'] = events['kind'].cat.codes
+        columns.update({f'ledger/{name}': values.to_numpy() for name, values in events.items()})
+        columns['ledger/kinds'] = np.array(TradeLedger.kinds)
+    (np.savez_compressed if compress else np.savez)(file, **columns)
+
+
+def _mmap_npz(path: str) -> dict:
+    # Map each stored (uncompressed) .npy member of an .npz straight from the file instead of reading it
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(f)
+            if dtype.hasobject:
+                raise ValueError("State files may not contain object arrays.")
+            if not shape or 0 in shape:
+                arrays[name] = np.zeros(shape, dtype=dtype) if 0 in shape else np.fromfile(f, dtype=dtype, count=1).reshape(shape)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
+    return arrays
+
+
+def load_state(file, mmap: bool = True) -> dict:
+    '''
+    Read a save_state() file. Paths are memory-mapped (columns are paged in as they are used) unless
+    mmap is False; file objects such as uploads are read with np.load. Returns a dict with 'book',
+    'portfolio', 'ledger' (None if none was saved; otherwise bound to the portfolio), 'reinvestable_money'
+    and 'activity_feed'. Raises ValueError for files written by a newer schema.
+    '''
+    if mmap and isinstance(file, (str, os.PathLike)):
+        arrays = _mmap_npz(os.fspath(file))
+    else:
+        with np.load(file, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+    version = int(arrays.get('schema_version', -1))
+    if not 1 <= version <= STATE_SCHEMA_VERSION:
+        raise ValueError(f"Unsupported portfolio state schema version {version}.")
+
+    sector_labels = arrays.pop('book/sector_labels')
+    kinds = arrays.pop('ledger/kinds', None)
+
+    def table(prefix):
+        return pd.DataFrame({name[len(prefix):]: values for name, values in arrays.items() if name.startswith(prefix)})
+
+    terms = table('book/')
+    terms['sector'] = sector_labels[terms['sector'].to_numpy()] if len(sector_labels) else ''
+    book = BondBook.from_frame(terms)
+    # One view per bond, shared by the portfolio and the ledger so their dicts match keys by identity
+    views = list(book)
+    portfolio = Portfolio.from_frame(table('positions/'), instruments=dict(zip(book.id.tolist(), views)))
+    ledger = None
+    if 'ledger/kind' in arrays:
+        events = table('ledger/')
+        events['kind'] = pd.Categorical.from_codes(events['kind'], kinds.tolist())
+        ledger = TradeLedger.from_frame(events, views, portfolio)
+    return {'book': book, 'portfolio': portfolio, 'ledger': ledger,
+            'reinvestable_money': float(arrays['reinvestable_money']), 'activity_feed': arrays['activity_feed'].tolist()}
@@ -1,35 +1,629 @@
+import numpy as np
+import pandas as pd
+
+try:
+    from .fixed_income import BondBook
+except ImportError:  # imported as a top-level module (e.g. by streamlit_app)
+    from fixed_income import BondBook
+
+
 class Portfolio:
-    def __init__(self):
-        self.assets = {}
+    '''
+    Position store backed by NumPy arrays: one row per held asset with its quantity, price_per_unit (cost of
+    the first purchase), total_investment (cost basis) and a stable integer instrument_id, plus an
+    asset -> row index. Adds and removals are O(1): arrays grow by doubling and a removed row is filled
+    with the last one. Assets can be any hashable key (tickers, Bond objects, BondView rows).
+    '''
+    columns = ('quantity', 'price_per_unit', 'total_investment')
+
+    def __init__(self, positions=None, capacity: int = 16):
+        # positions: optional iterable of (asset, quantity) or (asset, quantity, price_per_unit);
+        # the price defaults to the asset's market_price when it has one
+        self._clear(capacity)
+        for position in positions or []:
+            asset, quantity = position[0], position[1]
+            price = position[2] if len(position) > 2 else getattr(asset, 'market_price', 0.0)
+            self.add_asset(asset, quantity, price)
+
+    def _clear(self, capacity: int = 16, keep_ids: bool = False):
+        self._size = 0
+        self._keys = []
+        self._rows = {}
+        if not keep_ids:
+            # Instrument ids are kept after a position is closed, so re-adding an asset gives the same id
+            self._ids = {}
+            self._used_ids = set()
+            self._next_id = 0
+        capacity = max(int(capacity), 1)
+        self._quantity = np.zeros(capacity)
+        self._price_per_unit = np.zeros(capacity)
+        self._total_investment = np.zeros(capacity)
+        self._instrument_id = np.zeros(capacity, dtype=np.int64)
+        self._is_bond = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        capacity = 2 * len(self._quantity)
+        for name in ('_quantity', '_price_per_unit', '_total_investment', '_instrument_id', '_is_bond'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _instrument_id_for(self, asset) -> int:
+        # BondView rows keep their book id when it is free, so price arrays indexed by book id line up
+        if asset not in self._ids:
+            candidate = getattr(asset, 'id', None)
+            if not isinstance(candidate, (int, np.integer)) or candidate in self._used_ids:
+                while self._next_id in self._used_ids:
+                    self._next_id += 1
+                candidate = self._next_id
+            self._ids[asset] = int(candidate)
+            self._used_ids.add(int(candidate))
+        return self._ids[asset]
+
+    @property
+    def quantity(self) -> np.ndarray:
+        return self._quantity[:self._size]
+
+    @property
+    def price_per_unit(self) -> np.ndarray:
+        return self._price_per_unit[:self._size]
+
+    @property
+    def total_investment(self) -> np.ndarray:
+        return self._total_investment[:self._size]
+
+    @property
+    def instrument_id(self) -> np.ndarray:
+        return self._instrument_id[:self._size]
+
+    @property
+    def keys(self) -> list:
+        return list(self._keys)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, asset) -> bool:
+        return asset in self._rows
+
+    def row(self, asset) -> int:
+        return self._rows[asset]
 
     def add_asset(self, asset_name, quantity, price_per_unit):
-        if asset_name in self.assets:
-            self.assets[asset_name]['quantity'] += quantity
-            self.assets[asset_name]['total_investment'] += quantity * price_per_unit
-        else:
-            self.assets[asset_name] = {
-                'quantity': quantity,
-                'price_per_unit': price_per_unit,
-                'total_investment': quantity * price_per_unit
-            }
+        row = self._rows.get(asset_name)
+        if row is not None:
+            self._quantity[row] += quantity
+            self._total_investment[row] += quantity * price_per_unit
+            return
+        if self._size == len(self._quantity):
+            self._grow()
+        row = self._size
+        self._quantity[row] = quantity
+        self._price_per_unit[row] = price_per_unit
+        self._total_investment[row] = quantity * price_per_unit
+        self._instrument_id[row] = self._instrument_id_for(asset_name)
+        self._is_bond[row] = hasattr(asset_name, 'maturity')
+        self._rows[asset_name] = row
+        self._keys.append(asset_name)
+        self._size += 1
 
     def remove_asset(self, asset_name, quantity):
-        if asset_name in self.assets:
-            if self.assets[asset_name]['quantity'] >= quantity:
-                self.assets[asset_name]['quantity'] -= quantity
-                if self.assets[asset_name]['quantity'] == 0:
-                    del self.assets[asset_name]
-            else:
-                raise ValueError("Not enough quantity to remove.")
-        else:
+        row = self._rows.get(asset_name)
+        if row is None:
             raise ValueError("Asset not found in portfolio.")
+        if self._quantity[row] < quantity:
+            raise ValueError("Not enough quantity to remove.")
+        self._quantity[row] -= quantity
+        if self._quantity[row] == 0:
+            self._delete_row(row)
+
+    def _delete_row(self, row: int):
+        # Move the last row into the freed slot
+        last = self._size - 1
+        del self._rows[self._keys[row]]
+        if row != last:
+            for array in (self._quantity, self._price_per_unit, self._total_investment, self._instrument_id, self._is_bond):
+                array[row] = array[last]
+            self._keys[row] = self._keys[last]
+            self._rows[self._keys[row]] = row
+        self._keys.pop()
+        self._size = last
+
+    def _set_position(self, asset, quantity, price_per_unit, total_investment):
+        # Overwrite one position, opening or closing its row as needed (used by TradeLedger)
+        row = self._rows.get(asset)
+        if quantity <= 0:
+            if row is not None:
+                self._delete_row(row)
+            return
+        if row is None:
+            self.add_asset(asset, quantity, price_per_unit)
+            row = self._rows[asset]
+        self._quantity[row] = quantity
+        self._price_per_unit[row] = price_per_unit
+        self._total_investment[row] = total_investment
 
     def calculate_value(self, current_prices):
-        total_value = 0
-        for asset_name, asset_info in self.assets.items():
-            if asset_name in current_prices:
-                total_value += asset_info['quantity'] * current_prices[asset_name]
-        return total_value
+        '''
+        Market value of the held assets. current_prices is either a dict of asset -> price (assets without a
+        price are skipped) or an array of prices indexed by instrument_id, valued with one dot product.
+        '''
+        if isinstance(current_prices, dict):
+            prices = np.fromiter((current_prices.get(asset, 0.0) for asset in self._keys), dtype=float, count=self._size)
+            return self.quantity @ prices
+        return self.quantity @ np.asarray(current_prices, dtype=float)[self.instrument_id]
+
+    @property
+    def assets(self) -> dict:
+        '''
+        Positions as a dict of asset -> {'quantity', 'price_per_unit', 'total_investment'} (a copy;
+        assigning a dict of that shape replaces all positions).
+        '''
+        columns = zip(self.quantity.tolist(), self.price_per_unit.tolist(), self.total_investment.tolist())
+        return {asset: dict(zip(self.columns, values)) for asset, values in zip(self._keys, columns)}
+
+    @assets.setter
+    def assets(self, assets: dict):
+        self._clear(len(assets), keep_ids=True)
+        self._load((asset, info['quantity'], info['price_per_unit'], info.get('total_investment', info['quantity'] * info['price_per_unit']))
+                   for asset, info in assets.items())
+
+    def _load(self, positions):
+        # Append (asset, quantity, price_per_unit, total_investment) rows, keeping the given cost basis
+        for asset, quantity, price_per_unit, total_investment in positions:
+            self.add_asset(asset, quantity, price_per_unit)
+            self._total_investment[self._rows[asset]] = total_investment
 
     def get_assets(self):
-        return self.assets
\ No newline at end of file
+        return self.assets
+
+    def to_frame(self) -> pd.DataFrame:
+        '''
+        Positions as plain columns (instrument_id, quantity, price_per_unit, total_investment), for serialization.
+        '''
+        return pd.DataFrame({'instrument_id': self.instrument_id.copy(), 'quantity': self.quantity.copy(),
+                             'price_per_unit': self.price_per_unit.copy(), 'total_investment': self.total_investment.copy()})
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, instruments=None) -> 'Portfolio':
+        '''
+        Rebuild a portfolio from to_frame() output. instruments maps instrument ids back to assets: a BondBook
+        (matched on its id column), a dict or sequence indexed by id, or None to key positions by the id itself.
+        '''
+        ids = df['instrument_id'].to_numpy(dtype=np.int64)
+        if isinstance(instruments, BondBook):
+            rows = pd.Index(instruments.id).get_indexer(ids)
+            if (rows < 0).any():
+                raise ValueError("Instrument id not found in book.")
+            assets = [instruments[row] for row in rows]
+        elif instruments is None:
+            assets = ids.tolist()
+        else:
+            assets = [instruments[i] for i in ids.tolist()]
+        portfolio = cls(capacity=len(df))
+        portfolio._ids = dict(zip(assets, ids.tolist()))
+        portfolio._used_ids = set(portfolio._ids.values())
+        if len(portfolio._ids) < len(assets):
+            # Repeated instruments: accumulate them row by row
+            portfolio._load(zip(assets, df['quantity'].tolist(), df['price_per_unit'].tolist(), df['total_investment'].tolist()))
+            return portfolio
+        # One row per instrument: fill the columns directly
+        n = len(assets)
+        portfolio._quantity[:n] = df['quantity'].to_numpy(dtype=float)
+        portfolio._price_per_unit[:n] = df['price_per_unit'].to_numpy(dtype=float)
+        portfolio._total_investment[:n] = df['total_investment'].to_numpy(dtype=float)
+        portfolio._instrument_id[:n] = ids
+        portfolio._is_bond[:n] = np.fromiter((hasattr(asset, 'maturity') for asset in assets), dtype=bool, count=n)
+        portfolio._keys = list(assets)
+        portfolio._rows = dict(zip(assets, range(n)))
+        portfolio._size = n
+        return portfolio
+
+    def bond_positions(self):
+        '''
+        Return (BondBook, quantities) for every bond held; other assets are skipped.
+        '''
+        rows = np.flatnonzero(self._is_bond[:self._size])
+        return BondBook.from_bonds([self._keys[row] for row in rows]), self.quantity[rows].copy()
+
+    def _risk(self, zero_curve_df):
+        # One vectorized pass: per-unit measures for every bond plus the held quantities
+        book, quantities = self.bond_positions()
+        return book, quantities, book.curve_measures(zero_curve_df)
+
+    def summary(self, zero_curve_df) -> pd.DataFrame:
+        '''
+        Per-position market value, weight, durations, convexity and DV01 against a zero curve,
+        indexed by bond id.
+        '''
+        book, quantities, measures = self._risk(zero_curve_df)
+        market_value = quantities * measures['price']
+        total = market_value.sum()
+        return pd.DataFrame({
+            'Quantity': quantities,
+            'Price': measures['price'],
+            'Market Value': market_value,
+            'Weight %': market_value / total * 100 if total else np.zeros_like(market_value),
+            'Macaulay Duration': measures['macaulay_duration'],
+            'Modified Duration': measures['modified_duration'],
+            'Convexity': measures['convexity'],
+            'DV01': quantities * measures['dv01'],
+        }, index=pd.Index(book.id, name='id'))
+
+    def total_value(self, zero_curve_df) -> float:
+        book, quantities, measures = self._risk(zero_curve_df)
+        return float(quantities @ measures['price'])
+
+    def portfolio_dv01(self, zero_curve_df) -> float:
+        book, quantities, measures = self._risk(zero_curve_df)
+        return float(quantities @ measures['dv01'])
+
+
+class TradeLedger:
+    '''
+    Append-only, event-sourced record of position changes. Every trade, auto-sale or reinvestment is an
+    event holding its signed quantity and price plus the additive changes it made to the position's quantity,
+    price_per_unit and total_investment, stored in growable columnar arrays. Because events are additive, the
+    book at any point is one snapshot (taken every snapshot_every events) plus or minus the events between it
+    and that point. Undo and redo never delete anything: they append compensating events that reverse (or
+    re-apply) the original change, and the bound Portfolio is updated in place.
+    '''
+    kinds = ('trade', 'auto_sale', 'reinvestment', 'undo', 'redo')
+    columns = ('time', 'kind', 'instrument', 'quantity', 'price', 'unit_price_change', 'cost_change', 'reverses')
+    _UNDO, _REDO = 3, 4
+
+    def __init__(self, portfolio: Portfolio = None, assets=(), snapshot_every: int = 4096, capacity: int = 1024):
+        # assets: instruments to register first, so their instrument numbers match their order (e.g. book rows);
+        # the portfolio's current holdings become the opening snapshot
+        self.portfolio = portfolio
+        self.snapshot_every = max(int(snapshot_every), 1)
+        self._assets = []
+        self._slots = {}
+        self._state = np.zeros((3, 16))
+        self._size = 0
+        capacity = max(int(capacity), 1)
+        self._time = np.zeros(capacity, dtype=np.int64)
+        self._kind = np.zeros(capacity, dtype=np.int8)
+        self._instrument = np.zeros(capacity, dtype=np.int64)
+        self._quantity = np.zeros(capacity)
+        self._price = np.zeros(capacity)
+        self._unit_price_change = np.zeros(capacity)
+        self._cost_change = np.zeros(capacity)
+        self._reverses = np.zeros(capacity, dtype=np.int64)
+        # Per-kind stacks of events still in effect (always in seq order), the redo stack and every undone event
+        self._active = {kind: [] for kind in range(self._UNDO)}
+        self._redo = []
+        self._undone = set()
+        self._listeners = []
+        self._register(assets)
+        if portfolio is not None:
+            for asset, quantity, price_per_unit, total_investment in zip(portfolio.keys, portfolio.quantity.tolist(),
+                                                                        portfolio.price_per_unit.tolist(), portfolio.total_investment.tolist()):
+                self._state[:, self._slot_for(asset)] = quantity, price_per_unit, total_investment
+        self._snapshot_seq = [0]
+        self._snapshots = [self._state[:, :len(self._assets)].copy()]
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def assets(self) -> list:
+        return list(self._assets)
+
+    def _slot_for(self, asset) -> int:
+        slot = self._slots.get(asset)
+        if slot is None:
+            slot = len(self._assets)
+            if slot == self._state.shape[1]:
+                state = np.zeros((3, 2 * slot))
+                state[:, :slot] = self._state
+                self._state = state
+            self._slots[asset] = slot
+            self._assets.append(asset)
+        return slot
+
+    def subscribe(self, listener):
+        '''
+        Call listener(asset, quantity_change) after every event is applied, including undo, redo and extend.
+        Listeners are not saved with the ledger.
+        '''
+        self._listeners.append(listener)
+
+    def _register(self, assets):
+        # Bulk _slot_for for a fresh ledger (one dict build instead of one lookup per asset)
+        assets = list(assets)
+        slots = dict(zip(assets, range(len(assets))))
+        if self._assets or len(slots) < len(assets):
+            for asset in assets:
+                self._slot_for(asset)
+            return
+        self._assets = assets
+        self._slots = slots
+        self._state = np.zeros((3, max(len(assets), 16)))
+
+    def _grow(self):
+        capacity = 2 * len(self._kind)
+        for name in ('_time', '_kind', '_instrument', '_quantity', '_price', '_unit_price_change', '_cost_change', '_reverses'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def _changes(self, slot: int, quantity: float, price: float, unit_price_change: float, cost_change: float):
+        # Position changes for a signed quantity, following Portfolio.add_asset/remove_asset: opening a position
+        # sets price_per_unit, partial sales keep the cost basis and closing a position clears it
+        held, price_per_unit, total_investment = self._state[:, slot]
+        remaining = held + quantity
+        if held <= 0 and quantity < 0:
+            raise ValueError("Asset not found in portfolio.")
+        if remaining < 0:
+            raise ValueError("Not enough quantity to remove.")
+        if remaining == 0:
+            return -price_per_unit, -total_investment
+        if held <= 0:
+            if unit_price_change <= 0:
+                unit_price_change, cost_change = price, remaining * price
+            return unit_price_change, cost_change
+        return 0.0, cost_change
+
+    def _append(self, kind: int, slot: int, quantity: float, price: float, unit_price_change: float, cost_change: float,
+                time=None, reverses: int = -1) -> int:
+        if self._size == len(self._kind):
+            self._grow()
+        seq = self._size
+        self._time[seq] = pd.Timestamp(time if time is not None else pd.Timestamp.now()).value
+        self._kind[seq] = kind
+        self._instrument[seq] = slot
+        self._quantity[seq] = quantity
+        self._price[seq] = price
+        self._unit_price_change[seq] = unit_price_change
+        self._cost_change[seq] = cost_change
+        self._reverses[seq] = reverses
+        self._size += 1
+        self._state[:, slot] += quantity, unit_price_change, cost_change
+        if self.portfolio is not None:
+            self.portfolio._set_position(self._assets[slot], *self._state[:, slot].tolist())
+        for listener in self._listeners:
+            listener(self._assets[slot], quantity)
+        if self._size % self.snapshot_every == 0:
+            self._snapshot_seq.append(self._size)
+            self._snapshots.append(self._state[:, :len(self._assets)].copy())
+        return seq
+
+    def record(self, asset, quantity, price, kind: str = 'trade', time=None) -> int:
+        '''
+        Append a trade of a signed quantity (positive buys, negative sells) at a price and apply it to the
+        portfolio. kind is 'trade', 'auto_sale' or 'reinvestment'. Returns the event's sequence number.
+        Recording a new event clears the redo stack.
+        '''
+        code = self.kinds.index(kind)
+        if code >= self._UNDO:
+            raise ValueError("Use undo() and redo() for compensating events.")
+        slot = self._slot_for(asset)
+        unit_price_change, cost_change = (price, quantity * price) if quantity > 0 else (0.0, 0.0)
+        changes = self._changes(slot, quantity, price, unit_price_change, cost_change)
+        seq = self._append(code, slot, quantity, price, *changes, time=time)
+        self._active[code].append(seq)
+        self._redo.clear()
+        return seq
+
+    def buy(self, asset, quantity, price, kind: str = 'trade', time=None) -> int:
+        return self.record(asset, quantity, price, kind, time)
+
+    def sell(self, asset, quantity, price, kind: str = 'trade', time=None) -> int:
+        return self.record(asset, -quantity, price, kind, time)
+
+    def _compensate(self, seq: int, sign: int, kind: int, time=None) -> int:
+        slot = int(self._instrument[seq])
+        quantity = sign * self._quantity[seq]
+        changes = self._changes(slot, quantity, self._price[seq], sign * self._unit_price_change[seq], sign * self._cost_change[seq])
+        return self._append(kind, slot, quantity, self._price[seq], *changes, time=time, reverses=seq)
+
+    def undo_target(self, kind: str = None):
+        '''
+        Sequence number of the event undo(kind) would reverse, or None if nothing is left to undo.
+        '''
+        stacks = [self._active[self.kinds.index(kind)]] if kind is not None else list(self._active.values())
+        stacks = [stack for stack in stacks if stack]
+        return max(stack[-1] for stack in stacks) if stacks else None
+
+    def redo_target(self):
+        return self._redo[-1] if self._redo else None
+
+    def undo(self, kind: str = None, time=None):
+        '''
+        Reverse the latest event still in effect (of the given kind, or of any kind) by appending a
+        compensating event. Returns the compensating event's sequence number, or None if nothing is left to undo.
+        Raises ValueError, leaving the ledger unchanged, if the reversal is impossible on the current book
+        (e.g. the bought position has since been sold by an event of another kind).
+        '''
+        original = self.undo_target(kind)
+        if original is None:
+            return None
+        try:
+            seq = self._compensate(original, -1, self._UNDO, time)
+        except ValueError as e:
+            raise ValueError(f"Cannot undo event #{original}: {e}") from e
+        self._active[int(self._kind[original])].pop()
+        self._redo.append(original)
+        self._undone.add(original)
+        return seq
+
+    def redo(self, time=None):
+        '''
+        Re-apply the most recently undone event (if no new event was recorded since) by appending a
+        compensating event. Returns its sequence number, or None if there is nothing to redo.
+        Raises ValueError, leaving the ledger unchanged, if the event cannot be re-applied to the current book.
+        '''
+        original = self.redo_target()
+        if original is None:
+            return None
+        try:
+            seq = self._compensate(original, 1, self._REDO, time)
+        except ValueError as e:
+            raise ValueError(f"Cannot redo event #{original}: {e}") from e
+        self._active[int(self._kind[original])].append(self._redo.pop())
+        self._undone.discard(original)
+        return seq
+
+    def extend(self, events) -> None:
+        '''
+        Append already-recorded events (to_frame() rows or event() dicts) as they are, e.g. a journal tail
+        on top of a restored ledger. Their stored position changes are applied without revalidation.
+        '''
+        for event in (events.to_dict(orient='records') if isinstance(events, pd.DataFrame) else events):
+            kind = self.kinds.index(event['kind'])
+            reverses = int(event['reverses'])
+            seq = self._append(kind, int(event['instrument']), event['quantity'], event['price'], event['unit_price_change'],
+                               event['cost_change'], time=event['time'], reverses=reverses)
+            if kind == self._UNDO:
+                self._active[int(self._kind[reverses])].remove(reverses)
+                self._redo.append(reverses)
+                self._undone.add(reverses)
+            elif kind == self._REDO:
+                self._redo.remove(reverses)
+                self._active[int(self._kind[reverses])].append(reverses)
+                self._undone.discard(reverses)
+            else:
+                self._active[kind].append(seq)
+                self._redo.clear()
+
+    def event(self, seq: int) -> dict:
+        '''
+        One event as a dict of its columns, with the instrument resolved to its asset and the kind to its name.
+        '''
+        values = dict(zip(self.columns, (pd.Timestamp(int(self._time[seq])), self.kinds[self._kind[seq]], int(self._instrument[seq]),
+                                         float(self._quantity[seq]), float(self._price[seq]), float(self._unit_price_change[seq]),
+                                         float(self._cost_change[seq]), int(self._reverses[seq]))))
+        values['asset'] = self._assets[values['instrument']]
+        return values
+
+    def undone(self) -> np.ndarray:
+        '''
+        Boolean mask over events: True for trades, auto-sales and reinvestments that are currently undone.
+        '''
+        mask = np.zeros(self._size, dtype=bool)
+        mask[list(self._undone)] = True
+        return mask
+
+    def _state_at(self, seq: int) -> np.ndarray:
+        # Nearest snapshot on either side of seq, then add (or take back) the events in between in one bincount each
+        n = len(self._assets)
+        position = np.searchsorted(self._snapshot_seq, seq, side='right') - 1
+        if position + 1 < len(self._snapshot_seq) and self._snapshot_seq[position + 1] - seq < seq - self._snapshot_seq[position]:
+            position += 1
+        start = self._snapshot_seq[position]
+        state = np.zeros((3, n))
+        snapshot = self._snapshots[position]
+        state[:, :snapshot.shape[1]] = snapshot
+        low, high, sign = (start, seq, 1) if start <= seq else (seq, start, -1)
+        instruments = self._instrument[low:high]
+        for row, column in enumerate((self._quantity, self._unit_price_change, self._cost_change)):
+            state[row] += sign * np.bincount(instruments, weights=column[low:high], minlength=n)
+        return state
+
+    def portfolio_at(self, seq: int = None) -> Portfolio:
+        '''
+        The book after the first seq events (all of them by default) as a new Portfolio. Costs one snapshot
+        plus at most snapshot_every / 2 events, however long the history.
+        '''
+        seq = self._size if seq is None else int(seq)
+        if not 0 <= seq <= self._size:
+            raise ValueError("Sequence number out of range.")
+        quantity, price_per_unit, total_investment = self._state_at(seq)
+        slots = np.flatnonzero(quantity > 0)
+        portfolio = Portfolio(capacity=len(slots))
+        if self.portfolio is not None:
+            # Keep the live portfolio's instrument ids
+            portfolio._ids = dict(self.portfolio._ids)
+            portfolio._used_ids = set(self.portfolio._used_ids)
+        portfolio._load(zip([self._assets[slot] for slot in slots], quantity[slots].tolist(),
+                            price_per_unit[slots].tolist(), total_investment[slots].tolist()))
+        return portfolio
+
+    def as_of(self, time) -> Portfolio:
+        '''
+        The book as of a timestamp (events are assumed to be recorded in time order).
+        '''
+        return self.portfolio_at(np.searchsorted(self._time[:self._size], pd.Timestamp(time).value, side='right'))
+
+    def to_frame(self) -> pd.DataFrame:
+        '''
+        Events as plain columns, one row per event in sequence order; instrument numbers index assets.
+        '''
+        n = self._size
+        return pd.DataFrame({
+            'time': self._time[:n].astype('datetime64[ns]'),
+            'kind': pd.Categorical.from_codes(self._kind[:n], self.kinds),
+            'instrument': self._instrument[:n].copy(),
+            'quantity': self._quantity[:n].copy(),
+            'price': self._price[:n].copy(),
+            'unit_price_change': self._unit_price_change[:n].copy(),
+            'cost_change': self._cost_change[:n].copy(),
+            'reverses': self._reverses[:n].copy(),
+        })
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, assets, portfolio: Portfolio = None, snapshot_every: int = 4096) -> 'TradeLedger':
+        '''
+        Rebuild a ledger from to_frame() output without replaying it event by event. assets maps instrument
+        numbers back to assets. When portfolio is given it is taken as the book after the last event (the
+        opening snapshot is derived from it) and stays bound; otherwise the book starts empty and a new
+        portfolio is built.
+        '''
+        n = len(df)
+        ledger = cls(assets=assets, snapshot_every=snapshot_every, capacity=n)
+        ledger._time[:n] = pd.to_datetime(df['time']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        kind = df['kind']
+        ledger._kind[:n] = kind.cat.codes if isinstance(kind.dtype, pd.CategoricalDtype) else pd.Index(ledger.kinds).get_indexer(kind)
+        ledger._instrument[:n] = df['instrument'].to_numpy(dtype=np.int64)
+        for name in ('quantity', 'price', 'unit_price_change', 'cost_change'):
+            getattr(ledger, '_' + name)[:n] = df[name].to_numpy(dtype=float)
+        ledger._reverses[:n] = df['reverses'].to_numpy(dtype=np.int64)
+        ledger._size = n
+        if portfolio is not None:
+            final = [(ledger._slot_for(asset), values) for asset, values in zip(portfolio.keys, zip(
+                portfolio.quantity.tolist(), portfolio.price_per_unit.tolist(), portfolio.total_investment.tolist()))]
+        slots = len(ledger._assets)
+        totals = np.vstack([np.bincount(ledger._instrument[:n], weights=column[:n], minlength=slots)
+                            for column in (ledger._quantity, ledger._unit_price_change, ledger._cost_change)])
+        ledger._snapshots[0] = np.zeros((3, slots))
+        if portfolio is not None:
+            for slot, values in final:
+                ledger._snapshots[0][:, slot] = values
+            ledger._snapshots[0] -= totals
+        # Intermediate snapshots, one bincount per block of events
+        state = ledger._snapshots[0].copy()
+        for start in range(0, n - n % ledger.snapshot_every, ledger.snapshot_every):
+            instruments = ledger._instrument[start:start + ledger.snapshot_every]
+            for row, column in enumerate((ledger._quantity, ledger._unit_price_change, ledger._cost_change)):
+                state[row] += np.bincount(instruments, weights=column[start:start + ledger.snapshot_every], minlength=slots)
+            ledger._snapshot_seq.append(start + ledger.snapshot_every)
+            ledger._snapshots.append(state.copy())
+        ledger._state[:, :slots] = ledger._snapshots[0] + totals
+        ledger._rebuild_stacks()
+        ledger.portfolio = portfolio if portfolio is not None else ledger.portfolio_at()
+        return ledger
+
+    def _rebuild_stacks(self):
+        # Replay only the compensating events: a recorded event between two of them clears the redo stack
+        undone, stack, previous = set(), [], -1
+        for seq in np.flatnonzero(self._kind[:self._size] >= self._UNDO).tolist():
+            if seq - previous > 1:
+                stack.clear()
+            original = int(self._reverses[seq])
+            if self._kind[seq] == self._UNDO:
+                undone.add(original)
+                stack.append(original)
+            else:
+                undone.discard(original)
+                stack.pop()
+            previous = seq
+        if self._size - 1 > previous:
+            stack.clear()
+        self._redo = stack
+        self._undone = undone
+        kinds = self._kind[:self._size]
+        for kind in self._active:
+            self._active[kind] = [seq for seq in np.flatnonzero(kinds == kind).tolist() if seq not in undone]
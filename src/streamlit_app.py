@@ -1,12 +1,19 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-from fixed_income import Bond, bootstrap_yield_curve, simulate_yield_shift
-from portfolio import Portfolio
-from analysis import simulate_portfolio_paths, calculate_var
+from fixed_income import BondBook, bootstrap_yield_curve, simulate_yield_shift
+from portfolio import Portfolio, TradeLedger
+from persistence import SessionJournal, save_state, load_state
+from utils import ingest_positions
+from compliance import ComplianceEngine
+from analysis import (simulate_portfolio_paths, simulate_portfolio_paths_parallel, simulate_portfolio_paths_delta_gamma,
+                      key_rate_sensitivities, parametric_var, calculate_var, risk_measures, stream_var, HistoricalVaR,
+                      simulate_portfolio_paths_vr, weighted_var, var_convergence)
 import plotly.express as px
 import plotly.graph_objects as go
 import time
+import os
+import io
 
 st.set_page_config(page_title="Fixed Income Portfolio Dashboard", layout="wide")
 
@@ -31,6 +38,17 @@ with st.sidebar.expander("User Preferences", expanded=False):
     st.session_state['default_trade_size'] = st.number_input("Default Trade Size", min_value=1, value=st.session_state['default_trade_size'])
     st.session_state['theme_pref'] = st.radio("Theme Preference", ["Light", "Dark"], index=0 if st.session_state['theme_pref']=="Light" else 1)
 
+# --- Diversification Limits ---
+if 'compliance_limits' not in st.session_state:
+    st.session_state['compliance_limits'] = {'position_limit': 0.05, 'sector_limit': 0.20, 'exempt_sectors': ('real estate',)}
+
+with st.sidebar.expander("Diversification Limits", expanded=False):
+    limits = st.session_state['compliance_limits']
+    limits['position_limit'] = st.number_input("Max Weight per Bond %", min_value=0.1, max_value=99.0, value=limits['position_limit'] * 100, step=0.5) / 100
+    limits['sector_limit'] = st.number_input("Max Weight per Sector %", min_value=0.1, max_value=99.0, value=limits['sector_limit'] * 100, step=1.0) / 100
+    exempt = st.text_input("Exempt Sectors (comma-separated)", value=", ".join(limits['exempt_sectors']))
+    limits['exempt_sectors'] = tuple(sector.strip().lower() for sector in exempt.split(',') if sector.strip())
+
 # --- Theme toggle ---
 theme = st.session_state['theme_pref']
 if theme == "Dark":
@@ -65,34 +83,109 @@ if 'portfolio' not in st.session_state:
     st.session_state['portfolio'] = None
 if 'bonds' not in st.session_state:
     st.session_state['bonds'] = None
-if 'trade_history' not in st.session_state:
-    st.session_state['trade_history'] = []
+if 'ledger' not in st.session_state:
+    st.session_state['ledger'] = None
+
+def current_ledger():
+    # Ledger bound to the session's portfolio, started afresh whenever the portfolio object is replaced
+    ledger = st.session_state['ledger']
+    if ledger is None or ledger.portfolio is not st.session_state['portfolio']:
+        bonds = st.session_state['bonds']
+        ledger = TradeLedger(st.session_state['portfolio'], bonds if bonds is not None else [])
+        st.session_state['ledger'] = ledger
+    return ledger
+
+def current_compliance():
+    # Compliance engine over the session's holdings, kept current by the ledger's events; rebuilt when the ledger is replaced
+    if st.session_state['portfolio'] is None or st.session_state['bonds'] is None:
+        return None
+    ledger = current_ledger()
+    engine = st.session_state.get('compliance')
+    limits = st.session_state['compliance_limits']
+    if engine is None or st.session_state.get('compliance_ledger') is not ledger:
+        engine = ComplianceEngine.from_portfolio(st.session_state['portfolio'], st.session_state['bonds'], **limits)
+        ledger.subscribe(engine.apply)
+        st.session_state['compliance'] = engine
+        st.session_state['compliance_ledger'] = ledger
+    engine.position_limit = limits['position_limit']
+    engine.sector_limit = limits['sector_limit']
+    if engine.exempt_sectors != tuple(sorted(set(limits['exempt_sectors']))):
+        engine.set_exempt(limits['exempt_sectors'])
+    return engine
+
+def describe_breaches(breaches):
+    return "; ".join(f"{b['level']} {b['key']} at {b['weight']:.2%} (limit {b['limit']:.0%})" for b in breaches)
+
+def cash_allows(target, sign):
+    # Undo (sign -1) or redo (sign 1) of ledger event target: auto-sales and reinvestments move reinvestable cash,
+    # so their compensation must be covered by it
+    event = current_ledger().event(target)
+    needed = sign * event['quantity'] * event['price']
+    if event['kind'] != 'trade' and needed > st.session_state['reinvestable_money'] + 1e-9:
+        st.warning(f"Not enough reinvestable cash (${needed:,.2f} needed) to reverse {event['kind'].replace('_', '-')} #{target}.")
+        return False
+    return True
+
+def ledger_log(kind):
+    # Events of one kind as a display table; Bond # is the ledger's instrument number (the bond's row)
+    ledger = st.session_state['ledger']
+    if ledger is None or not len(ledger):
+        return pd.DataFrame()
+    events = ledger.to_frame()
+    events['undone'] = ledger.undone()
+    events = events[events['kind'] == kind]
+    return pd.DataFrame({
+        'Time': events['time'],
+        'Action': np.where(events['quantity'] > 0, 'Buy', 'Sell'),
+        'Bond': "Bond #" + events['instrument'].astype(str),
+        'Quantity': events['quantity'].abs(),
+        'Price': events['price'],
+        'Amount': (events['quantity'] * events['price']).abs(),
+        'Undone': events['undone'],
+    })
 trade_action = st.sidebar.selectbox("Action", ["Buy", "Sell"])
 trade_bond = st.sidebar.text_input("Bond Index (row #)", value="0")
 trade_qty = st.sidebar.number_input("Quantity", min_value=1, value=st.session_state['default_trade_size'])
-import json as _json
+if 'journal' not in st.session_state:
+    st.session_state['journal'] = SessionJournal("autosave_session")
+    st.session_state['autosaved'] = {}
 
-def autosave_session():
-    export_state = {
-        'positions': [
-            {
-                'bond': f"Bond #{i}",
-                'maturity': getattr(b, 'maturity', '?'),
-                'coupon_rate': getattr(b, 'coupon_rate', '?'),
-                'quantity': st.session_state['portfolio'].assets.get(b, {}).get('quantity', 0),
-                'avg_cost': st.session_state['portfolio'].assets.get(b, {}).get('price_per_unit', '?'),
-                'sector': None
-            }
-            for i, b in enumerate(st.session_state.get('bonds', []))
-        ],
-        'reinvestable_money': st.session_state.get('reinvestable_money', 0.0),
-        'auto_sale_log': st.session_state.get('auto_sale_log', []),
-        'reinvestment_log': st.session_state.get('reinvestment_log', []),
-        'activity_feed': st.session_state.get('activity_feed', []),
-        'trade_history': st.session_state.get('trade_history', [])
+def session_snapshot():
+    # Full session state for a journal snapshot, with positions aligned to the bond rows
+    bonds = st.session_state['bonds']
+    book = bonds if isinstance(bonds, BondBook) else BondBook.from_bonds(bonds)
+    held = st.session_state['portfolio'].assets
+    positions = [held.get(b, {}) for b in bonds]
+    return {
+        'bonds': {name: np.asarray(values) for name, values in book.to_frame().items()},
+        'positions': {name: np.array([p.get(name, 0.0) for p in positions], dtype=float) for name in Portfolio.columns},
+        'ledger': {name: values.to_numpy() for name, values in current_ledger().to_frame().astype({'kind': str}).items()},
+        'reinvestable_money': float(st.session_state.get('reinvestable_money', 0.0)),
+        'activity_feed': list(st.session_state.get('activity_feed', [])),
     }
-    with open("autosave_session.json", "w", encoding="utf-8") as f:
-        _json.dump(export_state, f, default=str)
+
+def autosave_session():
+    # Journal only what changed since the last save: new ledger events, the cash balance and new activity entries.
+    # A new book (or a shortened feed) is written as a fresh snapshot; a long journal is compacted in the background.
+    journal = st.session_state['journal']
+    saved = st.session_state['autosaved']
+    ledger = current_ledger()
+    feed = st.session_state.get('activity_feed', [])
+    cash = float(st.session_state.get('reinvestable_money', 0.0))
+    if saved.get('ledger') is not ledger or len(feed) < saved['activity']:
+        journal.compact(session_snapshot())
+    else:
+        for seq in range(saved['events'], len(ledger)):
+            event = ledger.event(seq)
+            del event['asset']
+            journal.append({'type': 'event', **event})
+        if cash != saved['cash']:
+            journal.append({'type': 'cash', 'value': cash})
+        for message in feed[saved['activity']:]:
+            journal.append({'type': 'activity', 'message': message})
+        if journal.needs_compaction:
+            journal.compact(session_snapshot())
+    saved.update(ledger=ledger, events=len(ledger), cash=cash, activity=len(feed))
 
 if st.sidebar.button("Execute Trade"):
     try:
@@ -101,19 +194,14 @@ if st.sidebar.button("Execute Trade"):
             bond = st.session_state['bonds'][idx]
             if st.session_state['portfolio'] is not None:
                 if trade_action == "Buy":
-                    st.session_state['portfolio'].add_asset(bond, trade_qty, bond.price)
+                    # O(1) pre-trade check against the diversification limits; manual trades are warned, not blocked
+                    breaches = current_compliance().check(bond, trade_qty)
+                    if breaches:
+                        st.sidebar.warning(f"Trade breaches diversification limits: {describe_breaches(breaches)}")
+                    current_ledger().buy(bond, trade_qty, bond.market_price)
                 else:
-                    st.session_state['portfolio'].remove_asset(bond, trade_qty)
-                st.session_state['trade_history'].append({
-                    'Time': pd.Timestamp.now(),
-                    'Action': trade_action,
-                    'Bond': f"Bond #{idx}",
-                    'Maturity': getattr(bond, 'maturity', '?'),
-                    'Coupon': getattr(bond, 'coupon_rate', '?'),
-                    'Quantity': trade_qty,
-                    'Price': bond.price
-                })
-                log_activity(f"{trade_action} {trade_qty} of Bond #{idx} at {bond.price}")
+                    current_ledger().sell(bond, trade_qty, bond.market_price)
+                log_activity(f"{trade_action} {trade_qty} of Bond #{idx} at {bond.market_price}")
                 autosave_session()
                 st.sidebar.success(f"{trade_action} {trade_qty} of bond #{idx} executed.")
                 # Notification for large trade
@@ -128,28 +216,30 @@ if st.sidebar.button("Execute Trade"):
 # --- Restore Last Session ---
 if st.sidebar.button("Restore Last Session"):
     try:
-        with open("autosave_session.json", "r", encoding="utf-8") as f:
-            import_state = _json.load(f)
-        # Restore positions
-        if 'positions' in import_state:
-            bonds = []
-            assets = {}
-            for pos in import_state['positions']:
-                bond = Bond(100, float(pos['coupon_rate']), float(pos['maturity']), 1)
-                bonds.append(bond)
-                assets[bond] = {
-                    'quantity': int(pos['quantity']),
-                    'price_per_unit': float(pos['avg_cost']),
-                    'total_investment': int(pos['quantity']) * float(pos['avg_cost'])
-                }
-            st.session_state['bonds'] = bonds
-            st.session_state['portfolio'] = Portfolio([])
-            st.session_state['portfolio'].assets = assets
-        st.session_state['reinvestable_money'] = import_state.get('reinvestable_money', 0.0)
-        st.session_state['auto_sale_log'] = import_state.get('auto_sale_log', [])
-        st.session_state['reinvestment_log'] = import_state.get('reinvestment_log', [])
-        st.session_state['activity_feed'] = import_state.get('activity_feed', [])
-        st.session_state['trade_history'] = import_state.get('trade_history', [])
+        # Latest snapshot plus the journal records written after it
+        state, tail = st.session_state['journal'].load()
+        if state is None:
+            raise ValueError("no autosaved session found")
+        bonds = BondBook.from_frame(pd.DataFrame(state['bonds']))
+        positions = pd.DataFrame(state['positions'])
+        held = np.flatnonzero(positions['quantity'].to_numpy() > 0)
+        portfolio = Portfolio([])
+        portfolio.assets = {bonds[i]: positions.iloc[i].to_dict() for i in held}
+        ledger = TradeLedger.from_frame(pd.DataFrame(state['ledger']), bonds, portfolio)
+        ledger.extend(record for record in tail if record['type'] == 'event')
+        cash = state['reinvestable_money']
+        feed = list(state['activity_feed'])
+        for record in tail:
+            if record['type'] == 'cash':
+                cash = record['value']
+            elif record['type'] == 'activity':
+                feed.append(record['message'])
+        st.session_state['bonds'] = bonds
+        st.session_state['portfolio'] = portfolio
+        st.session_state['ledger'] = ledger
+        st.session_state['reinvestable_money'] = cash
+        st.session_state['activity_feed'] = feed
+        st.session_state['autosaved'] = {'ledger': ledger, 'events': len(ledger), 'cash': cash, 'activity': len(feed)}
         st.sidebar.success("Last session restored.")
     except Exception as e:
         st.sidebar.error(f"Restore failed: {e}")
@@ -171,8 +261,8 @@ if st.sidebar.button("Submit Feedback"):
 # --- Trade Blotter ---
 st.sidebar.markdown("---")
 st.sidebar.subheader("Order History / Trade Blotter")
-if st.session_state['trade_history']:
-    trade_df = pd.DataFrame(st.session_state['trade_history'])
+trade_df = ledger_log('trade')
+if not trade_df.empty:
     st.sidebar.dataframe(trade_df.tail(10), use_container_width=True)
     csv_trades = trade_df.to_csv(index=False).encode('utf-8')
     st.sidebar.download_button("Download Trade History (CSV)", csv_trades, "trade_history.csv", "text/csv")
@@ -182,8 +272,6 @@ else:
 # --- Reinvestable Money State ---
 if 'reinvestable_money' not in st.session_state:
     st.session_state['reinvestable_money'] = 0.0
-if 'auto_sale_log' not in st.session_state:
-    st.session_state['auto_sale_log'] = []
 
 # --- Tabs ---
 tabs = st.tabs(["Data Input", "Curves", "Portfolio", "Scenarios", "Risk & VaR", "Reinvestable Money"])
@@ -197,29 +285,48 @@ with tabs[0]:
     portfolio = None
     if data_file is not None:
         try:
-            df = pd.read_csv(data_file)
-            required_cols = {"maturity", "coupon_rate", "price", "position_notional"}
-            if not required_cols.issubset(df.columns):
-                st.error(f"CSV must contain columns: {required_cols}")
-                log_step("CSV missing required columns.")
-                st.stop()
-            # Check numeric types
-            for col in required_cols:
-                if not pd.api.types.is_numeric_dtype(df[col]):
-                    st.error(f"Column '{col}' must be numeric.")
-                    log_step(f"Column '{col}' is not numeric.")
-                    st.stop()
-            # Build Bond objects
-            bonds = []
-            for _, row in df.iterrows():
-                bond = Bond(100, row["coupon_rate"], row["maturity"], 1)  # Assume face=100, annual
-                bond.price = row["price"]  # Assign market price
-                bonds.append(bond)
-            notionals = df["position_notional"].values
-            portfolio = Portfolio(list(zip(bonds, notionals)))
-            st.session_state['portfolio'] = portfolio
-            st.session_state['bonds'] = bonds
-            log_step("Portfolio and bonds loaded successfully.")
+            upload_id = getattr(data_file, 'file_id', data_file.name)
+            if st.session_state.get('upload_id') == upload_id and st.session_state['portfolio'] is not None:
+                # Same upload on a rerun: keep the traded book and its ledger
+                bonds = st.session_state['bonds']
+                portfolio = st.session_state['portfolio']
+                df = st.session_state['positions_df']
+                report = st.session_state['ingest_report']
+            else:
+                # Stream the file in chunks: typed columns, vectorized row checks, valid rows go straight into the book
+                status = st.empty()
+                bonds, notionals, report = ingest_positions(
+                    data_file, progress=lambda rows, rate: status.text(f"Read {rows:,} rows ({rate:,.0f} rows/sec)"))
+                status.empty()
+                if bonds is None:
+                    st.session_state['portfolio'] = None
+                    st.session_state['bonds'] = None
+                    st.session_state['upload_id'] = None
+                    bonds = None
+                else:
+                    df = bonds.to_frame().assign(position_notional=notionals)
+                    if 'sector' not in report['columns']:
+                        df = df.drop(columns='sector')
+                    portfolio = Portfolio.from_frame(pd.DataFrame({'instrument_id': bonds.id, 'quantity': notionals,
+                                                                   'price_per_unit': bonds.price, 'total_investment': notionals * bonds.price}),
+                                                     instruments=bonds)
+                    st.session_state['portfolio'] = portfolio
+                    st.session_state['bonds'] = bonds
+                    st.session_state['positions_df'] = df
+                    st.session_state['upload_id'] = upload_id
+                st.session_state['ingest_report'] = report
+            st.caption(f"{report['rows']:,} rows in {report['seconds']:.2f}s ({report['rows_per_sec']:,.0f} rows/sec): "
+                       f"{report['valid']:,} valid, {report['invalid']:,} rejected.")
+            if report['error_count']:
+                st.warning(f"{report['error_count']:,} validation errors; rejected rows were skipped.")
+                st.dataframe(report['errors'], use_container_width=True)
+                st.download_button("Download Validation Errors (CSV)", report['errors'].to_csv(index=False).encode('utf-8'),
+                                   "validation_errors.csv", "text/csv")
+            if bonds is None:
+                st.error("No valid positions to load.")
+                log_step("CSV had no valid positions.")
+            else:
+                log_step("Portfolio and bonds loaded successfully.")
         except Exception as e:
             st.error(f"Error loading CSV: {e}")
             log_step(f"Error loading CSV: {e}")
@@ -243,7 +350,7 @@ with tabs[2]:
     if portfolio is not None and bonds is not None:
         spot_df = bootstrap_yield_curve(bonds)
         summary = portfolio.summary(spot_df.dropna(subset=["spot_rate"]))
-        st.dataframe(summary.style.format({"Market Value": ".2f", "Weight %": ".2f", "Duration %": ".2f", "Convexity %": ".2f", "DV01": ".4f"}))
+        st.dataframe(summary.style.format({"Price": "{:.4f}", "Market Value": "{:,.2f}", "Weight %": "{:.2f}", "Macaulay Duration": "{:.2f}", "Modified Duration": "{:.2f}", "Convexity": "{:.2f}", "DV01": "{:.4f}"}))
         orig_value = portfolio.total_value(spot_df.dropna(subset=['spot_rate']))
         orig_dv01 = portfolio.portfolio_dv01(spot_df.dropna(subset=['spot_rate']))
         st.metric("Total Portfolio Value", f"{orig_value:,.2f}")
@@ -256,19 +363,20 @@ with tabs[2]:
         if show_pos:
             st.subheader("Current Positions")
             pos_data = []
+            held = portfolio.assets
             for i, bond in enumerate(bonds):
                 asset = bond
-                pos = portfolio.assets.get(asset, {})
+                pos = held.get(asset, {})
                 qty = pos.get('quantity', 0)
-                avg_cost = pos.get('price_per_unit', bond.price)
-                mkt_val = qty * bond.price
+                avg_cost = pos.get('price_per_unit', bond.market_price)
+                mkt_val = qty * bond.market_price
                 pos_data.append({
                     'Bond': f"Bond #{i}",
                     'Maturity': getattr(bond, 'maturity', '?'),
                     'Coupon': getattr(bond, 'coupon_rate', '?'),
                     'Quantity': qty,
                     'Avg Cost': avg_cost,
-                    'Market Price': bond.price,
+                    'Market Price': bond.market_price,
                     'Market Value': mkt_val,
                     'Unrealized PnL': mkt_val - qty * avg_cost
                 })
@@ -303,78 +411,34 @@ with tabs[2]:
         # Diversification Button
         st.markdown("---")
         if st.button("Check Diversification"):
-            # Check for sector column
+            engine = current_compliance()
             if "sector" not in df.columns:
-                st.warning("Portfolio CSV must include a 'sector' column for sector diversification checks.")
-            else:
-                # Bond/stock level: no more than 5% (except real estate)
-                over_5 = summary[(summary["Weight %"] > 5) & (~df["sector"].str.lower().eq("real estate"))]
-                # Sector level: no more than 20% (except real estate)
-                sector_weights = df.groupby(df["sector"].str.lower())["position_notional"].sum() / df["position_notional"].sum() * 100
-                over_20 = sector_weights[(sector_weights > 20) & (sector_weights.index != "real estate")]
+                st.warning("Portfolio CSV must include a 'sector' column for sector diversification checks; checking single-bond limits only.")
+            violations = engine.scan()
+            if not violations.empty:
+                st.error("Diversification rule violated. Selling excess and moving proceeds to Reinvestable Money tab:")
+                st.dataframe(violations, use_container_width=True)
                 auto_sale = False
-                if not over_5.empty or not over_20.empty:
-                    st.error("Diversification rule violated. Selling excess and moving proceeds to Reinvestable Money tab:")
-                    # Sell excess in bonds/stocks
-                    for idx in over_5.index:
-                        bond_row = df.iloc[idx]
-                        bond = bonds[idx]
-                        # Calculate excess %
-                        excess_pct = summary.loc[idx, "Weight %"] - 5
-                        excess_notional = excess_pct / 100 * df["position_notional"].sum()
-                        price = bond.price
-                        qty_to_sell = int(np.floor(excess_notional / price))
-                        if qty_to_sell > 0:
-                            try:
-                                st.session_state['portfolio'].remove_asset(bond, qty_to_sell)
-                                proceeds = qty_to_sell * price
-                                st.session_state['reinvestable_money'] += proceeds
-                                st.session_state['auto_sale_log'].append({
-                                    'Time': pd.Timestamp.now(),
-                                    'Bond': f"Bond #{idx}",
-                                    'Sector': bond_row['sector'],
-                                    'Quantity Sold': qty_to_sell,
-                                    'Proceeds': proceeds
-                                })
-                                st.write(f"Sold {qty_to_sell} of Bond #{idx} ({bond_row['sector']}) for ${proceeds:,.2f}")
-                                auto_sale = True
-                            except Exception as e:
-                                st.warning(f"Auto-sale error for Bond #{idx}: {e}")
-                    # Sell excess in sectors
-                    for sector, pct in over_20.items():
-                        sector_mask = df["sector"].str.lower() == sector
-                        sector_df = df[sector_mask]
-                        sector_bonds = [bonds[i] for i in sector_df.index]
-                        sector_notional = sector_df["position_notional"].sum()
-                        excess_pct = pct - 20
-                        excess_notional = excess_pct / 100 * df["position_notional"].sum()
-                        # Sell proportionally from all bonds in sector
-                        for i, bond in zip(sector_df.index, sector_bonds):
-                            bond_row = df.loc[i]
-                            bond_notional = bond_row["position_notional"]
-                            sell_notional = min(bond_notional, excess_notional * (bond_notional / sector_notional))
-                            price = bond.price
-                            qty_to_sell = int(np.floor(sell_notional / price))
-                            if qty_to_sell > 0:
-                                try:
-                                    st.session_state['portfolio'].remove_asset(bond, qty_to_sell)
-                                    proceeds = qty_to_sell * price
-                                    st.session_state['reinvestable_money'] += proceeds
-                                    st.session_state['auto_sale_log'].append({
-                                        'Time': pd.Timestamp.now(),
-                                        'Bond': f"Bond #{i}",
-                                        'Sector': bond_row['sector'],
-                                        'Quantity Sold': qty_to_sell,
-                                        'Proceeds': proceeds
-                                    })
-                                    st.write(f"Sold {qty_to_sell} of Bond #{i} ({bond_row['sector']}) for ${proceeds:,.2f}")
-                                    auto_sale = True
-                                except Exception as e:
-                                    st.warning(f"Auto-sale error for Bond #{i}: {e}")
-                    if auto_sale:
-                        st.info(f"Proceeds from auto-sales: ${st.session_state['reinvestable_money']:,.2f} (see 'Reinvestable Money' tab)")
-                else:
-                    st.success("Portfolio meets diversification requirements.")
+                # Smallest whole-unit sales that cure every breach: positions first, then sectors pro rata
+                for order in engine.cure_orders().itertuples():
+                    bond = bonds[order.row]
+                    price = bond.market_price
+                    try:
+                        current_ledger().sell(bond, order.quantity, price, kind='auto_sale')
+                        proceeds = order.quantity * price
+                        st.session_state['reinvestable_money'] += proceeds
+                        st.write(f"Sold {order.quantity:g} of Bond #{order.row} ({order.sector}) for ${proceeds:,.2f}")
+                        auto_sale = True
+                    except Exception as e:
+                        st.warning(f"Auto-sale error for Bond #{order.row}: {e}")
+                if auto_sale:
+                    autosave_session()
+                    st.info(f"Proceeds from auto-sales: ${st.session_state['reinvestable_money']:,.2f} (see 'Reinvestable Money' tab)")
+                remaining = engine.scan()
+                if not remaining.empty:
+                    st.warning(f"{len(remaining)} breaches remain after the sales; check again to cure them.")
+            else:
+                st.success("Portfolio meets diversification requirements.")
         log_step("Portfolio summary displayed.")
     else:
         st.info("Upload data in 'Data Input' tab.")
@@ -384,125 +448,63 @@ with tabs[5]:
     st.header("Reinvestable Money")
     # Summary dashboard
     st.metric("Available to Reinvest", f"${st.session_state['reinvestable_money']:,.2f}")
-    st.write(f"Auto-Sales: {len(st.session_state['auto_sale_log'])} | Reinvestments: {len(st.session_state.get('reinvestment_log', []))}")
-    # Diversification status
-    diversification_status = "Unknown"
-    if 'bonds' in st.session_state and st.session_state['bonds'] and 'portfolio' in st.session_state and st.session_state['portfolio']:
-        # Try to get latest weights
-        try:
-            spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-            summary = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-            df = None
-            for tab in tabs:
-                if hasattr(tab, 'data_file') and tab.data_file is not None:
-                    df = pd.read_csv(tab.data_file)
-                    break
-            if df is not None and "sector" in df.columns:
-                over_5 = summary[(summary["Weight %"] > 5) & (~df["sector"].str.lower().eq("real estate"))]
-                sector_weights = df.groupby(df["sector"].str.lower())["position_notional"].sum() / df["position_notional"].sum() * 100
-                over_20 = sector_weights[(sector_weights > 20) & (sector_weights.index != "real estate")]
-                if not over_5.empty or not over_20.empty:
-                    diversification_status = "Fail"
-                else:
-                    diversification_status = "Pass"
-        except Exception:
-            pass
+    st.write(f"Auto-Sales: {len(ledger_log('auto_sale'))} | Reinvestments: {len(ledger_log('reinvestment'))}")
+    # Diversification status and reinvestment suggestions, from the compliance engine's current exposures
+    engine = current_compliance()
+    diversification_status = "Unknown" if engine is None else ("Pass" if engine.scan().empty else "Fail")
     st.write(f"Diversification Status: **{diversification_status}**")
-    # Reinvestment suggestions
     st.subheader("Reinvestment Suggestions")
-    suggestions = []
-    if 'bonds' in st.session_state and st.session_state['bonds'] and 'portfolio' in st.session_state and st.session_state['portfolio']:
-        try:
-            spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-            summary = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-            if 'sector' in df.columns:
-                for idx, row in summary.iterrows():
-                    sector = df.iloc[idx]["sector"]
-                    if row["Weight %"] < 5 and sector.lower() != "real estate":
-                        suggestions.append(f"Bond #{idx} ({sector}): {row['Weight %']:.2f}% (underweight)")
-        except Exception:
-            pass
-    if suggestions:
+    underweight = np.array([], dtype=np.int64)
+    if engine is not None:
+        weights = engine.weights()
+        underweight = np.flatnonzero((engine.quantity > 0) & ~engine.position_exempt & (weights < engine.position_limit))
+    if len(underweight):
         st.write("Consider reinvesting in:")
-        for s in suggestions:
-            st.write(f"- {s}")
+        for idx in underweight:
+            st.write(f"- Bond #{idx} ({engine.sectors[engine.sector_code[idx]] or 'no sector'}): {weights[idx] * 100:.2f}% (underweight)")
     else:
-        st.write("No underweight bonds found (or missing sector data).")
+        st.write("No underweight bonds found.")
     # Auto-Reinvest button
     if st.session_state['reinvestable_money'] > 0 and st.session_state.get('bonds'):
         strategy = st.selectbox("Reinvestment Strategy", ["Proportional", "Fill Up Most Underweight First"])
         if st.button("Auto-Reinvest All"):
             try:
-                spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-                summary = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-                if 'sector' in df.columns:
-                    # Find eligible bonds
-                    eligible = [(i, row) for i, row in summary.iterrows() if row["Weight %"] < 5 and df.iloc[i]["sector"].lower() != "real estate"]
-                    if not eligible:
-                        st.info("No eligible bonds for reinvestment.")
-                    else:
-                        cash = st.session_state['reinvestable_money']
-                        reinvest_summary = []
-                        if strategy == "Proportional":
-                            total_weight_gap = sum(5 - row["Weight %"] for i, row in eligible)
-                            for i, row in eligible:
-                                bond = st.session_state['bonds'][i]
-                                price = bond.price
-                                gap = 5 - row["Weight %"]
-                                alloc = min(cash, cash * (gap / total_weight_gap)) if total_weight_gap > 0 else 0
-                                qty = int(np.floor(alloc / price))
-                                if qty > 0:
-                                    st.session_state['portfolio'].add_asset(bond, qty, price)
-                                    used = qty * price
-                                    st.session_state['reinvestable_money'] -= used
-                                    if 'reinvestment_log' not in st.session_state:
-                                        st.session_state['reinvestment_log'] = []
-                                    st.session_state['reinvestment_log'].append({
-                                        'Time': pd.Timestamp.now(),
-                                        'Bond': f"Bond #{i}",
-                                        'Quantity Bought': qty,
-                                        'Amount Used': used
-                                    })
-                                    cash = st.session_state['reinvestable_money']
-                                    reinvest_summary.append({
-                                        'Bond': f"Bond #{i}",
-                                        'Quantity Bought': qty,
-                                        'Amount Used': used
-                                    })
-                        else:  # Fill up most underweight first
-                            eligible_sorted = sorted(eligible, key=lambda x: x[1]["Weight %"])
-                            for i, row in eligible_sorted:
-                                bond = st.session_state['bonds'][i]
-                                price = bond.price
-                                gap = 5 - row["Weight %"]
-                                max_alloc = gap / 100 * df["position_notional"].sum()
-                                qty = int(np.floor(min(cash, max_alloc) / price))
-                                if qty > 0:
-                                    used = qty * price
-                                    st.session_state['portfolio'].add_asset(bond, qty, price)
-                                    st.session_state['reinvestable_money'] -= used
-                                    if 'reinvestment_log' not in st.session_state:
-                                        st.session_state['reinvestment_log'] = []
-                                    st.session_state['reinvestment_log'].append({
-                                        'Time': pd.Timestamp.now(),
-                                        'Bond': f"Bond #{i}",
-                                        'Quantity Bought': qty,
-                                        'Amount Used': used
-                                    })
-                                    cash = st.session_state['reinvestable_money']
-                                    reinvest_summary.append({
-                                        'Bond': f"Bond #{i}",
-                                        'Quantity Bought': qty,
-                                        'Amount Used': used
-                                    })
-                                if cash < price:
-                                    break
-                        st.success("Auto-reinvestment complete.")
-                        if reinvest_summary:
-                            st.write("Reinvestment Summary:")
-                            st.dataframe(pd.DataFrame(reinvest_summary))
-                        if cash > 0:
-                            st.info(f"${cash:,.2f} could not be reinvested due to 5% limit.")
+                if not len(underweight):
+                    st.info("No eligible bonds for reinvestment.")
+                else:
+                    cash = st.session_state['reinvestable_money']
+                    gaps = engine.position_limit - weights[underweight]
+                    if strategy == "Proportional":
+                        allocations = cash * gaps / gaps.sum()
+                        order = underweight
+                    else:  # Fill up most underweight first
+                        allocations = np.full(len(underweight), np.inf)
+                        order = underweight[np.argsort(weights[underweight], kind='stable')]
+                    reinvest_summary = []
+                    for i, alloc in zip(order, allocations):
+                        bond = st.session_state['bonds'][i]
+                        price = bond.market_price
+                        # Largest purchase the position and sector limits allow, as of the buys made so far
+                        qty = int(min(np.floor(min(alloc, cash) / price), engine.max_quantity(i)))
+                        if qty > 0:
+                            current_ledger().buy(bond, qty, price, kind='reinvestment')
+                            used = qty * price
+                            st.session_state['reinvestable_money'] -= used
+                            cash = st.session_state['reinvestable_money']
+                            reinvest_summary.append({
+                                'Bond': f"Bond #{i}",
+                                'Quantity Bought': qty,
+                                'Amount Used': used
+                            })
+                        if strategy != "Proportional" and cash < price:
+                            break
+                    autosave_session()
+                    st.success("Auto-reinvestment complete.")
+                    if reinvest_summary:
+                        st.write("Reinvestment Summary:")
+                        st.dataframe(pd.DataFrame(reinvest_summary))
+                    if cash > 0:
+                        st.info(f"${cash:,.2f} could not be reinvested within the diversification limits.")
             except Exception as e:
                 st.warning(f"Auto-reinvest error: {e}")
     # Reinvestment form
@@ -513,114 +515,108 @@ with tabs[5]:
             reinvest_bond_idx = st.selectbox("Select Bond to Reinvest In", options=list(range(len(st.session_state['bonds']))), format_func=lambda i: f"Bond #{i}" if st.session_state['bonds'] else "")
             reinvest_amt = st.number_input("Amount to Invest", min_value=1.0, max_value=st.session_state['reinvestable_money'], value=100.0, step=1.0)
             if st.button("Reinvest"):
-            # Before allocation
-            spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-            summary_before = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-            bond = st.session_state['bonds'][reinvest_bond_idx]
-            price = bond.price
-            qty = int(np.floor(reinvest_amt / price))
-            # Check if this would breach 5% limit (except real estate)
-            if 'sector' in df.columns and df.iloc[reinvest_bond_idx]["sector"].lower() != "real estate":
-            total_notional = df["position_notional"].sum() + qty * price
-            new_weight = (summary_before.loc[reinvest_bond_idx, "Market Value"] + qty * price) / total_notional * 100
-            if new_weight > 5:
-            st.warning("This reinvestment would breach the 5% per bond limit.")
-            qty = int(np.floor((0.05 * total_notional - summary_before.loc[reinvest_bond_idx, "Market Value"]) / price))
-            if qty > 0:
-            st.session_state['portfolio'].add_asset(bond, qty, price)
-            used = qty * price
-            st.session_state['reinvestable_money'] -= used
-            if 'reinvestment_log' not in st.session_state:
-            st.session_state['reinvestment_log'] = []
-            st.session_state['reinvestment_log'].append({
-            'Time': pd.Timestamp.now(),
-            'Bond': f"Bond #{reinvest_bond_idx}",
-            'Quantity Bought': qty,
-            'Amount Used': used
-            })
-            log_activity(f"Reinvested ${used:,.2f} into Bond #{reinvest_bond_idx} ({qty} units)")
-            # After allocation
-            spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-            summary_after = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-            st.success(f"Reinvested ${used:,.2f} into Bond #{reinvest_bond_idx} ({qty} units)")
-            # Show before/after pie chart
-            st.write("Allocation Before:")
-            fig_before = px.pie(summary_before, names=summary_before.index.astype(str), values="Weight %", title="Before")
-            st.plotly_chart(fig_before, use_container_width=True)
-            st.write("Allocation After:")
-            fig_after = px.pie(summary_after, names=summary_after.index.astype(str), values="Weight %", title="After")
-            st.plotly_chart(fig_after, use_container_width=True)
-            else:
-            st.warning("Amount too small to buy at least one unit or would breach diversification limit.")
-            # Undo last action
-            # Undo last action (choose type)
+                # Before allocation
+                spot_df = bootstrap_yield_curve(st.session_state['bonds'])
+                summary_before = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
+                bond = st.session_state['bonds'][reinvest_bond_idx]
+                price = bond.market_price
+                qty = int(np.floor(reinvest_amt / price))
+                # Pre-trade check; a breaching amount is cut to the most the limits allow
+                engine = current_compliance()
+                breaches = engine.check(bond, qty)
+                if breaches:
+                    st.warning(f"This reinvestment would breach the diversification limits: {describe_breaches(breaches)}")
+                    qty = int(min(qty, engine.max_quantity(bond)))
+                if qty > 0:
+                    current_ledger().buy(bond, qty, price, kind='reinvestment')
+                    used = qty * price
+                    st.session_state['reinvestable_money'] -= used
+                    log_activity(f"Reinvested ${used:,.2f} into Bond #{reinvest_bond_idx} ({qty} units)")
+                    autosave_session()
+                    # After allocation
+                    spot_df = bootstrap_yield_curve(st.session_state['bonds'])
+                    summary_after = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
+                    st.success(f"Reinvested ${used:,.2f} into Bond #{reinvest_bond_idx} ({qty} units)")
+                    # Show before/after pie chart
+                    st.write("Allocation Before:")
+                    fig_before = px.pie(summary_before, names=summary_before.index.astype(str), values="Weight %", title="Before")
+                    st.plotly_chart(fig_before, use_container_width=True)
+                    st.write("Allocation After:")
+                    fig_after = px.pie(summary_after, names=summary_after.index.astype(str), values="Weight %", title="After")
+                    st.plotly_chart(fig_after, use_container_width=True)
+                else:
+                    st.warning("Amount too small to buy at least one unit or would breach diversification limit.")
+            # Undo/redo last action: appends a compensating ledger event that reverses the position change
             undo_type = st.selectbox("Undo Last Action Type", ["Reinvestment", "Trade", "Auto-Sale", "Activity Log"])
-            if st.button("Undo Last Action"):
-            if undo_type == "Reinvestment" and st.session_state.get('reinvestment_log'):
-            st.session_state['reinvestment_log'].pop()
-            log_activity("Undid last reinvestment.")
-            elif undo_type == "Trade" and st.session_state.get('trade_history'):
-            st.session_state['trade_history'].pop()
-            log_activity("Undid last trade.")
-            elif undo_type == "Auto-Sale" and st.session_state.get('auto_sale_log'):
-            st.session_state['auto_sale_log'].pop()
-            log_activity("Undid last auto-sale.")
-            elif undo_type == "Activity Log" and st.session_state.get('activity_feed'):
-            st.session_state['activity_feed'].pop()
-            st.success(f"Last {undo_type} action undone (note: this only undoes the last entry of the selected type; for full undo, reload previous export).")
+            undo_kinds = {"Reinvestment": 'reinvestment', "Trade": 'trade', "Auto-Sale": 'auto_sale'}
+            col_undo, col_redo = st.columns(2)
+            seq = None
+            if col_undo.button("Undo Last Action"):
+                if undo_type == "Activity Log":
+                    if st.session_state.get('activity_feed'):
+                        st.session_state['activity_feed'].pop()
+                    st.success("Last activity log entry removed.")
+                else:
+                    target = current_ledger().undo_target(undo_kinds[undo_type])
+                    if target is None:
+                        st.info(f"No {undo_type} left to undo.")
+                    elif cash_allows(target, -1):
+                        try:
+                            seq = current_ledger().undo(undo_kinds[undo_type])
+                        except ValueError as e:
+                            st.warning(f"{e} Undo the later events on this bond first.")
+            if col_redo.button("Redo"):
+                target = current_ledger().redo_target()
+                if target is None:
+                    st.info("Nothing to redo.")
+                elif cash_allows(target, 1):
+                    try:
+                        seq = current_ledger().redo()
+                    except ValueError as e:
+                        st.warning(str(e))
+            if seq is not None:
+                event = current_ledger().event(seq)
+                original = current_ledger().event(event['reverses'])
+                if original['kind'] != 'trade':
+                    # Auto-sales and reinvestments move reinvestable cash; their compensation moves it back
+                    st.session_state['reinvestable_money'] -= event['quantity'] * event['price']
+                log_activity(f"{event['kind'].capitalize()} of {original['kind'].replace('_', '-')} #{event['reverses']} ({original['quantity']:+g} of Bond #{event['instrument']})")
+                autosave_session()
+                st.success(f"{event['kind'].capitalize()} applied: position in Bond #{event['instrument']} changed by {event['quantity']:+g}.")
         else:  # Sector reinvestment
-            sector_choices = sorted(set(df["sector"])) if "sector" in df.columns else []
+            engine = current_compliance()
+            sector_choices = sorted(sector for sector in engine.sectors if sector) if engine is not None else []
             sector = st.selectbox("Select Sector", sector_choices)
             reinvest_amt = st.number_input("Amount to Invest", min_value=1.0, max_value=st.session_state['reinvestable_money'], value=100.0, step=1.0, key="sector_amt")
             if st.button("Reinvest in Sector"):
                 # Before allocation
                 spot_df = bootstrap_yield_curve(st.session_state['bonds'])
                 summary_before = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-                sector_mask = df["sector"] == sector
-                sector_bond_idxs = list(df[sector_mask].index)
-                eligible = []
-                for idx in sector_bond_idxs:
-                    if sector.lower() == "real estate":
-                        eligible.append(idx)
-                    else:
-                        if summary_before.loc[idx, "Weight %"] < 5:
-                            eligible.append(idx)
-                if not eligible:
+                code = int(np.flatnonzero(engine.sectors == sector)[0])
+                exempt = engine.sector_exempt[code]
+                weights = engine.weights()
+                sector_rows = np.flatnonzero(engine.sector_code == code)
+                eligible = sector_rows if exempt else sector_rows[weights[sector_rows] < engine.position_limit]
+                if not len(eligible):
                     st.warning("No eligible bonds in this sector for reinvestment.")
                 else:
-                    total_gap = sum(5 - summary_before.loc[idx, "Weight %"] for idx in eligible) if sector.lower() != "real estate" else len(eligible)
+                    gaps = np.ones(len(eligible)) if exempt else engine.position_limit - weights[eligible]
                     cash = reinvest_amt
+                    allocations = cash * gaps / gaps.sum()
                     reinvest_summary = []
-                    for idx in eligible:
+                    for idx, alloc in zip(eligible, allocations):
                         bond = st.session_state['bonds'][idx]
-                        price = bond.price
-                        if sector.lower() == "real estate":
-                            alloc = cash / len(eligible)
-                        else:
-                            gap = 5 - summary_before.loc[idx, "Weight %"]
-                            alloc = min(cash, cash * (gap / total_gap)) if total_gap > 0 else 0
-                        qty = int(np.floor(alloc / price))
-                        # Check sector limit (except real estate)
-                        if sector.lower() != "real estate":
-                            total_notional = df["position_notional"].sum() + qty * price
-                            sector_notional = df[sector_mask]["position_notional"].sum() + qty * price
-                            new_sector_weight = sector_notional / total_notional * 100
-                            if new_sector_weight > 20:
-                                st.warning(f"This reinvestment would breach the 20% sector limit for {sector}.")
-                                continue
+                        price = bond.market_price
+                        qty = int(np.floor(min(alloc, cash) / price))
+                        # Pre-trade check against the bond and sector limits, as of the buys made so far
+                        breaches = engine.check(idx, qty)
+                        if breaches:
+                            st.warning(f"Reinvesting in Bond #{idx} would breach the diversification limits: {describe_breaches(breaches)}")
+                            qty = int(min(qty, engine.max_quantity(idx)))
                         if qty > 0:
-                            st.session_state['portfolio'].add_asset(bond, qty, price)
+                            current_ledger().buy(bond, qty, price, kind='reinvestment')
                             used = qty * price
                             st.session_state['reinvestable_money'] -= used
-                            if 'reinvestment_log' not in st.session_state:
-                                st.session_state['reinvestment_log'] = []
-                            st.session_state['reinvestment_log'].append({
-                                'Time': pd.Timestamp.now(),
-                                'Bond': f"Bond #{idx}",
-                                'Sector': sector,
-                                'Quantity Bought': qty,
-                                'Amount Used': used
-                            })
                             cash -= used
                             reinvest_summary.append({
                                 'Bond': f"Bond #{idx}",
@@ -629,6 +625,7 @@ with tabs[5]:
                                 'Amount Used': used
                             })
                     if reinvest_summary:
+                        autosave_session()
                         st.success(f"Reinvested in sector {sector}.")
                         # After allocation
                         spot_df = bootstrap_yield_curve(st.session_state['bonds'])
@@ -644,32 +641,28 @@ with tabs[5]:
                         st.warning("No reinvestment performed (limits would be breached or amount too small).")
     # Sector allocation chart (before/after if possible)
     st.subheader("Sector Allocation")
-    if 'bonds' in st.session_state and st.session_state['bonds'] and 'portfolio' in st.session_state and st.session_state['portfolio'] and 'sector' in df.columns:
-        spot_df = bootstrap_yield_curve(st.session_state['bonds'])
-        summary = st.session_state['portfolio'].summary(spot_df.dropna(subset=["spot_rate"]))
-        # Map bond index to sector
-        sector_map = {i: df.iloc[i]["sector"] for i in range(len(df))}
-        sector_alloc = {}
-        for i, row in summary.iterrows():
-            sector = sector_map.get(i, "Unknown")
-            sector_alloc[sector] = sector_alloc.get(sector, 0) + row["Weight %"]
-        sector_df = pd.DataFrame(list(sector_alloc.items()), columns=["Sector", "Weight %"])
+    engine = current_compliance()
+    if engine is not None and engine.total > 0:
+        sector_df = pd.DataFrame({'Sector': np.where(engine.sectors == '', 'Unlabeled', engine.sectors),
+                                  'Weight %': engine.sector_weights().to_numpy() * 100})
         # Highlight over/underweight
-        sector_df["Status"] = sector_df.apply(lambda r: "Overweight" if r["Sector"].lower() != "real estate" and r["Weight %"] > 20 else ("Underweight" if r["Sector"].lower() != "real estate" and r["Weight %"] < 20 else "OK"), axis=1)
-        fig_sector = px.pie(sector_df, names="Sector", values="Weight %", color="Status", color_discrete_map={"Overweight": "red", "Underweight": "orange", "OK": "green"}, title="Sector Allocation (Red: >20%, Orange: <20%, Green: Real Estate or OK)")
+        limit = engine.sector_limit * 100
+        sector_df["Status"] = np.where(engine.sector_exempt, "OK", np.where(sector_df["Weight %"] > limit, "Overweight",
+                                                                             np.where(sector_df["Weight %"] < limit, "Underweight", "OK")))
+        fig_sector = px.pie(sector_df, names="Sector", values="Weight %", color="Status", color_discrete_map={"Overweight": "red", "Underweight": "orange", "OK": "green"}, title=f"Sector Allocation (Red: >{limit:g}%, Orange: <{limit:g}%, Green: exempt or OK)")
         st.plotly_chart(fig_sector, use_container_width=True)
         st.dataframe(sector_df, use_container_width=True)
     # Reinvestment log
     st.subheader("Reinvestment Log")
-    if st.session_state.get('reinvestment_log'):
-        reinvest_df = pd.DataFrame(st.session_state['reinvestment_log'])
+    reinvest_df = ledger_log('reinvestment')
+    if not reinvest_df.empty:
         st.dataframe(reinvest_df, use_container_width=True)
         csv_reinv = reinvest_df.to_csv(index=False).encode('utf-8')
         st.download_button("Download Reinvestment Log (CSV)", csv_reinv, "reinvestment_log.csv", "text/csv")
     # Auto-sale log
     st.subheader("Auto-Sale Log")
-    if st.session_state['auto_sale_log']:
-        auto_sale_df = pd.DataFrame(st.session_state['auto_sale_log'])
+    auto_sale_df = ledger_log('auto_sale')
+    if not auto_sale_df.empty:
         st.dataframe(auto_sale_df, use_container_width=True)
         csv_auto = auto_sale_df.to_csv(index=False).encode('utf-8')
         st.download_button("Download Auto-Sale Log (CSV)", csv_auto, "auto_sale_log.csv", "text/csv")
@@ -677,49 +670,30 @@ with tabs[5]:
         st.info("No auto-sales yet.")
     # Export/import/reset/help
     st.subheader("Export/Import/Reset Portfolio State")
-    import json
-    export_state = {
-        'positions': [
-            {
-                'bond': f"Bond #{i}",
-                'maturity': getattr(b, 'maturity', '?'),
-                'coupon_rate': getattr(b, 'coupon_rate', '?'),
-                'quantity': st.session_state['portfolio'].assets.get(b, {}).get('quantity', 0),
-                'avg_cost': st.session_state['portfolio'].assets.get(b, {}).get('price_per_unit', '?'),
-                'sector': df.iloc[i]["sector"] if "sector" in df.columns else None
-            }
-            for i, b in enumerate(st.session_state['bonds'])
-        ],
-        'reinvestable_money': st.session_state['reinvestable_money'],
-        'auto_sale_log': st.session_state['auto_sale_log'],
-        'reinvestment_log': st.session_state.get('reinvestment_log', []),
-        'activity_feed': st.session_state.get('activity_feed', [])
-    }
-    st.download_button("Export Portfolio State (JSON)", json.dumps(export_state, default=str).encode('utf-8'), "portfolio_state.json", "application/json")
-    import_file = st.file_uploader("Import Portfolio State (JSON)", type=["json"], key="import_json")
-    if import_file is not None:
+    # Typed, schema-versioned binary state: bond terms (calls, sectors), positions, ledger, cash and activity feed
+    if st.session_state.get('bonds') and st.session_state.get('portfolio') is not None:
+        state_book = st.session_state['bonds']
+        if not isinstance(state_book, BondBook):
+            state_book = BondBook.from_bonds(state_book)
+        state_file = io.BytesIO()
+        try:
+            save_state(state_file, state_book, st.session_state['portfolio'], current_ledger(), st.session_state['reinvestable_money'],
+                       st.session_state.get('activity_feed', []), compress=True)
+            st.download_button("Export Portfolio State", state_file.getvalue(), "portfolio_state.npz", "application/octet-stream")
+        except ValueError as e:
+            st.warning(f"Export unavailable: {e}")
+    else:
+        st.info("Load a portfolio to export its state.")
+    import_file = st.file_uploader("Import Portfolio State (.npz)", type=["npz"], key="import_state")
+    if import_file is not None and st.session_state.get('imported_state') != getattr(import_file, 'file_id', import_file.name):
         try:
-            import_state = json.load(import_file)
-            # Restore positions
-            if 'positions' in import_state:
-                # Rebuild bonds and portfolio
-                bonds = []
-                assets = {}
-                for pos in import_state['positions']:
-                    bond = Bond(100, float(pos['coupon_rate']), float(pos['maturity']), 1)
-                    bonds.append(bond)
-                    assets[bond] = {
-                        'quantity': int(pos['quantity']),
-                        'price_per_unit': float(pos['avg_cost']),
-                        'total_investment': int(pos['quantity']) * float(pos['avg_cost'])
-                    }
-                st.session_state['bonds'] = bonds
-                st.session_state['portfolio'] = Portfolio([])
-                st.session_state['portfolio'].assets = assets
-            st.session_state['reinvestable_money'] = import_state.get('reinvestable_money', 0.0)
-            st.session_state['auto_sale_log'] = import_state.get('auto_sale_log', [])
-            st.session_state['reinvestment_log'] = import_state.get('reinvestment_log', [])
-            st.session_state['activity_feed'] = import_state.get('activity_feed', [])
+            import_state = load_state(import_file)
+            st.session_state['imported_state'] = getattr(import_file, 'file_id', import_file.name)
+            st.session_state['bonds'] = import_state['book']
+            st.session_state['portfolio'] = import_state['portfolio']
+            st.session_state['ledger'] = import_state['ledger']
+            st.session_state['reinvestable_money'] = import_state['reinvestable_money']
+            st.session_state['activity_feed'] = import_state['activity_feed']
             st.success("Portfolio state imported successfully.")
         except Exception as e:
             st.error(f"Import failed: {e}")
@@ -728,10 +702,11 @@ with tabs[5]:
             del st.session_state[k]
         st.experimental_rerun()
     with st.expander("Help & Guidance", expanded=False):
-        st.markdown("""
-        **Diversification Rules:**
-        - No more than 5% in any single bond/stock (except real estate)
-        - No more than 20% in any single sector (except real estate)
+        limits = st.session_state['compliance_limits']
+        st.markdown(f"""
+        **Diversification Rules** (set under Diversification Limits in the sidebar):
+        - No more than {limits['position_limit']:.0%} in any single bond/stock (except exempt sectors: {', '.join(limits['exempt_sectors']) or 'none'})
+        - No more than {limits['sector_limit']:.0%} in any single sector (except exempt sectors)
         
         **Reinvestment Options:**
         - Reinvest by bond or sector, with limits enforced
@@ -744,8 +719,8 @@ with tabs[5]:
         - Scenarios: Analyze yield curve shocks
         
         **Export/Import:**
-        - Export your full portfolio, cash, and logs as JSON
-        - Import to restore a previous session
+        - Export saves bond terms, positions, the trade ledger (with undo history), cash and the activity feed as one compressed .npz state file
+        - Import an .npz state file to restore that session
         - Reset clears all data and starts fresh
         """)
 
@@ -773,23 +748,86 @@ with tabs[4]:
     st.header("Risk & VaR")
     if portfolio is not None and bonds is not None:
         spot_df = bootstrap_yield_curve(bonds)
-        n_scenarios = st.number_input("# Scenarios", min_value=100, max_value=10000, value=1000, step=100)
+        n_scenarios = st.number_input("# Scenarios", min_value=100, max_value=1000000, value=1000, step=100)
         vol = st.number_input("Yield Curve Volatility (annual, %)", min_value=0.01, max_value=5.0, value=1.0, step=0.01) / 100
         dt = st.number_input("Time Step (years)", min_value=0.01, max_value=1.0, value=0.25, step=0.01)
         alpha = st.slider("VaR Confidence Level", min_value=0.90, max_value=0.99, value=0.95, step=0.01)
-        if st.button("Run Simulation"):
-            vals = simulate_portfolio_paths(portfolio, spot_df, int(n_scenarios), vol, dt)
-            pnl = vals - np.mean(vals)
-            # Plotly histogram for PnL
-            fig = px.histogram(pd.DataFrame({"PnL": pnl}), x="PnL", nbins=30, title="Simulated Portfolio P&L Distribution")
-            st.plotly_chart(fig, use_container_width=True)
-            var = calculate_var(vals, alpha)
-            st.metric(f"{int(alpha*100)}% VaR", f"{var:,.2f}")
+        valuation = st.radio("Valuation", ["Full revaluation", "Delta-gamma approximation", "Parametric (delta-normal)"], horizontal=True,
+                             help="Approximate modes reuse key-rate sensitivities computed once and update with the inputs.")
+        if valuation != "Full revaluation":
+            sensitivities = key_rate_sensitivities(portfolio, spot_df)
+            if valuation == "Parametric (delta-normal)":
+                var = parametric_var(portfolio, spot_df, vol, dt, alpha, sensitivities=sensitivities)
+                st.metric(f"{int(alpha*100)}% VaR (parametric)", f"{var:,.2f}")
+            else:
+                vals, report = simulate_portfolio_paths_delta_gamma(portfolio, spot_df, int(n_scenarios), vol, dt,
+                                                                    sensitivities=sensitivities, alpha=alpha)
+                fig = px.histogram(pd.DataFrame({"PnL": vals - np.mean(vals)}), x="PnL", nbins=30, title="Approximate Portfolio P&L Distribution")
+                st.plotly_chart(fig, use_container_width=True)
+                var = calculate_var(vals, alpha)
+                st.metric(f"{int(alpha*100)}% VaR (delta-gamma)", f"{var:,.2f}")
+                if report['n_checked']:
+                    st.caption(f"Approximation check on {report['n_checked']} fully revalued scenarios: RMSE {report['rmse']:,.2f}, "
+                               f"max error {report['max_abs_error']:,.2f} (P&L std {report['pnl_std']:,.2f}); "
+                               f"VaR full {report['var_full']:,.2f} vs approx {report['var_approx']:,.2f}.")
+            if var > 1000:  # Example threshold
+                st.warning(f"VaR exceeds threshold: {var:,.2f}")
+        seed = st.number_input("Random seed (reproducible runs)", min_value=0, value=0, step=1)
+        sampling = st.selectbox("Sampling", ["pseudo", "sobol", "halton", "antithetic"], help="Quasi-random (scrambled) and antithetic draws converge faster than plain pseudo-random ones.")
+        control_label = st.selectbox("Control variate", ["none", "duration", "delta_gamma"])
+        control_variate = None if control_label == "none" else control_label
+        variance_reduction = sampling != "pseudo" or control_variate is not None
+        if variance_reduction and st.button("Convergence Report"):
+            report = var_convergence(portfolio, spot_df, vol, dt, alpha, sampling=sampling, control_variate=control_variate, seed=int(seed))
+            st.dataframe(report.style.format({"var": "{:,.2f}", "std_error": "{:,.2f}"}))
+            st.line_chart(report.set_index("n_scenarios")["std_error"])
+        streaming = st.checkbox("Streaming mode (bounded memory, running VaR/ES estimates)", value=n_scenarios > 100000)
+        n_workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1)
+        if valuation == "Full revaluation" and st.button("Run Simulation"):
+            if streaming:
+                progress = st.progress(0.0)
+                running = st.empty()
+                for estimates in stream_var(portfolio, spot_df, int(n_scenarios), vol, dt, alphas=sorted({alpha, 0.99})):
+                    progress.progress(float(estimates['n_scenarios'].iloc[0] / n_scenarios))
+                    running.dataframe(estimates.style.format("{:,.2f}"))
+                var = estimates.loc[alpha, 'var']
+                st.metric(f"{int(alpha*100)}% VaR", f"{var:,.2f}")
+                st.metric(f"{int(alpha*100)}% Expected Shortfall", f"{estimates.loc[alpha, 'es']:,.2f}")
+                st.caption("Estimates refresh as scenario blocks complete; bounds are 95% confidence intervals.")
+            else:
+                weights = None
+                if variance_reduction:
+                    vals, weights = simulate_portfolio_paths_vr(portfolio, spot_df, int(n_scenarios), vol, dt, sampling, control_variate, alpha, seed=int(seed))
+                elif n_workers > 1:
+                    vals = simulate_portfolio_paths_parallel(portfolio, spot_df, int(n_scenarios), vol, dt, seed=int(seed), n_workers=int(n_workers))
+                else:
+                    vals = simulate_portfolio_paths(portfolio, spot_df, int(n_scenarios), vol, dt)
+                pnl = vals - np.mean(vals)
+                # Plotly histogram for PnL
+                fig = px.histogram(pd.DataFrame({"PnL": pnl}), x="PnL", nbins=30, title="Simulated Portfolio P&L Distribution")
+                st.plotly_chart(fig, use_container_width=True)
+                var = calculate_var(vals, alpha) if weights is None else weighted_var(vals, alpha, weights)
+                st.metric(f"{int(alpha*100)}% VaR", f"{var:,.2f}")
+                if weights is None:
+                    st.dataframe(risk_measures(pnl, sorted({0.90, 0.95, 0.975, 0.99, alpha})).style.format("{:,.2f}"))
             st.caption("Value-at-Risk (VaR) is the loss not exceeded with the selected confidence level.")
             log_step(f"Monte Carlo simulation run ({n_scenarios} scenarios, vol={vol}, dt={dt}). VaR={var:,.2f}")
             # Notification for VaR breach
             if var > 1000:  # Example threshold
                 st.warning(f"VaR exceeds threshold: {var:,.2f}")
+        # Historical simulation over an uploaded curve history
+        st.subheader("Historical-Simulation VaR")
+        history_file = st.file_uploader("Curve history CSV (first column: date; other columns: tenors in years, zero rates in decimal)", type=["csv"], key="curve_history")
+        if history_file is not None:
+            history = pd.read_csv(history_file, index_col=0, parse_dates=True)
+            max_window = max(len(history) - 1, 1)
+            window = st.number_input("Lookback window (days)", min_value=1, max_value=max_window, value=min(500, max_window), step=1)
+            try:
+                hist_var = HistoricalVaR(portfolio, spot_df, history, window=int(window))
+                st.dataframe(hist_var.risk(sorted({0.95, 0.99, alpha})).style.format("{:,.2f}"))
+                st.line_chart(hist_var.scenario_pnl())
+            except ValueError as e:
+                st.error(f"Curve history error: {e}")
         # Candlestick chart for selected bond
         st.subheader("Bond Price Candlestick (Simulated)")
         bond_names = [f"Bond #{i}: {getattr(b, 'maturity', '?')}y {getattr(b, 'coupon_rate', '?')*100:.2f}%" for i, b in enumerate(st.session_state.get('bonds', []))]
@@ -1,3 +1,27 @@
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .fixed_income import BondBook
+except ImportError:  # imported as a top-level module (e.g. by streamlit_app)
+    from fixed_income import BondBook
+
+# Columns of a position file and the dtype each is ingested as; the first four are required
+POSITION_SCHEMA = {
+    'maturity': 'float64',
+    'coupon_rate': 'float64',
+    'price': 'float64',
+    'position_notional': 'float64',
+    'face_value': 'float64',
+    'frequency': 'float64',
+    'call_date': 'float64',
+    'id': 'int64',
+    'sector': 'string',
+}
+REQUIRED_POSITION_COLUMNS = ('maturity', 'coupon_rate', 'price', 'position_notional')
+
 def load_data(file_path):
     # Function to load data from a CSV file
     import pandas as pd
@@ -16,4 +40,148 @@ def calculate_percentage(part, whole):
 def validate_asset(asset):
     # Function to validate asset data
     required_keys = ['name', 'amount', 'price']
-    return all(key in asset for key in required_keys)
\ No newline at end of file
+    return all(key in asset for key in required_keys)
+
+_INT64_MAX_DIGITS = str(np.iinfo(np.int64).max)
+
+def _parse_ids(raw):
+    # Parse id text as exact int64 (float parsing would merge ids above 2**53). Returns the ids (0 where
+    # invalid), a mask of non-numeric cells and a mask of numeric cells that are not integers in the int64 range
+    values = pd.to_numeric(raw, errors='coerce')
+    if values.dtype == np.int64:
+        # Every cell parsed as an exact int64
+        return values.to_numpy(), np.zeros(len(raw), dtype=bool), np.zeros(len(raw), dtype=bool)
+    text = raw.astype('string').str.strip()
+    parts = text.str.extract(r'^([+-]?)0*(\d+?)(?:\.0*)?$')
+    sign, digits = parts[0].fillna(''), parts[1]
+    in_range = (digits.str.len() < len(_INT64_MAX_DIGITS)) | ((digits.str.len() == len(_INT64_MAX_DIGITS)) & (digits <= _INT64_MAX_DIGITS))
+    ok = in_range.fillna(False).to_numpy(dtype=bool, copy=True)
+    signed = (sign.str.replace('+', '', regex=False) + digits)[ok].to_numpy(dtype=str)
+    ids = np.zeros(len(raw), dtype=np.int64)
+    ids[ok] = signed.astype(np.int64)
+    # Only ids that print back to the same integer are kept
+    ok[ok] = ids[ok].astype(str) == np.where(digits[ok].to_numpy(dtype=str) == '0', '0', signed)
+    numeric = values.notna().to_numpy()
+    return ids, raw.notna().to_numpy() & ~numeric, ~ok & (numeric | raw.isna().to_numpy())
+
+
+def validate_positions(chunk, known_sectors=None, start=0, seen_ids=None):
+    # Vectorized checks on one chunk of raw (string) position columns. Returns the chunk coerced to
+    # POSITION_SCHEMA, a mask of valid rows and a DataFrame of errors (row = line number in the file's data rows).
+    # seen_ids (a set) carries the ids of valid rows across chunks: a repeated id is an error on every row after
+    # the first, and the ids of this chunk's valid rows are added to it.
+    columns = [name for name in POSITION_SCHEMA if name in chunk.columns]
+    missing = [name for name in REQUIRED_POSITION_COLUMNS if name not in chunk.columns]
+    clean = pd.DataFrame(index=chunk.index)
+    problems = []
+    for name in columns:
+        raw = chunk[name]
+        if POSITION_SCHEMA[name] == 'string':
+            clean[name] = raw.astype('string').str.strip().fillna('')
+            continue
+        if name == 'id':
+            clean[name], not_numeric, not_integer = _parse_ids(raw)
+            problems.append((name, pd.Series(not_numeric), "not numeric"))
+            problems.append((name, pd.Series(not_integer), "must be an integer"))
+            continue
+        values = pd.to_numeric(raw, errors='coerce')
+        problems.append((name, values.isna() & raw.notna(), "not numeric"))
+        clean[name] = values.astype('float64')
+    for name in REQUIRED_POSITION_COLUMNS:
+        if name in clean:
+            problems.append((name, chunk[name].isna(), "missing"))
+    checks = {
+        'maturity': (lambda x: x <= 0, "must be > 0"),
+        'coupon_rate': (lambda x: (x < 0) | (x > 1), "must be between 0 and 1 (decimal)"),
+        'price': (lambda x: x <= 0, "must be > 0"),
+        'position_notional': (lambda x: x < 0, "must be >= 0"),
+        'face_value': (lambda x: x <= 0, "must be > 0"),
+        'frequency': (lambda x: ~x.isin([1, 2, 4, 12]) & x.notna(), "must be 1, 2, 4 or 12"),
+    }
+    for name, (check, message) in checks.items():
+        if name in clean:
+            problems.append((name, check(clean[name]).fillna(False).astype(bool), message))
+    if 'call_date' in clean and 'maturity' in clean:
+        call = clean['call_date']
+        problems.append(('call_date', ((call <= 0) | (call > clean['maturity'])).fillna(False).astype(bool), "must be in (0, maturity]"))
+    if 'sector' in clean and known_sectors is not None:
+        known = {sector.lower() for sector in known_sectors}
+        sector = clean['sector'].str.lower()
+        problems.append(('sector', (~sector.isin(known) & (sector != '')).astype(bool), "unknown sector"))
+    rows = np.arange(start, start + len(chunk))
+    errors = [pd.DataFrame({'row': rows[mask.to_numpy()], 'column': name, 'value': chunk[name].to_numpy()[mask.to_numpy()], 'error': message})
+              for name, mask, message in problems if mask.any()]
+    valid = np.ones(len(chunk), dtype=bool)
+    for _, mask, _ in problems:
+        valid &= ~mask.to_numpy()
+    if 'id' in clean:
+        seen_ids = set() if seen_ids is None else seen_ids
+        ids = clean['id'].to_numpy()
+        duplicate = np.zeros(len(chunk), dtype=bool)
+        candidates = np.flatnonzero(valid)
+        duplicate[candidates] = (pd.Series(ids[candidates]).duplicated().to_numpy()
+                                 | np.fromiter((i in seen_ids for i in ids[candidates].tolist()), dtype=bool, count=len(candidates)))
+        if duplicate.any():
+            errors.append(pd.DataFrame({'row': rows[duplicate], 'column': 'id', 'value': chunk['id'].to_numpy()[duplicate], 'error': "duplicate id"}))
+            valid &= ~duplicate
+        if not missing:
+            seen_ids.update(ids[valid].tolist())
+    if missing:
+        valid[:] = False
+        if start == 0:
+            errors.insert(0, pd.DataFrame({'row': -1, 'column': missing, 'value': None, 'error': "required column missing"}))
+    errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=['row', 'column', 'value', 'error'])
+    return clean, valid, errors
+
+
+def ingest_positions(source, chunksize=50_000, known_sectors=None, max_errors=10_000, progress=None):
+    # Stream a position CSV in chunks: every chunk is validated with vectorized checks and only its valid rows
+    # are kept, as typed columns, so memory stays bounded by the valid data plus one chunk. Returns
+    # (BondBook, position notionals, report); report holds 'errors' (row-level, at most max_errors rows),
+    # 'rows', 'valid', 'invalid', 'error_count', 'columns', 'seconds' and 'rows_per_sec'.
+    # progress(rows_read, rows_per_sec) is called after each chunk.
+    started = time.perf_counter()
+    kept = {name: [] for name in POSITION_SCHEMA}
+    errors = []
+    error_count = rows = valid_rows = 0
+    columns = None
+    seen_ids = set()
+    # Everything is read as text and coerced per chunk, so one bad cell flags its row instead of failing the file
+    for chunk in pd.read_csv(source, chunksize=chunksize, dtype=str, skipinitialspace=True):
+        if columns is None:
+            columns = [name for name in POSITION_SCHEMA if name in chunk.columns]
+        clean, valid, chunk_errors = validate_positions(chunk, known_sectors, start=rows, seen_ids=seen_ids)
+        rows += len(chunk)
+        valid_rows += int(valid.sum())
+        error_count += len(chunk_errors)
+        if len(chunk_errors) and sum(len(e) for e in errors) < max_errors:
+            errors.append(chunk_errors)
+        for name in columns:
+            values = clean[name].to_numpy()[valid]
+            if not len(values):
+                continue
+            kept[name].append(pd.Categorical(values) if POSITION_SCHEMA[name] == 'string' else values.astype(POSITION_SCHEMA[name]))
+        if progress is not None:
+            progress(rows, rows / max(time.perf_counter() - started, 1e-9))
+    columns = columns or []
+    book, notionals = None, np.array([])
+    if valid_rows and all(name in columns for name in REQUIRED_POSITION_COLUMNS):
+        # Free each chunk list as soon as its column is joined
+        data = {name: np.concatenate(kept.pop(name)) for name in columns if POSITION_SCHEMA[name] != 'string'}
+        for name, default in (('face_value', 100.0), ('frequency', 1.0)):
+            if name in data:
+                data[name] = np.where(np.isnan(data[name]), default, data[name])
+        if 'sector' in columns:
+            sectors = pd.api.types.union_categoricals(kept.pop('sector'))
+            data['sector'] = np.asarray(sectors.categories, dtype=str)[sectors.codes]
+        book = BondBook(data.get('face_value', 100.0), data['coupon_rate'], data['maturity'], data.get('frequency', 1.0),
+                        data.get('call_date', np.nan), data['price'], ids=data.get('id'), sector=data.get('sector', ''))
+        notionals = data['position_notional']
+    else:
+        valid_rows = 0
+    seconds = time.perf_counter() - started
+    errors = (pd.concat(errors, ignore_index=True).sort_values('row', kind='stable', ignore_index=True).head(max_errors) if errors
+              else pd.DataFrame(columns=['row', 'column', 'value', 'error']))
+    report = {'errors': errors, 'rows': rows, 'valid': valid_rows, 'invalid': rows - valid_rows, 'error_count': error_count,
+              'columns': columns, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds > 0 else float('inf')}
+    return book, notionals, report
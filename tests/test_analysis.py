@@ -1,6 +1,12 @@
 import unittest
+import numpy as np
 from src.portfolio import Portfolio
-from src.analysis import calculate_return, calculate_risk
+from src.analysis import (calculate_return, calculate_risk, calculate_var, key_rate_sensitivities, parametric_var, risk_attribution,
+                          risk_measures, scenario_pnl, scenario_risk,
+                          simulate_portfolio_paths, simulate_portfolio_paths_delta_gamma, simulate_portfolio_paths_vr,
+                          draw_normals, var_convergence, weighted_var,
+                          simulate_portfolio_paths_parallel, HistoricalVaR, simulate_term_structure_paths, StreamingVaR, var_term_structure)
+from src.fixed_income import Bond, HullWhiteModel, parallel_shocks
 
 class TestAnalysis(unittest.TestCase):
 
@@ -26,5 +32,191 @@ class TestAnalysis(unittest.TestCase):
         result = calculate_risk(self.portfolio, historical_prices)
         self.assertAlmostEqual(result.mean(), expected_risk)
 
+    def test_scenario_pnl(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [1, 5, 10], 'spot_rate': [0.05, 0.05, 0.05]})
+        portfolio = Portfolio([(Bond(100, 0.05, 5, 1), 10), (Bond(100, 0.0, 10, 1), 3)])
+        shocks = parallel_shocks(curve['maturity'], [-50, 0, 50])
+        by_position = scenario_pnl(portfolio, curve, shocks, by_position=True)
+        self.assertEqual(by_position.shape, (3, 2))
+        np.testing.assert_allclose(by_position.sum(axis=1), scenario_pnl(portfolio, curve, shocks))
+        self.assertAlmostEqual(by_position[2, 1], 3 * 100 * (1.055 ** -10 - 1.05 ** -10))
+        self.assertEqual(by_position[1, 0], 0.0)
+
+    def test_simulate_portfolio_paths_matches_scenario_loop(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [0.5, 2, 5, 10], 'spot_rate': [0.03, 0.035, 0.04, 0.042]})
+        bonds = [Bond(100, 0.05, 3, 2), Bond(100, 0.06, 12, 1, callable=True, call_date=4)]
+        portfolio = Portfolio([(bonds[0], 10), (bonds[1], 4)])
+        portfolio.add_asset('AAPL', 10, 150)
+        np.random.seed(7)
+        values = simulate_portfolio_paths(portfolio, curve, 50, 0.2, 0.25, chunk_size=16)
+        # Reference: one scenario at a time from the same stream, repricing bond by bond
+        np.random.seed(7)
+        for value in values:
+            spots = curve['spot_rate'].to_numpy() * np.exp(np.random.normal(0, 0.2 * np.sqrt(0.25), size=4))
+            expected = sum(q * b.price(np.interp(b.maturity, curve['maturity'], spots)) for b, q in zip(bonds, [10, 4]))
+            self.assertAlmostEqual(value, expected, places=9)
+        # Blocking changes only the order of the float reductions, not the draws
+        np.random.seed(7)
+        np.testing.assert_allclose(simulate_portfolio_paths(portfolio, curve, 50, 0.2, 0.25, chunk_size=7), values, rtol=1e-12)
+
+    def test_streaming_var_matches_full_array(self):
+        rng = np.random.default_rng(0)
+        values = 1000 + 50 * rng.standard_normal(20000)
+        estimator = StreamingVaR(len(values), alphas=(0.99, 0.95))
+        for block in np.array_split(values, 7):
+            estimates = estimator.update(block).estimates()
+        self.assertLess(len(estimator.tail), 1500)
+        for alpha in (0.95, 0.99):
+            row = estimates.loc[alpha]
+            self.assertAlmostEqual(row['var'], calculate_var(values, alpha), places=8)
+            self.assertTrue(row['var_lower'] <= row['var'] <= row['var_upper'])
+            self.assertTrue(row['es_lower'] < row['es'] < row['es_upper'])
+            self.assertGreater(row['es'], row['var'])
+        with self.assertRaises(ValueError):
+            estimator.update([1.0])
+
+    def test_parallel_paths_are_reproducible(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [0.5, 2, 5, 10], 'spot_rate': [0.03, 0.035, 0.04, 0.042]})
+        portfolio = Portfolio([(Bond(100, 0.05, 3, 2), 10), (Bond(100, 0.06, 12, 1, callable=True, call_date=4), 4)])
+        run = lambda n_workers, chunk_size: simulate_portfolio_paths_parallel(portfolio, curve, 1001, 0.2, 0.25, seed=11,
+                                                                             n_workers=n_workers, chunk_size=chunk_size)
+        np.random.seed(0)
+        global_state = np.random.get_state()
+        two_workers = run(2, 100)
+        np.testing.assert_array_equal(two_workers, run(2, 100))
+        np.testing.assert_allclose(two_workers, run(2, 1000), rtol=1e-12)
+        # The global stream is neither read nor advanced
+        np.testing.assert_array_equal(np.random.get_state()[1], global_state[1])
+        self.assertEqual(np.random.get_state()[2], global_state[2])
+        self.assertFalse(np.array_equal(two_workers, run(1, 1000)))
+        # Each worker's block is an ordinary simulation driven by its own spawned stream
+        self.assertAlmostEqual(two_workers.mean(), run(1, 1000).mean(), delta=2.0)
+
+    def test_term_structure_paths_roll_down(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [1, 5, 10], 'spot_rate': [0.03, 0.04, 0.045]})
+        zero, coupon = Bond(100, 0.0, 5, 1), Bond(100, 0.06, 3, 1)
+        portfolio = Portfolio([(zero, 2), (coupon, 1)])
+        horizons = [0, 0.5, 1.5]
+        quiet = HullWhiteModel(curve, volatility=1e-9)
+        values = simulate_term_structure_paths(portfolio, quiet, horizons, 3, seed=0)
+        self.assertAlmostEqual(values[0, 0], portfolio.total_value(curve), places=6)
+        # Without volatility the curve rolls forward: prices grow at the initial forward rates
+        discount = lambda t: (1 + np.interp(t, curve['maturity'], curve['spot_rate'])) ** -t
+        coupon_value = sum(c * discount(t) for c, t in [(6, 2), (106, 3)]) / discount(1.5)
+        self.assertAlmostEqual(values[2, 1], 200 * discount(5) / discount(1.5) + coupon_value, places=5)
+        paid = simulate_term_structure_paths(portfolio, quiet, horizons, 3, seed=0, include_paid=True)
+        np.testing.assert_allclose(paid - values, [[0, 0, 0], [0, 0, 0], [6, 6, 6]])
+        model = HullWhiteModel(curve, volatility=0.01)
+        paths = simulate_term_structure_paths(portfolio, model, horizons, 2000, seed=5)
+        np.testing.assert_array_equal(paths, simulate_term_structure_paths(portfolio, model, horizons, 2000, seed=5))
+        risk = var_term_structure(paths, horizons, alphas=(0.95, 0.99))
+        self.assertEqual(list(risk.columns), ['var_95', 'es_95', 'var_99', 'es_99'])
+        self.assertLess(risk.loc[0.5, 'var_95'], risk.loc[1.5, 'var_95'])
+        self.assertAlmostEqual(risk.loc[1.5, 'var_99'], calculate_var(paths[2], 0.99))
+        # One ES definition across the APIs
+        self.assertAlmostEqual(risk.loc[1.5, 'es_99'], risk_measures(paths[2] - paths[2].mean(), 0.99).loc[0.99, 'es'])
+
+    def test_delta_gamma_mode(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [0.5, 2, 5, 10], 'spot_rate': [0.03, 0.035, 0.04, 0.042]})
+        portfolio = Portfolio([(Bond(100, 0.05, 3, 2), 10), (Bond(100, 0.0, 7, 1), 20), (Bond(100, 0.06, 9, 1, callable=True, call_date=4), 4)])
+        sensitivities = key_rate_sensitivities(portfolio, curve)
+        # Same valuation as a zero-volatility simulation; deltas match central differences of the 5y knot
+        value = lambda spot_rates: simulate_portfolio_paths(portfolio, curve.assign(spot_rate=spot_rates), 1, 0.0, 0.25)[0]
+        self.assertAlmostEqual(sensitivities['value'], value(curve['spot_rate']))
+        bump = np.array([0, 0, 1e-4, 0])
+        self.assertAlmostEqual(sensitivities['delta'][2], (value(curve['spot_rate'] + bump) - value(curve['spot_rate'] - bump)) / 2e-4, delta=1e-3)
+        np.random.seed(3)
+        full = simulate_portfolio_paths(portfolio, curve, 2000, 0.05, 0.25)
+        np.random.seed(3)
+        approx, report = simulate_portfolio_paths_delta_gamma(portfolio, curve, 2000, 0.05, 0.25, sensitivities=sensitivities, n_check=100)
+        self.assertEqual(report['n_checked'], 100)
+        self.assertLess(np.abs(approx - full).max(), 0.01 * full.std())
+        self.assertAlmostEqual(report['var_full'], calculate_var(full[np.linspace(0, 1999, 100).astype(int)], 0.95))
+        self.assertAlmostEqual(parametric_var(portfolio, curve, 0.05, 0.25, sensitivities=sensitivities) / calculate_var(full, 0.95), 1, delta=0.1)
+
+    def test_risk_measures_at_many_alphas(self):
+        pnl = np.random.default_rng(1).standard_t(4, size=5001)
+        measures = risk_measures(pnl, [0.9, 0.95, 0.975, 0.99, 0.999])
+        for alpha, row in measures.iterrows():
+            self.assertAlmostEqual(row['var'], -np.percentile(pnl, 100 * (1 - alpha)))
+            self.assertAlmostEqual(row['es'], -np.sort(pnl)[:int(np.ceil(len(pnl) * (1 - alpha)))].mean())
+
+    def test_component_risk_adds_up(self):
+        rng = np.random.default_rng(2)
+        pnl = rng.standard_normal((4000, 6)) * [1, 2, 3, 1, 1, 5]
+        result = risk_attribution(pnl, [0.95, 0.99], exposures=np.full(6, 50.0), groups=['a', 'b', 'a', 'c', 'c', 'b'])
+        np.testing.assert_allclose(result['component_var'].sum(), result['summary']['var'])
+        np.testing.assert_allclose(result['component_es'].sum(), result['summary']['es'])
+        np.testing.assert_allclose(result['group_component_es'].loc['b'], result['component_es'].iloc[[1, 5]].sum())
+        np.testing.assert_allclose(result['marginal_es'] * 50, result['component_es'])
+        # The most volatile position dominates the tail
+        self.assertEqual(result['component_es'][0.99].idxmax(), 5)
+
+    def test_scenario_risk_matches_position_matrix(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [1, 5, 10], 'spot_rate': [0.03, 0.04, 0.045]})
+        portfolio = Portfolio([(Bond(100, 0.05, 3, 2), 10), (Bond(100, 0.0, 7, 1), 20), (Bond(100, 0.06, 9, 1, callable=True, call_date=4), 4)])
+        shocks = np.random.default_rng(3).normal(0, 0.003, size=(500, 3))
+        fast = scenario_risk(portfolio, curve, shocks, groups=['gov', 'corp', 'corp'])
+        full = risk_attribution(scenario_pnl(portfolio, curve, shocks, by_position=True), groups=['gov', 'corp', 'corp'])
+        for name in ('summary', 'component_var', 'component_es', 'group_component_es'):
+            np.testing.assert_allclose(fast[name], full[name], atol=1e-9)
+
+    def test_historical_var_rolling_window(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [1, 5, 10], 'spot_rate': [0.03, 0.04, 0.045]})
+        portfolio = Portfolio([(Bond(100, 0.05, 3, 2), 10), (Bond(100, 0.0, 7, 1), 20), (Bond(100, 0.06, 9, 1, callable=True, call_date=4), 4)])
+        rng = np.random.default_rng(4)
+        rates = 0.03 + np.cumsum(rng.normal(0, 0.001, size=(60, 4)), axis=0)
+        history = pd.DataFrame(rates[:50], index=pd.bdate_range('2024-01-01', periods=50), columns=[0.5, 2, 5, 10])
+        model = HistoricalVaR(portfolio, curve, history, window=30)
+        # Each scenario is one day's change applied to today's curve and book
+        day = history.iloc[-1] - history.iloc[-2]
+        shocked = curve.assign(spot_rate=curve['spot_rate'] + np.interp(curve['maturity'], history.columns.astype(float), day))
+        self.assertAlmostEqual(model.scenario_pnl().iloc[-1], portfolio.total_value(shocked) - portfolio.total_value(curve))
+        for k in range(50, 60):
+            model.append(rates[k], history.index[-1] + pd.offsets.BDay(k - 49))
+        rebuilt = HistoricalVaR(portfolio, curve, rates, tenors=[0.5, 2, 5, 10], window=30)
+        np.testing.assert_allclose(model.scenario_pnl().to_numpy(), rebuilt.scenario_pnl().to_numpy())
+        self.assertEqual(model.scenario_pnl().index[-1], history.index[-1] + pd.offsets.BDay(10))
+        pd.testing.assert_frame_equal(model.risk(), risk_measures(rebuilt.scenario_pnl()))
+        with self.assertRaises(ValueError):
+            model.append(rates[-1])
+        self.assertEqual(model.scenario_pnl().index[-1], history.index[-1] + pd.offsets.BDay(10))
+        with self.assertRaises(ValueError):
+            HistoricalVaR(portfolio, curve, history, window=0)
+
+    def test_draw_normals(self):
+        for sampling in ('pseudo', 'antithetic', 'sobol', 'halton'):
+            draws = draw_normals(1024, 3, sampling, rng=0)
+            self.assertEqual(draws.shape, (1024, 3))
+            np.testing.assert_array_equal(draws, draw_normals(1024, 3, sampling, rng=0))
+            self.assertAlmostEqual(draws.std(), 1.0, delta=0.1)
+        np.testing.assert_array_equal(draw_normals(10, 2, 'antithetic', rng=1)[5:], -draw_normals(10, 2, 'antithetic', rng=1)[:5])
+        # Quasi-random points fill the space evenly: sample means sit far closer to zero than 1/sqrt(n)
+        self.assertLess(np.abs(draw_normals(4096, 4, 'sobol', rng=2).mean(axis=0)).max(), 0.005)
+        with self.assertRaises(ValueError):
+            draw_normals(8, 2, 'lattice')
+
+    def test_control_variate_reduces_var_error(self):
+        import pandas as pd
+        curve = pd.DataFrame({'maturity': [0.5, 2, 5, 10], 'spot_rate': [0.03, 0.035, 0.04, 0.042]})
+        portfolio = Portfolio([(Bond(100, 0.05, 3, 2), 10), (Bond(100, 0.0, 7, 1), 20), (Bond(100, 0.06, 9, 1), 4)])
+        values, weights = simulate_portfolio_paths_vr(portfolio, curve, 512, 0.2, 0.25, 'pseudo', 'duration', seed=5)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertAlmostEqual(weighted_var(values, 0.95), weighted_var(values, 0.95, np.full(512, 1 / 512)))
+        # Negative weights would make the cumulative weight non-monotone (the search would land on 3)
+        self.assertAlmostEqual(weighted_var([1.0, 2.0, 3.0, 4.0], 0.8, [0.3, -0.2, 0.45, 0.45]), 3.45 / 1.2 - 1.0)
+        plain = var_convergence(portfolio, curve, 0.2, 0.25, 0.95, sizes=(256, 1024), replicates=12, sampling='pseudo', seed=6)
+        reduced = var_convergence(portfolio, curve, 0.2, 0.25, 0.95, sizes=(256, 1024), replicates=12, sampling='sobol',
+                                  control_variate='delta_gamma', seed=6)
+        self.assertEqual(list(reduced.columns), ['n_scenarios', 'var', 'std_error'])
+        self.assertLess(reduced['std_error'].iloc[1] * 3, plain['std_error'].iloc[1])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+import pandas as pd
+from src.compliance import ComplianceEngine
+from src.fixed_income import BondBook
+from src.portfolio import Portfolio, TradeLedger
+
+class TestComplianceEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.book = BondBook.from_frame(pd.DataFrame({
+            'maturity': [2, 5, 10, 3, 4], 'coupon_rate': [0.05, 0.04, 0.03, 0.02, 0.01], 'price': [100.0] * 5,
+            'sector': ['Tech', 'Real Estate', 'tech ', 'Energy', ''], 'id': [1, 2, 3, 4, 5]}))
+        self.portfolio = Portfolio(list(zip(self.book, [10, 50, 30, 10, 0.5])))
+        self.engine = ComplianceEngine.from_portfolio(self.portfolio, self.book)
+
+    def test_incremental_exposures_match_full_rebuild(self):
+        ledger = TradeLedger(self.portfolio, self.book)
+        ledger.subscribe(self.engine.apply)
+        ledger.sell(self.book[2], 12, 100.0, kind='auto_sale')
+        ledger.buy(self.book[3], 4, 100.0)
+        ledger.undo()
+        rebuilt = ComplianceEngine.from_portfolio(self.portfolio, self.book)
+        np.testing.assert_allclose(self.engine.exposure, rebuilt.exposure)
+        np.testing.assert_allclose(self.engine.sector_exposure, rebuilt.sector_exposure)
+        self.assertAlmostEqual(self.engine.total, rebuilt.total)
+        self.assertEqual(self.engine.sector_weights().index.tolist(), ['tech', 'real estate', 'energy', ''])
+
+    def test_scan_cure_is_exact(self):
+        violations = self.engine.scan().set_index(['level', 'key'])
+        # Real estate is exempt; the unlabeled bond is under the position limit and outside the sector rule
+        self.assertEqual(violations.index.tolist(), [('position', 1), ('position', 3), ('position', 4), ('sector', 'tech')])
+        total = self.engine.total
+        for (level, key), row in violations.iterrows():
+            cured = (row['exposure'] - row['cure_notional']) / (total - row['cure_notional'])
+            self.assertAlmostEqual(cured, row['limit'])
+        self.assertEqual(violations.loc[('position', 3), 'cure_quantity'], 27)
+        orders = self.engine.cure_orders().set_index('id')
+        self.assertTrue((orders['quantity'] <= self.engine.quantity[orders['row']]).all())
+        self.assertNotIn(2, orders.index)
+
+    def test_pre_trade_check_and_limits_are_configurable(self):
+        self.assertEqual(self.engine.max_quantity(self.book[4]), 4)
+        self.assertEqual(self.engine.check(self.book[4], 4), [])
+        self.assertEqual([b['level'] for b in self.engine.check(self.book[4], 5)], ['position'])
+        self.assertEqual(self.engine.max_quantity(self.book[1]), np.inf)
+        self.engine.set_exempt(['Tech'])
+        self.engine.position_limit = 0.6
+        self.assertEqual(self.engine.check(self.book[0], 100), [])
+        self.assertEqual(self.engine.check(4, 20), [])
+        self.assertEqual([b['key'] for b in self.engine.check(self.book[1], 1)], ['real estate'])
+        self.assertEqual(self.engine.scan()['key'].tolist(), ['real estate'])
+
+    def test_rejects_unusable_prices(self):
+        for price in (0.0, -1.0, np.nan, np.inf):
+            with self.assertRaises(ValueError):
+                ComplianceEngine(self.book, self.engine.quantity, prices=[100.0, 100.0, price, 100.0, 100.0])
+            with self.assertRaises(ValueError):
+                self.engine.reprice(np.where(np.arange(5) == 3, price, 100.0))
+        self.engine.reprice(np.full(5, 50.0))
+        self.assertEqual(self.engine.total, 5025.0)
+        self.assertEqual(self.engine.max_quantity(self.book[4]), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
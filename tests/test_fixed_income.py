@@ -0,0 +1,380 @@
+import copy
+import pickle
+import unittest
+import numpy as np
+import pandas as pd
+from src.fixed_income import (Bond, BondBook, CashFlowSchedule, CIRModel, CurveBootstrapper, HullWhiteModel, ShortRateLattice, VasicekModel, apply_shocks, bootstrap_discount_factors, bootstrap_yield_curve,
+                              butterfly_shocks, key_rate_shocks, parallel_shocks, price_bond, price_bonds, simulate_yield_shift, steepener_shocks, twist_shocks,
+                              yield_to_maturity, yield_to_worst, ZeroCurve)
+
+
+def reference_price(face_value, coupon_rate, maturity, yield_rate, frequency):
+    # Straightforward coupon-by-coupon discounting, used as the reference for the closed form
+    coupon = face_value * coupon_rate / frequency
+    n_periods = int(maturity * frequency)
+    pv = sum(coupon / (1 + yield_rate / frequency) ** t for t in range(1, n_periods + 1))
+    return pv + face_value / (1 + yield_rate / frequency) ** n_periods
+
+
+class TestPriceBonds(unittest.TestCase):
+
+    def test_matches_coupon_by_coupon_discounting(self):
+        cases = [(100, 0.05, 5, 0.05, 1), (100, 0.05, 5, 0.04, 1), (100, 0.06, 3, 0.05, 2),
+                 (1000, 0.0, 2.5, 0.03, 2), (100, 0.045, 7.75, 0.06, 4), (100, 0.05, 10, 0.0, 1)]
+        for face, coupon, maturity, y, freq in cases:
+            self.assertAlmostEqual(price_bond(face, coupon, maturity, y, freq),
+                                   reference_price(face, coupon, maturity, y, freq), places=9)
+
+    def test_par_bond_prices_at_par(self):
+        self.assertAlmostEqual(price_bond(100, 0.05, 5, 0.05, 1), 100.0)
+
+    def test_broadcasts_bonds_against_scenarios(self):
+        coupons = np.array([0.02, 0.05, 0.07])[:, None]
+        maturities = np.array([2, 5, 10])[:, None]
+        yields = np.linspace(0.01, 0.08, 4)
+        prices = price_bonds(100, coupons, maturities, yields, 2)
+        self.assertEqual(prices.shape, (3, 4))
+        for i in range(3):
+            for j in range(4):
+                self.assertAlmostEqual(prices[i, j], reference_price(100, coupons[i, 0], maturities[i, 0], yields[j], 2))
+
+def reference_tips_price(face_value, coupon_rate, maturity, frequency, cpi, real_yield):
+    # Period-by-period inflation adjustment, the way Bond.price used to do it
+    n_periods = int(maturity * frequency)
+    pv = 0.0
+    for t in range(1, n_periods + 1):
+        ratio = cpi[min(t, len(cpi) - 1)] / cpi[0]
+        pv += face_value * ratio * coupon_rate / frequency / (1 + real_yield / frequency) ** t
+    ratio = cpi[min(n_periods, len(cpi) - 1)] / cpi[0]
+    return pv + face_value * ratio / (1 + real_yield / frequency) ** n_periods
+
+
+class TestTips(unittest.TestCase):
+
+    def test_tips_price_matches_period_by_period_adjustment(self):
+        cpi = pd.Series([250, 255, 260, 265, 270, 275])
+        for maturity, freq in [(5, 1), (8, 1), (3, 2)]:
+            bond = Bond(100, 0.01, maturity, freq, cpi_series=cpi)
+            self.assertAlmostEqual(bond.price(0.005, real_yield=0.005),
+                                   reference_tips_price(100, 0.01, maturity, freq, cpi.values, 0.005))
+
+    def test_batch_tips_pricing_over_real_yield_scenarios(self):
+        cpi = np.array([100, 102, 104.5, 106, 109, 111, 113])
+        schedule = CashFlowSchedule(100, np.array([0.01, 0.02, 0.005]), np.array([5, 3, 6]), 1)
+        ratios = schedule.index_ratios(cpi)
+        real_yields = np.array([[-0.01, 0.0, 0.01, 0.02]] * 3)
+        prices = schedule.price(real_yields, ratios)
+        self.assertEqual(prices.shape, (3, 4))
+        for i, (coupon, maturity) in enumerate([(0.01, 5), (0.02, 3), (0.005, 6)]):
+            for j, y in enumerate(real_yields[i]):
+                self.assertAlmostEqual(prices[i, j], reference_tips_price(100, coupon, maturity, 1, cpi, y))
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def test_semi_annual_curve_round_trip(self):
+        # Par-ish bonds at every semi-annual date priced off a known discount curve are recovered exactly
+        maturities = np.arange(1, 21) / 2
+        true_discount = np.exp(-0.03 * maturities - 0.001 * maturities ** 2)
+        coupons = np.linspace(0.02, 0.06, 20)
+        prices = np.array([100 * c / 2 * true_discount[:k + 1].sum() + 100 * true_discount[k] for k, c in enumerate(coupons)])
+        order = np.random.default_rng(2).permutation(20)
+        result_maturities, discount = bootstrap_discount_factors(maturities[order], coupons[order], prices[order], 100, 2)
+        np.testing.assert_allclose(result_maturities, maturities)
+        np.testing.assert_allclose(discount, true_discount, rtol=1e-12)
+
+    def test_gaps_and_fractional_maturities_are_interpolated(self):
+        # Pillars at 1y and 4.5y: the 4.5y bond's coupons at 1.5..4y are log-linear between them
+        d1, d45 = 0.96, 0.82
+        weights = (np.arange(3, 9) / 2 - 1) / 3.5
+        gap = d1 ** (1 - weights) * d45 ** weights
+        half = np.sqrt(d1)  # 0.5y coupon, interpolated between t=0 and the 1y pillar
+        price = 2.5 * (half + d1 + gap.sum()) + 102.5 * d45
+        maturities, discount = bootstrap_discount_factors([1, 4.5], [0.0, 0.05], [100 * d1, price], 100, [1, 2])
+        np.testing.assert_allclose(discount, [d1, d45])
+
+    def test_bootstrap_yield_curve_accepts_price_array(self):
+        df = pd.DataFrame({'maturity': [1, 2, 3], 'coupon_rate': [0.0, 0.05, 0.06]})
+        curve = bootstrap_yield_curve(df, prices=[97.0, 101.5, 104.0])
+        z1 = 100 / 97 - 1
+        z2 = (105 / (101.5 - 5 / (1 + z1))) ** 0.5 - 1
+        np.testing.assert_allclose(curve.dropna(subset=['spot_rate'])['spot_rate'].to_numpy()[:2], [z1, z2])
+
+
+class TestCurveBootstrapper(unittest.TestCase):
+
+    def setUp(self):
+        self.maturities = np.array([0.5, 1, 2, 3, 5, 7, 10])
+        self.coupons = np.array([0.0, 0.0, 0.03, 0.035, 0.04, 0.042, 0.045])
+        self.frequency = np.array([2, 1, 2, 2, 2, 2, 2])
+        self.prices = np.array([98.6, 97.0, 99.5, 99.8, 100.2, 100.1, 99.7])
+
+    def test_update_matches_full_rebootstrap(self):
+        bootstrapper = CurveBootstrapper(self.maturities, self.coupons, self.prices, 100, self.frequency)
+        old_curve = bootstrapper.curve
+        changed = bootstrapper.update(3, 100.4)
+        np.testing.assert_array_equal(changed, [3, 5, 7, 10])
+        prices = self.prices.copy()
+        prices[3] = 100.4
+        _, fresh = bootstrap_discount_factors(self.maturities, self.coupons, prices, 100, self.frequency)
+        np.testing.assert_allclose(bootstrapper.discount_factors, fresh, rtol=1e-13)
+        # Patched spline: untouched left of the previous knot, through the new rates at the knots
+        curve = bootstrapper.curve
+        np.testing.assert_allclose(curve.zero(self.maturities), bootstrapper.spot_rates, atol=1e-14)
+        np.testing.assert_array_equal(curve.zero([0.7, 1.5]), old_curve.zero([0.7, 1.5]))
+        self.assertNotEqual(curve, old_curve)
+
+    def test_unknown_maturity_raises(self):
+        bootstrapper = CurveBootstrapper(self.maturities, self.coupons, self.prices, 100, self.frequency)
+        with self.assertRaises(KeyError):
+            bootstrapper.update(4, 100.0)
+
+
+class TestZeroCurve(unittest.TestCase):
+
+    def setUp(self):
+        self.curve = ZeroCurve([1, 2, 5, 10], [0.03, 0.034, 0.04, 0.043])
+
+    def test_queries_are_vectorized_and_consistent(self):
+        t = np.array([0.5, 1, 3.3, 10, 12])
+        z = self.curve.zero(t)
+        self.assertEqual(z.shape, t.shape)
+        self.assertAlmostEqual(z[0], 0.03)
+        self.assertAlmostEqual(z[-1], 0.043)
+        np.testing.assert_allclose(self.curve.discount(t), (1 + z) ** -t)
+        forward = self.curve.forward(2, 5)
+        self.assertAlmostEqual(self.curve.discount(2) / (1 + forward) ** 3, self.curve.discount(5))
+
+    def test_hash_by_content_and_immutable(self):
+        same = ZeroCurve.from_frame(pd.DataFrame({'maturity': [10, 5, 2, 1, 1.5], 'spot_rate': [0.043, 0.04, 0.034, 0.03, np.nan]}))
+        self.assertEqual(self.curve, same)
+        self.assertEqual(hash(self.curve), hash(same))
+        self.assertEqual(len({self.curve, same, self.curve.shifted(0.001)}), 2)
+        with self.assertRaises(AttributeError):
+            self.curve.spot_rate = None
+        with self.assertRaises(ValueError):
+            self.curve.coefficients[0, 0] = 1.0
+        patched = self.curve.patched(self.curve.spot_rate + 0.001, 2)
+        for curve in (self.curve, patched, ZeroCurve([5.0], [0.04])):
+            restored = pickle.loads(pickle.dumps(curve))
+            self.assertEqual(restored, curve)
+            self.assertEqual(hash(restored), hash(curve))
+            np.testing.assert_array_equal(restored.zero([0.5, 3, 7, 20]), curve.zero([0.5, 3, 7, 20]))
+            self.assertEqual(copy.deepcopy(curve), curve)
+        with self.assertRaises(AttributeError):
+            restored.spot_rate = None
+
+    def test_accepted_where_curve_frames_are(self):
+        shocked = simulate_yield_shift(self.curve, 'parallel', 100)
+        self.assertIsInstance(shocked, ZeroCurve)
+        np.testing.assert_allclose(shocked.spot_rate, self.curve.spot_rate + 0.01)
+        schedule = CashFlowSchedule(100, 0.05, 5, 1)
+        self.assertAlmostEqual(schedule.curve_measures(self.curve)['price'][0],
+                               (5 * self.curve.discount(np.arange(1, 6))).sum() + 100 * self.curve.discount(5))
+
+
+class TestScenarioEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.curve = pd.DataFrame({'maturity': [0.5, 1, 2, 5, 10], 'spot_rate': [0.03, 0.032, 0.035, 0.04, 0.042]})
+        self.tenors = self.curve['maturity'].to_numpy()
+        self.book = BondBook(100, [0.0, 0.05, 0.06, 0.04], [1.5, 4, 10, 7], [1, 2, 2, 1], call_date=[np.nan, np.nan, 3, np.nan])
+        self.shocks = np.vstack([parallel_shocks(self.tenors, [-100, 0, 50]), steepener_shocks(self.tenors, [25, -25]),
+                                 twist_shocks(self.tenors, [30]), butterfly_shocks(self.tenors, [20]),
+                                 key_rate_shocks(self.tenors, [1, 2, 5, 10], 10)])
+
+    def test_shock_builders(self):
+        self.assertEqual(self.shocks.shape, (11, 5))
+        np.testing.assert_allclose(key_rate_shocks(self.tenors, [1, 2, 5, 10], 10).sum(axis=0), 0.001)
+        np.testing.assert_allclose(twist_shocks(self.tenors, [30])[0, [0, -1]], [-0.0015, 0.0015])
+        np.testing.assert_allclose(butterfly_shocks(self.tenors, [20], belly=5)[0, [0, 3, 4]], [0.002, -0.002, 0.002])
+        np.testing.assert_allclose(apply_shocks(self.curve, self.shocks)[4], simulate_yield_shift(self.curve, 'steepening', -25)['spot_rate'])
+
+    def test_scenario_prices_match_curve_repricing(self):
+        prices = self.book.scenario_prices(self.curve, self.shocks)
+        for k, spot_rates in enumerate(apply_shocks(self.curve, self.shocks)):
+            shocked = pd.DataFrame({'maturity': self.tenors, 'spot_rate': spot_rates})
+            expected = self.book.schedule.curve_measures(shocked)['price']
+            expected[2] = min(expected[2], self.book.call_schedule.curve_measures(shocked)['price'][2])
+            np.testing.assert_allclose(prices[k], expected, rtol=1e-12)
+
+    def test_scenario_values_aggregate_positions(self):
+        quantities = np.array([10.0, 20.0, 5.0, 1.0])
+        np.testing.assert_allclose(self.book.scenario_values(self.curve, self.shocks, quantities),
+                                   self.book.scenario_prices(self.curve, self.shocks) @ quantities, rtol=1e-12)
+
+
+class TestShortRateLattice(unittest.TestCase):
+
+    def setUp(self):
+        self.curve = pd.DataFrame({'maturity': [0.5, 1, 2, 5, 10], 'spot_rate': [0.03, 0.032, 0.035, 0.04, 0.042]})
+        self.lattice = ShortRateLattice(self.curve, horizon=10, steps_per_year=2, volatility=0.2)
+        self.book = BondBook(100, [0.0, 0.05, 0.06, 0.06], [5, 10, 10, 10], 2,
+                             call_date=[np.nan, np.nan, np.nan, 3], price=[np.nan, np.nan, np.nan, 101.0])
+
+    def test_non_callable_bonds_reprice_the_curve(self):
+        np.testing.assert_allclose(self.lattice.price(self.book)[:3], self.book.schedule.curve_measures(self.curve)['price'][:3])
+
+    def test_call_option_lowers_price(self):
+        result = self.lattice.analyze(self.book)
+        self.assertGreater(result.loc[3, 'option_value'], 0)
+        self.assertAlmostEqual(result.loc[3, 'straight_price'], result.loc[2, 'model_price'])
+        # A single European call at year 3 is worth less to the issuer than the Bermudan schedule
+        european = self.lattice.price(self.book.take([3]), call_dates=[[3]])[0]
+        self.assertGreater(european, result.loc[3, 'model_price'])
+
+    def test_oas_round_trip_and_effective_duration(self):
+        priced = self.lattice.price(self.book, oas=0.01)
+        np.testing.assert_allclose(self.lattice.oas(self.book, priced), 0.01, atol=1e-9)
+        result = self.lattice.analyze(self.book, bump=1e-4)
+        measures = self.book.schedule.curve_measures(self.curve)
+        self.assertAlmostEqual(result.loc[1, 'effective_duration'], measures['modified_duration'][1], places=3)
+        self.assertLess(result.loc[3, 'effective_duration'], result.loc[2, 'effective_duration'])
+
+
+class TestShortRateModels(unittest.TestCase):
+
+    def test_hull_white_reprices_initial_curve(self):
+        curve = pd.DataFrame({'maturity': [0.5, 1, 2, 5, 10], 'spot_rate': [0.03, 0.032, 0.035, 0.04, 0.042]})
+        model = HullWhiteModel(curve, mean_reversion=0.1, volatility=0.01)
+        tau = np.array([0.5, 1.5, 4, 10])
+        np.testing.assert_allclose(model.discount(0, tau, [model.short_rate])[0], (1 + np.interp(tau, curve['maturity'], curve['spot_rate'])) ** -tau)
+
+    def test_affine_models_calibrate_to_their_own_curve(self):
+        tau = np.array([0.5, 1, 2, 5, 10, 20])
+        for model in (VasicekModel(0.2, 0.01, 0.05, 0.02), CIRModel(0.2, 0.05, 0.05, 0.02)):
+            spot_rates = model.discount(0, tau, [model.short_rate])[0] ** (-1 / tau) - 1
+            fitted = type(model).calibrate(pd.DataFrame({'maturity': tau, 'spot_rate': spot_rates}), 0.2, model.volatility)
+            self.assertAlmostEqual(fitted.long_rate, 0.05)
+            self.assertAlmostEqual(fitted.short_rate, 0.02)
+
+    def test_transitions_keep_discounted_bond_prices_martingales(self):
+        model = VasicekModel(0.3, 0.01, 0.05, 0.02)
+        rng = np.random.default_rng(0)
+        rates, accrued = np.full(100000, model.short_rate), np.zeros(100000)
+        for k in range(100):
+            following = model.step(k / 100, 0.01, rates, rng)
+            accrued += 0.005 * (rates + following)
+            rates = following
+        expected = model.discount(0, [3.0], [model.short_rate])[0, 0]
+        self.assertAlmostEqual((np.exp(-accrued) * model.discount(1, [2.0], rates)[:, 0]).mean(), expected, places=4)
+
+
+class TestBondBook(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'maturity': [1, 2, 3, 10],
+            'coupon_rate': [0.0, 0.05, 0.06, 0.05],
+            'price': [97.0, 101.5, 104.0, 99.0],
+            'call_date': [np.nan, np.nan, np.nan, 5],
+            'position_notional': [1000, 2000, 3000, 4000],
+        })
+        self.book = BondBook.from_frame(self.df)
+
+    def test_from_frame_columns(self):
+        self.assertEqual(len(self.book), 4)
+        self.assertEqual(self.book.maturity.dtype, np.float64)
+        np.testing.assert_array_equal(self.book.face_value, [100.0] * 4)
+        np.testing.assert_array_equal(self.book.id, np.arange(4))
+        np.testing.assert_array_equal(self.book.callable, [False, False, False, True])
+
+    def test_view_behaves_like_bond(self):
+        view = self.book[3]
+        bond = Bond(100, 0.05, 10, 1, callable=True, call_date=5)
+        self.assertEqual(view.market_price, 99.0)
+        self.assertAlmostEqual(view.price(0.04), bond.price(0.04))
+        self.assertEqual(view, self.book[3])
+        self.assertEqual(hash(view), hash(self.book[-1]))
+        with self.assertRaises(AttributeError):
+            view.extra = 1
+
+    def test_bootstrap_accepts_book(self):
+        bonds = [Bond(100, 0.0, 1, 1), Bond(100, 0.05, 2, 1), Bond(100, 0.06, 3, 1)]
+        for bond, price in zip(bonds, [97.0, 101.5, 104.0]):
+            bond.price = price
+        from_bonds = bootstrap_yield_curve(bonds)
+        from_book = bootstrap_yield_curve(self.book.take(np.arange(3)))
+        pd.testing.assert_frame_equal(from_bonds, from_book)
+
+class TestCashFlowSchedule(unittest.TestCase):
+
+    def test_schedule_prices_match_closed_form(self):
+        face = np.array([100, 100, 1000, 100])
+        coupon = np.array([0.05, 0.0, 0.03, 0.07])
+        maturity = np.array([5, 2.5, 10, 0.5])
+        freq = np.array([1, 2, 2, 1])
+        yields = np.array([0.04, 0.03, 0.05, 0.06])
+        schedule = CashFlowSchedule(face, coupon, maturity, freq)
+        np.testing.assert_allclose(schedule.price(yields), price_bonds(face, coupon, maturity, yields, freq))
+        scenarios = np.array([0.01, 0.05, 0.09])
+        np.testing.assert_allclose(schedule.price(yields[:, None] + scenarios),
+                                   price_bonds(face[:, None], coupon[:, None], maturity[:, None], yields[:, None] + scenarios, freq[:, None]))
+
+    def test_measures_match_finite_differences(self):
+        schedule = CashFlowSchedule(100, 0.06, 7, 2)
+        y, h = 0.05, 1e-5
+        m = schedule.measures(y)
+        up, down = schedule.price(y + h)[0], schedule.price(y - h)[0]
+        self.assertAlmostEqual(m['modified_duration'][0], (down - up) / (2 * h * m['price'][0]), places=5)
+        self.assertAlmostEqual(m['convexity'][0], (up + down - 2 * m['price'][0]) / (h ** 2 * m['price'][0]), places=2)
+        self.assertAlmostEqual(m['dv01'][0], (down - up) / (2 * h) * 1e-4, places=7)
+
+    def test_schedule_is_immutable_and_cached(self):
+        bond = Bond(100, 0.05, 5, 1)
+        self.assertIs(bond.schedule, bond.schedule)
+        with self.assertRaises(AttributeError):
+            bond.schedule.amounts = None
+        with self.assertRaises(ValueError):
+            bond.schedule.amounts[0, 0] = 1.0
+        self.assertAlmostEqual(bond.price(0.04), price_bond(100, 0.05, 5, 0.04, 1))
+        for restored in (pickle.loads(pickle.dumps(bond)), copy.deepcopy(bond)):
+            self.assertAlmostEqual(restored.price(0.04), bond.price(0.04))
+            np.testing.assert_array_equal(restored.schedule.amounts, bond.schedule.amounts)
+            with self.assertRaises(ValueError):
+                restored.schedule.amounts[0, 0] = 1.0
+        subset = CashFlowSchedule([100, 100], [0.05, 0.03], [5, 2], [1, 2]).take([1])
+        np.testing.assert_array_equal(pickle.loads(pickle.dumps(subset)).price(0.04), subset.price(0.04))
+
+class TestYieldSolver(unittest.TestCase):
+
+    def test_round_trips_prices(self):
+        rng = np.random.default_rng(1)
+        n = 2000
+        coupon = rng.uniform(0, 0.1, n)
+        maturity = rng.uniform(1, 30, n)
+        freq = rng.choice([1, 2, 4], n)
+        true_yield = rng.uniform(-0.01, 0.15, n)
+        prices = price_bonds(100, coupon, maturity, true_yield, freq)
+        result = yield_to_maturity(prices, 100, coupon, maturity, freq)
+        self.assertTrue(result['converged'].all())
+        np.testing.assert_allclose(result['yield'], true_yield, atol=1e-8)
+
+    def test_bisection_fallback_and_unbracketed_price(self):
+        # One Newton step is not enough, so the bisection fallback has to finish the job
+        result = yield_to_maturity([90.0, 1e6], 100, 0.05, 10, 1, max_iter=1)
+        self.assertTrue(result['bisection'].all())
+        self.assertTrue(result.loc[0, 'converged'])
+        self.assertAlmostEqual(price_bond(100, 0.05, 10, result.loc[0, 'yield'], 1), 90.0, places=6)
+        self.assertFalse(result.loc[1, 'converged'])
+        self.assertTrue(np.isnan(result.loc[1, 'yield']))
+
+    def test_yield_to_worst_picks_lowest_call(self):
+        # Premium callable: calling early is worst for the holder
+        price = price_bond(100, 0.08, 10, 0.05, 2)
+        result = yield_to_worst([price, price], 100, 0.08, 10, 2, call_dates=[[3, 5], [np.nan, np.nan]])
+        ytc = yield_to_maturity(price, 100, 0.08, 3, 2)['yield'][0]
+        self.assertAlmostEqual(result.loc[0, 'yield_to_worst'], ytc)
+        self.assertEqual(result.loc[0, 'worst_date'], 3)
+        self.assertAlmostEqual(result.loc[1, 'yield_to_worst'], 0.05)
+        self.assertEqual(result.loc[1, 'worst_date'], 10)
+        self.assertTrue(result['converged'].all())
+        # A call yield outside the solver's bracket must not be dropped from the minimum silently
+        result = yield_to_worst(price, 100, 0.08, 10, 2, call_dates=[[3, 5]], call_prices=[[1e7, 100]])
+        self.assertFalse(result.loc[0, 'converged'])
+        self.assertTrue(np.isnan(result.loc[0, 'yield_to_worst']))
+        self.assertTrue(np.isnan(result.loc[0, 'worst_date']))
+        self.assertAlmostEqual(result.loc[0, 'yield_to_maturity'], 0.05)
+
+if __name__ == '__main__':
+    unittest.main()
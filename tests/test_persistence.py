@@ -0,0 +1,138 @@
+import io
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from src.fixed_income import BondBook
+from src.persistence import STATE_SCHEMA_VERSION, SessionJournal, _mmap_npz, decode, encode, load_state, save_state
+from src.portfolio import Portfolio, TradeLedger
+
+class TestSessionJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'session')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encoding_keeps_types(self):
+        value = {'time': pd.Timestamp('2024-01-02 03:04:05.123456'), 'n': np.int64(3),
+                 'array': np.array([1.5, 2.5]), 'times': np.array(['2024-01-01'], dtype='datetime64[ns]')}
+        restored = decode(encode(value))
+        self.assertEqual(restored['time'], value['time'])
+        self.assertEqual(restored['n'], 3)
+        np.testing.assert_array_equal(restored['array'], value['array'])
+        self.assertEqual(restored['times'].dtype, np.dtype('datetime64[ns]'))
+
+    def test_restore_is_snapshot_plus_tail(self):
+        journal = SessionJournal(self.path, sync_every=2, compact_every=3)
+        journal.compact({'cash': 0.0})
+        values = []
+        for i in range(8):
+            journal.append({'type': 'cash', 'value': float(i)})
+            values.append(float(i))
+            if journal.needs_compaction:
+                journal.compact({'cash': float(i)})
+        state, tail = journal.load()
+        self.assertEqual(state, {'cash': 5.0})
+        self.assertEqual([record['value'] for record in tail], [6.0, 7.0])
+        journal.close()
+        with open(journal.journal_path, 'a', encoding='utf-8') as f:
+            f.write('[9,{"type":"cash","val')  # torn write
+        reopened = SessionJournal(self.path)
+        self.assertEqual(reopened.seq, 8)
+        self.assertEqual(len(reopened.load()[1]), 2)
+        for i in range(8, 11):
+            reopened.append({'type': 'cash', 'value': float(i)})
+        self.assertEqual([record['value'] for record in reopened.load()[1]], [6.0, 7.0, 8.0, 9.0, 10.0])
+        reopened.compact({'cash': 10.0}, background=False)
+        reopened.append({'type': 'cash', 'value': 11.0})
+        reopened.close()
+        restored = SessionJournal(self.path)
+        state, tail = restored.load()
+        self.assertEqual(state, {'cash': 10.0})
+        self.assertEqual([record['value'] for record in tail], [11.0])
+        restored.close()
+
+    def test_ledger_restores_from_snapshot_and_journal(self):
+        portfolio = Portfolio([('A', 10, 100.0)])
+        ledger = TradeLedger(portfolio, ['A', 'B'])
+        journal = SessionJournal(self.path)
+        ledger.buy('B', 5, 50.0)
+        journal.compact({'ledger': {name: column.to_numpy() for name, column in ledger.to_frame().astype({'kind': str}).items()},
+                         'book': portfolio.to_frame().to_dict(orient='list')}, background=False)
+        ledger.sell('A', 4, 110.0, kind='auto_sale')
+        ledger.undo()
+        for seq in (1, 2):
+            event = ledger.event(seq)
+            del event['asset']
+            journal.append({'type': 'event', **event})
+        state, tail = journal.load()
+        book = pd.DataFrame(state['book'])
+        restored = Portfolio([])
+        restored.assets = {['A', 'B'][i]: row.to_dict() for i, row in book.drop(columns='instrument_id').iterrows()}
+        rebuilt = TradeLedger.from_frame(pd.DataFrame(state['ledger']), ['A', 'B'], restored)
+        rebuilt.extend(tail)
+        self.assertEqual(restored.assets, portfolio.assets)
+        rebuilt.redo()
+        self.assertEqual(restored.assets['A']['quantity'], 6)
+        journal.close()
+
+
+class TestStateFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'state.npz')
+        self.book = BondBook.from_frame(pd.DataFrame({
+            'maturity': [2, 5, 10], 'coupon_rate': [0.05, 0.04, 0.03], 'price': [101, 99, 85], 'frequency': [1, 2, 2],
+            'call_date': [np.nan, 3, np.nan], 'sector': ['tech', 'real estate', 'tech'], 'id': [7, 8, 9]}))
+        self.portfolio = Portfolio(list(zip(self.book, [10, 20, 30])))
+        self.ledger = TradeLedger(self.portfolio, self.book)
+        self.ledger.sell(self.book[2], 5, 84.0, kind='auto_sale')
+        self.ledger.buy(self.book[0], 3, 101.0, kind='reinvestment')
+        self.ledger.undo()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_keeps_terms_positions_and_ledger(self):
+        for compress in (False, True):
+            save_state(self.path, self.book, self.portfolio, self.ledger, 125.5, ['sold'], compress=compress)
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            for source in (self.path, io.BytesIO(data)):
+                state = load_state(source)
+                book = state['book']
+                pd.testing.assert_frame_equal(book.to_frame(), self.book.to_frame())
+                self.assertEqual(book[1].sector, 'real estate')
+                self.assertTrue(book[1].callable)
+                self.assertEqual({view.id: values for view, values in state['portfolio'].assets.items()},
+                                 {view.id: values for view, values in self.portfolio.assets.items()})
+                self.assertEqual(state['reinvestable_money'], 125.5)
+                self.assertEqual(state['activity_feed'], ['sold'])
+                ledger = state['ledger']
+                self.assertIs(ledger.portfolio, state['portfolio'])
+                np.testing.assert_array_equal(ledger.undone(), self.ledger.undone())
+                ledger.redo()
+                self.assertEqual(state['portfolio'].assets[book[0]]['quantity'], 13)
+
+    def test_uncompressed_file_is_memory_mapped(self):
+        save_state(self.path, self.book, self.portfolio)
+        self.assertIsNone(load_state(self.path)['ledger'])
+        self.assertIsInstance(_mmap_npz(self.path)['book/maturity'], np.memmap)
+
+    def test_rejects_newer_schema(self):
+        save_state(self.path, self.book, self.portfolio)
+        with np.load(self.path) as archive:
+            arrays = dict(archive)
+        arrays['schema_version'] = np.int64(STATE_SCHEMA_VERSION + 1)
+        np.savez(self.path, **arrays)
+        with self.assertRaises(ValueError):
+            load_state(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
-from src.portfolio import Portfolio
+import numpy as np
+import pandas as pd
+from src.fixed_income import Bond, BondBook
+from src.portfolio import Portfolio, TradeLedger
 
 class TestPortfolio(unittest.TestCase):
 
@@ -27,5 +30,120 @@ class TestPortfolio(unittest.TestCase):
         total_value = self.portfolio.calculate_value(current_prices)
         self.assertEqual(total_value, 1500 + 5000)
 
+    def test_summary_against_flat_curve(self):
+        book = BondBook.from_frame(pd.DataFrame({'maturity': [2, 5, 10], 'coupon_rate': [0.05, 0.05, 0.03], 'price': [100, 100, 85]}))
+        portfolio = Portfolio(list(zip(book, [10, 20, 30])))
+        curve = pd.DataFrame({'maturity': [1, 30], 'spot_rate': [0.05, 0.05]})
+        summary = portfolio.summary(curve)
+        self.assertEqual(list(summary.index), [0, 1, 2])
+        self.assertAlmostEqual(summary.loc[1, 'Price'], 100.0)
+        self.assertAlmostEqual(summary['Weight %'].sum(), 100.0)
+        bond = Bond(100, 0.03, 10, 1)
+        self.assertAlmostEqual(summary.loc[2, 'Modified Duration'], bond.duration(0.05))
+        self.assertAlmostEqual(summary.loc[2, 'Convexity'], bond.convexity(0.05))
+        self.assertAlmostEqual(portfolio.total_value(curve), summary['Market Value'].sum())
+        self.assertAlmostEqual(portfolio.portfolio_dv01(curve), 10 * Bond(100, 0.05, 2, 1).dv01(0.05)
+                               + 20 * Bond(100, 0.05, 5, 1).dv01(0.05) + 30 * bond.dv01(0.05))
+
+    def test_array_store_grows_and_swaps_on_remove(self):
+        portfolio = Portfolio(capacity=2)
+        for i, name in enumerate(['A', 'B', 'C', 'D', 'E']):
+            portfolio.add_asset(name, i + 1, 10.0 * (i + 1))
+        self.assertEqual(len(portfolio), 5)
+        ids = dict(zip(portfolio.keys, portfolio.instrument_id.tolist()))
+        portfolio.remove_asset('B', 2)
+        self.assertEqual(portfolio.keys, ['A', 'E', 'C', 'D'])
+        self.assertEqual(portfolio.row('E'), 1)
+        np.testing.assert_array_equal(portfolio.quantity, [1, 5, 3, 4])
+        self.assertEqual(dict(zip(portfolio.keys, portfolio.instrument_id.tolist())), {k: ids[k] for k in portfolio.keys})
+        portfolio.add_asset('B', 1, 20.0)
+        self.assertEqual(portfolio.instrument_id[portfolio.row('B')], ids['B'])
+        with self.assertRaises(ValueError):
+            portfolio.remove_asset('Z', 1)
+        with self.assertRaises(ValueError):
+            portfolio.remove_asset('A', 2)
+
+    def test_value_from_price_array_and_round_trip(self):
+        book = BondBook(100, [0.05, 0.04, 0.03], [2, 5, 10], price=[101.0, 99.0, 90.0])
+        portfolio = Portfolio(list(zip(book, [10, 20, 30])))
+        portfolio.add_asset('AAPL', 5, 150)
+        portfolio.remove_asset(book[0], 10)
+        prices = np.array([101.0, 99.0, 90.0, 150.0])
+        self.assertEqual(portfolio.calculate_value(prices), 20 * 99 + 30 * 90 + 5 * 150)
+        self.assertEqual(portfolio.calculate_value({book[1]: 99.0, 'AAPL': 150}), 20 * 99 + 5 * 150)
+        frame = portfolio.to_frame()
+        restored = Portfolio.from_frame(frame, instruments={1: book[1], 2: book[2], 3: 'AAPL'})
+        self.assertEqual(restored.assets, portfolio.assets)
+        pd.testing.assert_frame_equal(restored.to_frame(), frame)
+        bonds_only = Portfolio.from_frame(frame[frame['instrument_id'] < 3], instruments=book)
+        self.assertEqual(bonds_only.keys, [book[1], book[2]])
+        self.assertEqual(len(bonds_only.bond_positions()[0]), 2)
+
+
+class TestTradeLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.portfolio = Portfolio([('AAPL', 10, 150.0)])
+        self.ledger = TradeLedger(self.portfolio, snapshot_every=3)
+        self.ledger.buy('GOOGL', 5, 1000.0)
+        self.ledger.sell('AAPL', 4, 160.0, kind='auto_sale')
+        self.ledger.buy('MSFT', 2, 300.0, kind='reinvestment')
+        self.ledger.sell('GOOGL', 5, 1100.0)
+
+    def test_undo_and_redo_reverse_positions(self):
+        closed = self.portfolio.assets
+        self.ledger.undo('trade')
+        self.assertEqual(self.portfolio.assets['GOOGL'], {'quantity': 5, 'price_per_unit': 1000.0, 'total_investment': 5000.0})
+        self.ledger.undo('auto_sale')
+        self.assertEqual(self.portfolio.assets['AAPL']['quantity'], 10)
+        self.ledger.undo()
+        self.assertNotIn('MSFT', self.portfolio)
+        np.testing.assert_array_equal(self.ledger.undone(), [False, True, True, True, False, False, False])
+        for _ in range(3):
+            self.ledger.redo()
+        self.assertEqual(self.portfolio.assets, closed)
+        self.assertIsNone(self.ledger.redo())
+        self.assertEqual(len(self.ledger), 10)
+
+    def test_new_event_clears_redo_and_bad_sales_raise(self):
+        self.ledger.undo()
+        self.ledger.buy('AAPL', 1, 150.0)
+        self.assertIsNone(self.ledger.redo())
+        with self.assertRaises(ValueError):
+            self.ledger.sell('AAPL', 100, 150.0)
+        with self.assertRaises(ValueError):
+            self.ledger.sell('TSLA', 1, 150.0)
+
+    def test_undo_of_a_position_closed_since_raises_and_keeps_ledger(self):
+        ledger = TradeLedger(Portfolio([]))
+        ledger.buy('AAPL', 5, 150.0)
+        ledger.sell('AAPL', 5, 160.0, kind='auto_sale')
+        self.assertEqual(ledger.undo_target('trade'), 0)
+        with self.assertRaises(ValueError):
+            ledger.undo('trade')
+        self.assertEqual(len(ledger), 2)
+        self.assertEqual(ledger.undo_target('trade'), 0)
+        self.assertFalse(ledger.undone().any())
+        # The auto-sale itself can still be undone, after which the trade can be too
+        ledger.undo('auto_sale')
+        ledger.undo('trade')
+        self.assertNotIn('AAPL', ledger.portfolio)
+        self.assertEqual(ledger.redo_target(), 0)
+
+    def test_replay_matches_live_book_at_every_point(self):
+        books = [self.ledger.portfolio_at(0).assets]
+        for step in (lambda: self.ledger.undo(), lambda: self.ledger.buy('MSFT', 3, 310.0), lambda: self.ledger.undo('auto_sale')):
+            step()
+            books.append(self.portfolio.assets)
+        self.assertEqual(books[0], {'AAPL': {'quantity': 10, 'price_per_unit': 150.0, 'total_investment': 1500.0}})
+        for seq, book in zip([0, 5, 6, 7], books):
+            self.assertEqual(self.ledger.portfolio_at(seq).assets, book)
+        rebuilt = TradeLedger.from_frame(self.ledger.to_frame(), self.ledger.assets, portfolio=self.ledger.portfolio_at(), snapshot_every=3)
+        for seq in range(len(self.ledger) + 1):
+            self.assertEqual(rebuilt.portfolio_at(seq).assets, self.ledger.portfolio_at(seq).assets)
+        rebuilt.undo('reinvestment')
+        self.assertEqual(rebuilt.portfolio.assets['MSFT']['quantity'], 3)
+
+
 if __name__ == '__main__':
-    unittest.main()
\ No newline at end of file
+    unittest.main()
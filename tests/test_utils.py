@@ -0,0 +1,78 @@
+import io
+import unittest
+import numpy as np
+import pandas as pd
+from src.portfolio import Portfolio
+from src.utils import ingest_positions, validate_positions
+
+CSV = """maturity,coupon_rate,price,position_notional,sector,call_date,frequency
+2,0.05,101,10,Tech,,2
+5,0.04,abc,20,Energy,3,
+-1,0.03,99,30,Tech,,
+10,0.03,85,,Real Estate,12,
+7,0.02,90,5,Crypto,,
+3,0.01,100,5, tech ,2,
+"""
+
+class TestIngestPositions(unittest.TestCase):
+
+    def test_row_level_errors_and_valid_rows_across_chunks(self):
+        progress = []
+        book, notionals, report = ingest_positions(io.StringIO(CSV), chunksize=4, known_sectors=['Tech', 'Energy', 'Real Estate'],
+                                                   progress=lambda rows, rate: progress.append(rows))
+        self.assertEqual(progress, [4, 6])
+        self.assertEqual((report['rows'], report['valid'], report['invalid']), (6, 2, 4))
+        self.assertEqual(report['errors'][['row', 'column', 'error']].values.tolist(), [
+            [1, 'price', 'not numeric'],
+            [2, 'maturity', 'must be > 0'],
+            [3, 'position_notional', 'missing'],
+            [3, 'call_date', 'must be in (0, maturity]'],
+            [4, 'sector', 'unknown sector'],
+        ])
+        np.testing.assert_array_equal(book.maturity, [2, 3])
+        np.testing.assert_array_equal(book.frequency, [2, 1])
+        np.testing.assert_array_equal(book.sector, ['Tech', 'tech'])
+        self.assertTrue(book[1].callable)
+        np.testing.assert_array_equal(notionals, [10, 5])
+        self.assertGreater(report['rows_per_sec'], 0)
+
+    def test_missing_required_column_rejects_file(self):
+        book, notionals, report = ingest_positions(io.StringIO("maturity,price\n1,100\n"))
+        self.assertIsNone(book)
+        self.assertEqual(len(notionals), 0)
+        self.assertEqual(report['errors']['column'].tolist(), ['coupon_rate', 'position_notional'])
+        self.assertEqual(report['valid'], 0)
+
+    def test_validate_coerces_to_schema(self):
+        chunk = pd.DataFrame({'maturity': ['1.5'], 'coupon_rate': ['0.02'], 'price': ['99'], 'position_notional': ['3'], 'id': ['7']})
+        clean, valid, errors = validate_positions(chunk)
+        self.assertTrue(valid.all())
+        self.assertTrue(errors.empty)
+        self.assertEqual(clean['maturity'].dtype, np.float64)
+
+    def test_ids_are_parsed_exactly(self):
+        ids = ['9007199254740993', '9007199254740992', '9223372036854775807', '9223372036854775808', '7.0', '7.5', 'x', None, '-012']
+        chunk = pd.DataFrame({'maturity': '1', 'coupon_rate': '0.02', 'price': '99', 'position_notional': '3', 'id': ids})
+        clean, valid, errors = validate_positions(chunk)
+        self.assertEqual(valid.tolist(), [True, True, True, False, True, False, False, False, True])
+        self.assertEqual(clean['id'][valid].tolist(), [9007199254740993, 9007199254740992, 2 ** 63 - 1, 7, -12])
+        self.assertEqual(errors[['row', 'error']].values.tolist(), [[6, 'not numeric'], [3, 'must be an integer'], [5, 'must be an integer'], [7, 'must be an integer']])
+        book, _, _ = ingest_positions(io.StringIO(chunk.dropna().to_csv(index=False)), chunksize=2)
+        self.assertEqual(book.id.tolist(), [9007199254740993, 9007199254740992, 2 ** 63 - 1, 7, -12])
+
+    def test_duplicate_ids_are_rejected_across_chunks(self):
+        csv = "maturity,coupon_rate,price,position_notional,id\n" + "".join(
+            f"{m},0.03,100,10,{i}\n" for m, i in [(1, 5), (2, 6), (-1, 7), (3, 5), (4, 7), (5, 6)])
+        book, notionals, report = ingest_positions(io.StringIO(csv), chunksize=2)
+        # The first valid row with an id keeps it; row 2 is invalid, so row 4 is the first valid 7
+        self.assertEqual(book.id.tolist(), [5, 6, 7])
+        np.testing.assert_array_equal(book.maturity, [1, 2, 4])
+        dupes = report['errors'][report['errors']['error'] == 'duplicate id']
+        self.assertEqual(dupes[['row', 'column']].values.tolist(), [[3, 'id'], [5, 'id']])
+        portfolio = Portfolio.from_frame(pd.DataFrame({'instrument_id': book.id, 'quantity': notionals, 'price_per_unit': book.price,
+                                                       'total_investment': notionals * book.price}), instruments=book)
+        self.assertEqual(len(portfolio), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()